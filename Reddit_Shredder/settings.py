@@ -32,10 +32,23 @@ ALLOWED_HOSTS = [
 ]
 
 # Application definition.
+
+# The cache holds state shared by every process: access tokens, revoked token
+# flags, the circuit breaker, history snapshots, exclusion versions, active
+# users and the metrics totals, roughly ten keys per Reddit account. Once
+# MAX_ENTRIES is reached the database cache drops expired keys and then the
+# alphabetically lowest 1 / CULL_FREQUENCY of the rest (access_token_*,
+# active_*, circuit_* first), so MAX_ENTRIES must stay well above the key
+# count.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
         'LOCATION': 'app_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('SHREDDER_CACHE_ENTRIES',
+                                              100000)),
+            'CULL_FREQUENCY': 10,
+        },
     }
 }
 
@@ -58,6 +71,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.query_budget.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'Reddit_Shredder.urls'
@@ -132,13 +146,160 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
 # Cron jobs.
 CRONJOBS = [
-    ('0 * * * *', 'app.reddit_connection.reddit_schedule.run_shredder'),
-    ('0 * * * *', 'app.reddit_connection.reddit_schedule.purge_db'),
+    ('*/5 * * * *', 'app.reddit_connection.reddit_schedule.run_shredder'),
+    ('15 * * * *', 'app.reddit_connection.reddit_schedule.purge_db'),
     ('0 0 * * *', 'app.cache_functions.cache_purge.purge'),
+    ('30 * * * *', 'app.reddit_connection.token_health.check_tokens'),
+    ('*/10 * * * *', 'app.cache_functions.snapshot_warmer.warm_snapshots'),
 ]
 
 # Reddit details.
 CLIENT_ID = ""
 CLIENT_SECRET = ""
 REDIRECT_URI = "https://redditshredder.joshharkema.com/authorize_callback"
-USER_AGENT = "Reddit Shredder v0.5.0(by /u/jharkema)"
\ No newline at end of file
+USER_AGENT = "Reddit Shredder v0.5.0(by /u/jharkema)"
+
+# Access tokens are refreshed this many seconds before they expire.
+ACCESS_TOKEN_REFRESH_MARGIN = 300
+
+# Tokens Reddit refused are failed fast (without asking Reddit) for this many
+# seconds, after which the next use or health check asks again.
+REVOKED_TOKEN_TTL = 86400
+
+# Token health checks (intervals in seconds).
+TOKEN_CHECK_INTERVAL = 86400
+TOKEN_CHECK_WORKERS = 8
+TOKEN_CHECK_RETRIES = 4
+TOKEN_CHECK_BACKOFF = 2
+
+# Shred runs resume from checkpoints younger than this (seconds).
+CHECKPOINT_MAX_AGE = 86400
+
+# Comments are overwritten with this marker plus a random string before they
+# are deleted, so a resumed run can tell which ones are already overwritten.
+OVERWRITE_MARKER = '[shredded] '
+
+# Retries for transient API errors (backoff in seconds, doubled per attempt.)
+RETRY_ATTEMPTS = 5
+RETRY_BACKOFF = 1
+
+# The circuit breaker opens after CIRCUIT_THRESHOLD transient errors within
+# CIRCUIT_WINDOW seconds and pauses all workers for CIRCUIT_COOLDOWN seconds.
+CIRCUIT_THRESHOLD = 10
+CIRCUIT_WINDOW = 60
+CIRCUIT_COOLDOWN = 30
+
+# The auto shredder runs every account once per SCHEDULE_PERIOD seconds, at a
+# stable slot within the period. Cron wakes it every SCHEDULER_TICK minutes
+# (must match the run_shredder cron entry) and each account is started up to
+# SLOT_JITTER seconds after its slot.
+SCHEDULE_PERIOD = 3600
+SCHEDULER_TICK = 5
+SLOT_JITTER = 30
+SHRED_WORKERS = 8
+
+# Per-account budgets for a scheduled run (seconds / API requests). A run that
+# runs out of budget saves its checkpoint and carries on at the next tick.
+SHRED_TIME_BUDGET = 600
+SHRED_REQUEST_BUDGET = 1000
+
+# Leases expire this many seconds after their last heartbeat.
+LEASE_TTL = 300
+
+# History snapshots (the item lists behind the delete and exclude pages.) A
+# snapshot younger than SNAPSHOT_TTL seconds is served as is, an older one is
+# topped up with the newest items, and one older than SNAPSHOT_MAX_AGE is
+# rebuilt from scratch. Bodies are cut to SNAPSHOT_BODY_LENGTH characters.
+SNAPSHOT_TTL = 900
+SNAPSHOT_MAX_AGE = 86400
+SNAPSHOT_BODY_LENGTH = 300
+
+# The snapshot warmer keeps the history snapshots of users active within the
+# last ACTIVE_USER_WINDOW seconds no older than WARM_FRESHNESS seconds, using
+# at most WARM_REQUEST_BUDGET API requests per run.
+ACTIVE_USER_WINDOW = 1800
+WARM_FRESHNESS = 600
+WARM_REQUEST_BUDGET = 200
+
+# Identical fetches that are already in flight are shared. Callers wait up to
+# SINGLE_FLIGHT_TIMEOUT seconds for the leader. A failed leader's error is
+# raised in the waiting processes for SINGLE_FLIGHT_FAILURE_TTL seconds.
+SINGLE_FLIGHT_TIMEOUT = 120
+SINGLE_FLIGHT_FAILURE_TTL = 30
+
+# Shred run output (the JSON results and SchedulerOutput rows) keeps at most
+# OUTPUT_BODY_LENGTH characters of each body, matching the sub_comment_body
+# column.
+OUTPUT_BODY_LENGTH = 1000
+
+# The shredder preview keeps the indexes of up to PREVIEW_INDEXES accounts in
+# memory, scores are indexed in sorted blocks of PREVIEW_BLOCK_SIZE items.
+PREVIEW_INDEXES = 100
+PREVIEW_BLOCK_SIZE = 256
+
+# History search keeps the indexes of up to SEARCH_INDEXES accounts in memory
+# and returns at most SEARCH_LIMIT results per query.
+SEARCH_INDEXES = 100
+SEARCH_LIMIT = 500
+
+# Largest page the DataTables endpoints will return.
+TABLE_MAX_LENGTH = 100
+
+# Default (and largest) page size of the records API.
+RECORDS_PAGE_SIZE = 100
+
+# Records older than a day are moved out of the DB into compressed per-user,
+# per-day archive files under ARCHIVE_DIR, and kept for ARCHIVE_DAYS days.
+ARCHIVE_DIR = os.environ.get('SHREDDER_ARCHIVE_DIR',
+                             os.path.join(BASE_DIR, 'archive'))
+ARCHIVE_DAYS = 90
+
+# Batch deletes from the delete page: at most DELETE_BATCH_MAX items per
+# request, with up to DELETE_WORKERS accounts handled at once.
+DELETE_BATCH_MAX = 100
+DELETE_WORKERS = 4
+
+# Most set / unset operations accepted by one exclusions batch.
+EXCLUDE_BATCH_MAX = 500
+
+# The bearer token the Prometheus server scrapes the /metrics/ endpoint with
+# (staff users can always see it.) Behind the reverse proxy every request comes
+# from 127.0.0.1, so the client address can't be trusted. Blank for staff only.
+METRICS_TOKEN = os.environ.get('SHREDDER_METRICS_TOKEN', '')
+
+# Profiled runs: every run of the RedditAccounts PKs in PROFILE_ACCOUNTS, staff
+# requests with profile=1 and a PROFILE_SAMPLE_RATE share of all runs. Reports
+# are stored in PROFILE_DIR, only the newest PROFILE_KEEP are kept.
+PROFILE_ACCOUNTS = ()
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_DIR = os.environ.get('SHREDDER_PROFILE_DIR',
+                             os.path.join(BASE_DIR, 'profiles'))
+PROFILE_KEEP = 200
+
+# The shredder's JSON line log, shared by the web and cron processes. Rotate
+# it with logrotate (without copytruncate), every process reopens the file
+# once it has been moved away.
+LOG_FILE = os.environ.get(
+    'SHREDDER_LOG_FILE', os.path.join(BASE_DIR, 'reddit_connection.log'))
+LOG_LEVEL = os.environ.get('SHREDDER_LOG_LEVEL', 'INFO')
+
+# The most DB queries a request may make before it is logged as over budget,
+# by URL name, QUERY_BUDGET for views not listed. The budgets include the
+# database cache's queries: a read is one query, a write to a cold key five
+# (count, savepoint, select, insert, release.)
+QUERY_BUDGET = 20
+QUERY_BUDGETS = {
+    'profile': 12,
+    'logs': 8,
+    'exclude': 10,
+    'authorize_callback': 10,
+}
+
+# Exclusion rule regexes run on shared worker threads, so they are kept cheap:
+# at most RULE_REGEX_MAX_LENGTH characters, no nested quantifiers or
+# backreferences, and each search is cut off after RULE_REGEX_TIMEOUT seconds.
+# Only the first RULE_BODY_LENGTH characters of a body are searched, matching
+# the snapshot's body length keeps the shredder preview exact.
+RULE_REGEX_MAX_LENGTH = 200
+RULE_REGEX_TIMEOUT = 0.05
+RULE_BODY_LENGTH = SNAPSHOT_BODY_LENGTH
@@ -25,16 +25,31 @@ urlpatterns = [
     url(r'^shredder/$', app.views.shredder, name='shredder'),
     url(r'^shredder/shred/$', app.views.shredder_output,
         name='shredder_output'),
+    url(r'^shredder/preview/$', app.views.shredder_preview,
+        name='shredder_preview'),
     url(r'^shredder/run/$', reddit_connection.run_shredder, name='run_shredder'),
     url(r'^profile/$', app.views.profile, name='profile'),
+    url(r'^metrics/$', app.views.metrics, name='metrics'),
     url(r'^profile/scheduler/$', reddit_schedule.change_schedule,
         name='scheduler'),
     url(r'^profile/privacy/$', app.views.privacy, name='privacy'),
     url(r'^profile/karma_limit/$', app.views.karma_exclude,
         name='karma_limit'),
+    url(r'^profile/rules/$', app.views.exclusion_rules,
+        name='exclusion_rules'),
     url(r'^profile/delete/$', app.views.delete, name='delete'),
+    url(r'^profile/delete/batch/$', app.views.delete_batch,
+        name='delete_batch'),
     url(r'^profile/logs/$', app.views.logs, name='logs'),
+    url(r'^profile/history/$', app.views.history_table,
+        name='history_table'),
+    url(r'^profile/logs/data/$', app.views.logs_table, name='logs_table'),
+    url(r'^profile/records/$', app.views.records_api, name='records'),
+    url(r'^profile/search/$', app.views.history_search,
+        name='history_search'),
     url(r'^profile/exclude/$', app.views.manual_exclude, name='exclude'),
+    url(r'^profile/exclude/batch/$', app.views.exclude_batch,
+        name='exclude_batch'),
     url(r'^profile/delete_account/$', app.views.delete_account,
         name='delete_account'),
     url(r'^changelog/$', app.views.changelog, name='changelog'),
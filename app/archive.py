@@ -0,0 +1,221 @@
+"""
+The archive tier for auto shredder records. purge_db moves records older than
+a day out of SchedulerOutput into one gzipped file per user per day, so the
+table stays small while the history stays readable.
+
+Each file holds its rows column by column (ids, run times, user names, item
+ids, bodies, statuses), newest first, which compresses far better than rows.
+A per-user index.json maps each archived day to its row count, so readers can
+skip whole days without opening them.
+"""
+
+import datetime
+import gzip
+import json
+import os
+import shutil
+from collections import defaultdict
+from datetime import timezone
+
+from Reddit_Shredder.settings import ARCHIVE_DAYS
+from Reddit_Shredder.settings import ARCHIVE_DIR
+
+# Rows moved out of the DB per query.
+BATCH_SIZE = 1000
+
+# The archived fields, in file column order.
+COLUMNS = (
+    'id',
+    'op_run_time',
+    'reddit_user_name',
+    'sub_comment_id',
+    'sub_comment_body',
+    'sub_comment_status',
+)
+
+
+def user_dir(user_id):
+    return os.path.join(ARCHIVE_DIR, str(int(user_id)))
+
+
+def day_path(user_id, day):
+    """
+    :param user_id: The user's PK.
+    :param day: The day, as YYYY-MM-DD.
+    :return: The path of the user's archive file for the day.
+    """
+    return os.path.join(user_dir(user_id), '{}.json.gz'.format(day))
+
+
+def write_atomic(path, data, compress=False):
+    """
+    Writes a file through a temporary file, so readers never see half of it.
+
+    :param path: The file path.
+    :param data: The bytes to write.
+    :param compress: True to gzip the data.
+    :return: Nothing.
+    """
+    temp = path + '.tmp'
+    opener = gzip.open if compress else open
+    with opener(temp, 'wb') as output:
+        output.write(data)
+    os.replace(temp, path)
+
+
+def load_index(user_id):
+    """
+    :param user_id: The user's PK.
+    :return: A dict of archived day (YYYY-MM-DD) -> row count.
+    """
+    try:
+        with open(os.path.join(user_dir(user_id), 'index.json')) as index:
+            return json.load(index)
+    except FileNotFoundError:
+        return {}
+
+
+def save_index(user_id, index):
+    write_atomic(os.path.join(user_dir(user_id), 'index.json'),
+                 json.dumps(index, sort_keys=True).encode('utf-8'))
+
+
+def read_day(user_id, day):
+    """
+    :param user_id: The user's PK.
+    :param day: The day, as YYYY-MM-DD.
+    :return: The day's rows as dicts, newest first.
+    """
+    try:
+        with gzip.open(day_path(user_id, day), 'rb') as archive:
+            columns = json.loads(archive.read().decode('utf-8'))
+    except FileNotFoundError:
+        return []
+
+    columns['op_run_time'] = [
+        datetime.datetime.fromtimestamp(moment, tz=timezone.utc)
+        for moment in columns['op_run_time']]
+
+    return [dict(zip(COLUMNS, row))
+            for row in zip(*(columns[name] for name in COLUMNS))]
+
+
+def write_day(user_id, day, rows):
+    """
+    Adds rows to a user's archive file for a day. Rows already in the file
+    (by id) are replaced, so archiving the same rows twice is harmless.
+
+    :param user_id: The user's PK.
+    :param day: The day, as YYYY-MM-DD.
+    :param rows: Row dicts with the COLUMNS keys.
+    :return: Nothing.
+    """
+    os.makedirs(user_dir(user_id), exist_ok=True)
+
+    merged = {row['id']: row for row in read_day(user_id, day)}
+    merged.update((row['id'], row) for row in rows)
+    ordered = sorted(merged.values(),
+                     key=lambda row: (row['op_run_time'], row['id']),
+                     reverse=True)
+
+    columns = {name: [row[name] for row in ordered] for name in COLUMNS}
+    columns['op_run_time'] = [moment.timestamp()
+                              for moment in columns['op_run_time']]
+
+    write_atomic(day_path(user_id, day),
+                 json.dumps(columns, separators=(',', ':')).encode('utf-8'),
+                 compress=True)
+
+    index = load_index(user_id)
+    index[day] = len(ordered)
+    save_index(user_id, index)
+
+
+def archive(rows):
+    """
+    Archives SchedulerOutput rows.
+
+    :param rows: Row dicts with user_id and the COLUMNS keys.
+    :return: Nothing.
+    """
+    days = defaultdict(list)
+    for row in rows:
+        day = row['op_run_time'].astimezone(timezone.utc).date().isoformat()
+        days[(row['user_id'], day)].append(row)
+
+    for (user_id, day), day_rows in days.items():
+        write_day(user_id, day, day_rows)
+
+
+def count(user_id):
+    """
+    :param user_id: The user's PK.
+    :return: The number of archived rows.
+    """
+    return sum(load_index(user_id).values())
+
+
+def iter_rows(user_id, skip=0, first_day=None, last_day=None):
+    """
+    Yields a user's archived rows, newest first.
+
+    :param user_id: The user's PK.
+    :param skip: Skip this many rows, whole days are skipped unread.
+    :param first_day: Only days from this one (YYYY-MM-DD) onwards.
+    :param last_day: Only days up to and including this one.
+    :return: A generator of row dicts.
+    """
+    for day, rows in sorted(load_index(user_id).items(), reverse=True):
+        if last_day is not None and day > last_day:
+            continue
+        if first_day is not None and day < first_day:
+            break
+
+        if skip >= rows:
+            skip -= rows
+            continue
+
+        for row in read_day(user_id, day)[skip:]:
+            yield row
+        skip = 0
+
+
+def remove(user_id):
+    """
+    Deletes all of a user's archived rows.
+
+    :param user_id: The user's PK.
+    :return: Nothing.
+    """
+    shutil.rmtree(user_dir(user_id), ignore_errors=True)
+
+
+def expire():
+    """
+    Deletes archive files older than ARCHIVE_DAYS.
+
+    :return: Nothing.
+    """
+    if not os.path.isdir(ARCHIVE_DIR):
+        return
+
+    oldest = (datetime.datetime.now(tz=timezone.utc) - datetime.timedelta(
+        days=ARCHIVE_DAYS)).date().isoformat()
+
+    for user_id in os.listdir(ARCHIVE_DIR):
+        if not user_id.isdigit():
+            continue
+
+        index = load_index(user_id)
+        expired = [day for day in index if day < oldest]
+        for day in expired:
+            del index[day]
+            try:
+                os.remove(day_path(user_id, day))
+            except FileNotFoundError:
+                pass
+
+        if not index:
+            shutil.rmtree(user_dir(user_id), ignore_errors=True)
+        elif expired:
+            save_index(user_id, index)
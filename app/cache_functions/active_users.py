@@ -0,0 +1,43 @@
+"""
+Tracks the users who have been active recently (logged in or opened their
+profile), so the snapshot warmer knows whose history to keep fresh. Each
+active user has a key of their own in the cache holding the time they were
+first seen in the current ACTIVE_USER_WINDOW, so concurrent requests never
+overwrite each other and a user is written at most once per window.
+"""
+
+import time
+
+from django.core.cache import cache
+
+from Reddit_Shredder.settings import ACTIVE_USER_WINDOW
+
+
+def active_key(user_id):
+    """
+    :param user_id: The user's PK.
+    :return: The cache key marking the user as active.
+    """
+    return 'active_{}'.format(user_id)
+
+
+def mark_active(user_id):
+    """
+    Records a user as active, unless they already are.
+
+    :param user_id: The user's PK.
+    :return: Nothing.
+    """
+    cache.add(active_key(user_id), time.time(), ACTIVE_USER_WINDOW)
+
+
+def active_users(user_ids):
+    """
+    :param user_ids: The user PKs to check.
+    :return: A dict of active user id -> the time they were seen.
+    """
+    user_ids = list(user_ids)
+    seen = cache.get_many([active_key(user_id) for user_id in user_ids])
+
+    return {user_id: seen[active_key(user_id)] for user_id in user_ids
+            if active_key(user_id) in seen}
@@ -0,0 +1,286 @@
+"""
+Per-account history snapshots. The delete and exclude pages used to walk an
+account's entire comment and submission history on every load, instead a
+compact copy of the history (id, type, created, score, truncated body and
+subreddit) is kept in the cache as compressed JSON.
+
+Snapshots younger than SNAPSHOT_TTL are served as is. Older ones are topped up
+by listing only the items newer than the newest one already known, and every
+SNAPSHOT_MAX_AGE seconds the snapshot is rebuilt to pick up score changes. Our
+own deletes remove the items from the snapshot straight away.
+"""
+
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from functools import partial
+
+from django.core.cache import cache
+
+from Reddit_Shredder.settings import SNAPSHOT_BODY_LENGTH
+from Reddit_Shredder.settings import SNAPSHOT_MAX_AGE
+from Reddit_Shredder.settings import SNAPSHOT_TTL
+from app.cache_functions.single_flight import single_flight
+from app.models import ShredCheckpoint
+from app.reddit_connection.client import reddit_client
+from app.reddit_connection.listing import PAGE_SIZE, fetch_page
+from app.reddit_connection.retry import call_with_retry
+
+HistoryItem = namedtuple('HistoryItem', [
+    'id',
+    'item_type',
+    'created',
+    'score',
+    'body',
+    'subreddit',
+])
+
+
+def snapshot_key(account_id):
+    """
+    :param account_id: The RedditAccounts PK.
+    :return: The cache key of the account's snapshot.
+    """
+    return 'history_{}'.format(account_id)
+
+
+def stamp_key(account_id):
+    """
+    :param account_id: The RedditAccounts PK.
+    :return: The cache key of the time the account's snapshot last changed.
+    """
+    return 'history_stamp_{}'.format(account_id)
+
+
+def flight_key(account_id):
+    """
+    :param account_id: The RedditAccounts PK.
+    :return: The single flight key of the account's snapshot refresh.
+    """
+    return 'history:{}'.format(account_id)
+
+
+def item_record(record):
+    """
+    Converts a listing record to a HistoryItem.
+
+    :param record: The listing.ItemRecord.
+    :return: A HistoryItem.
+    """
+    return HistoryItem(record.id,
+                       record.item_type,
+                       int(record.created),
+                       record.score,
+                       record.body,
+                       record.subreddit)
+
+
+def load(account_id):
+    """
+    Reads an account's snapshot from the cache.
+
+    :param account_id: The RedditAccounts PK.
+    :return: A dict with the fetched and built times and the items, or None.
+    """
+    blob = cache.get(snapshot_key(account_id))
+    if blob is None:
+        return None
+
+    snapshot = json.loads(zlib.decompress(blob).decode('utf-8'))
+    snapshot['items'] = [HistoryItem(*item) for item in snapshot['items']]
+    return snapshot
+
+
+def load_fresh(account_id):
+    """
+    Reads an account's snapshot from the cache if it doesn't need a refresh.
+
+    :param account_id: The RedditAccounts PK.
+    :return: The snapshot dict, or None if it is missing or stale.
+    """
+    snapshot = load(account_id)
+    if snapshot is None or time.time() - snapshot['fetched'] > SNAPSHOT_TTL:
+        return None
+    return snapshot
+
+
+def store(account_id, snapshot):
+    """
+    Writes an account's snapshot to the cache.
+
+    :param account_id: The RedditAccounts PK.
+    :param snapshot: The snapshot dict.
+    :return: Nothing.
+    """
+    blob = zlib.compress(json.dumps(snapshot,
+                                    separators=(',', ':')).encode('utf-8'))
+    cache.set_many({snapshot_key(account_id): blob,
+                    stamp_key(account_id): time.time()}, SNAPSHOT_MAX_AGE)
+
+
+def list_items(token, known=None, reddit_refresh=None):
+    """
+    Lists an account's comments and submissions, newest first.
+
+    :param token: The user's refresh token.
+    :param known: A set of ids already in the snapshot, listing stops at the
+                  first known item. None lists everything.
+    :param reddit_refresh: The Reddit object to list with, a new one from
+                           reddit_client if None.
+    :return: A list of HistoryItems.
+    """
+    if reddit_refresh is None:
+        reddit_refresh = reddit_client(token)
+
+    user_name = call_with_retry(reddit_refresh.user.me, token=token).name
+
+    items = []
+    for phase in (ShredCheckpoint.COMMENTS, ShredCheckpoint.SUBMISSIONS):
+        after = None
+        while True:
+            page = call_with_retry(fetch_page, reddit_refresh, user_name,
+                                   phase, after,
+                                   body_length=SNAPSHOT_BODY_LENGTH,
+                                   token=token)
+            new_items = [item_record(record) for record in page
+                         if known is None or record.id not in known]
+            items.extend(new_items)
+
+            # Stop at the end of the listing or at the first known item.
+            if len(page) < PAGE_SIZE or len(new_items) < len(page):
+                break
+            after = page[-1].fullname
+
+    return items
+
+
+def refresh(account_id, token, full=False, reddit_refresh=None):
+    """
+    Refreshes an account's snapshot.
+
+    :param account_id: The RedditAccounts PK.
+    :param token: The user's refresh token.
+    :param full: True to rebuild the snapshot from scratch.
+    :param reddit_refresh: The Reddit object to list with, see list_items.
+    :return: The refreshed snapshot.
+    """
+    now = time.time()
+    snapshot = None if full else load(account_id)
+
+    if snapshot is None or now - snapshot['built'] > SNAPSHOT_MAX_AGE:
+        snapshot = {'built': now,
+                    'items': list_items(token, reddit_refresh=reddit_refresh)}
+    else:
+        known = set(item.id for item in snapshot['items'])
+        snapshot['items'] = list_items(token, known, reddit_refresh) \
+            + snapshot['items']
+
+    snapshot['fetched'] = now
+    snapshot['items'].sort(key=lambda item: item.created, reverse=True)
+    store(account_id, snapshot)
+
+    return snapshot
+
+
+def snapshot_stamp(account_id):
+    """
+    A cheap check for changes, the stamp changes whenever the snapshot does.
+
+    :param account_id: The RedditAccounts PK.
+    :return: The time the snapshot was last written, or None.
+    """
+    return cache.get(stamp_key(account_id))
+
+
+def get_snapshot(account_id, token):
+    """
+    Returns an account's history, refreshing the snapshot if it is stale.
+
+    :param account_id: The RedditAccounts PK.
+    :param token: The user's refresh token.
+    :return: A list of HistoryItems, newest first.
+    """
+    snapshot = load_fresh(account_id)
+
+    # Concurrent page loads share one refresh.
+    if snapshot is None:
+        snapshot = single_flight(flight_key(account_id), refresh, account_id,
+                                 token, reload=partial(load_fresh, account_id))
+
+    return snapshot['items']
+
+
+def forget(account_ids):
+    """
+    Drops the snapshots of deleted accounts.
+
+    :param account_ids: The RedditAccounts PKs.
+    :return: Nothing.
+    """
+    cache.delete_many([key(account_id) for account_id in account_ids
+                       for key in (snapshot_key, stamp_key)])
+
+
+def remove_items(account_id, ids):
+    """
+    Drops deleted items from an account's snapshot.
+
+    :param account_id: The RedditAccounts PK.
+    :param ids: The deleted comment / submission ids.
+    :return: Nothing.
+    """
+    ids = set(ids)
+    snapshot = load(account_id)
+    if snapshot is None or not ids:
+        return
+
+    snapshot['items'] = [item for item in snapshot['items']
+                         if item.id not in ids]
+    store(account_id, snapshot)
+
+
+class IndexCache(object):
+    """
+    Keeps in-memory indexes built from history snapshots, one per account. An
+    index is rebuilt whenever the account's snapshot changes, and only the
+    most recently used indexes are kept.
+    """
+
+    def __init__(self, build, size):
+        """
+        :param build: Builds an index from a list of HistoryItems.
+        :param size: The number of indexes to keep.
+        """
+        self.build = build
+        self.size = size
+
+        # Account PK -> (snapshot stamp, index), least recently used first.
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, account_id, token):
+        """
+        :param account_id: The RedditAccounts PK.
+        :param token: The user's refresh token.
+        :return: The account's index.
+        """
+        stamp = snapshot_stamp(account_id)
+
+        with self._lock:
+            cached = self._indexes.get(account_id)
+            if cached is not None and stamp is not None \
+                    and cached[0] == stamp:
+                self._indexes.move_to_end(account_id)
+                return cached[1]
+
+        index = self.build(get_snapshot(account_id, token))
+
+        with self._lock:
+            self._indexes[account_id] = (snapshot_stamp(account_id), index)
+            self._indexes.move_to_end(account_id)
+            while len(self._indexes) > self.size:
+                self._indexes.popitem(last=False)
+
+        return index
@@ -0,0 +1,203 @@
+"""
+Indexes behind the shredder preview. The preview answers "how many comments
+and submissions would a run with these settings delete" while the user types,
+so it can't walk the history every time.
+
+Each item type is indexed from the account's history snapshot: the creation
+times sorted ascending, and the scores in the same order split into blocks
+that are each kept sorted. The items older than the cut-off are a prefix found
+by binary search, and the scores at or below the limit are counted with one
+binary search per whole block plus a scan of the last, partial block.
+
+The items a run would keep anyway are then taken back out. The verdict of the
+user's subreddit, score and text rules never changes, so it is worked out once
+per rule set and the items those rules don't keep get an index of their own,
+which the counts are taken from. Age rules keep a range of creation times,
+counted with the same binary searches, and excluded items are looked up one
+by one. A preview never walks the whole history.
+"""
+
+import time
+from bisect import bisect_left, bisect_right
+
+from Reddit_Shredder.settings import PREVIEW_BLOCK_SIZE
+from Reddit_Shredder.settings import PREVIEW_INDEXES
+from app.cache_functions.history_snapshot import IndexCache
+
+
+class TypeIndex(object):
+    """
+    The age and score index of a single item type.
+    """
+    __slots__ = ('created', 'scores', 'blocks')
+
+    def __init__(self, items):
+        """
+        :param items: The HistoryItems of one type.
+        """
+        items = sorted(items, key=lambda item: item.created)
+
+        self.created = [item.created for item in items]
+        self.scores = [item.score for item in items]
+        self.blocks = [sorted(self.scores[start:start + PREVIEW_BLOCK_SIZE])
+                       for start in range(0, len(items), PREVIEW_BLOCK_SIZE)]
+
+    def count(self, cutoff, karma_limit=None):
+        """
+        :param cutoff: Only items created before this (epoch seconds) count.
+        :param karma_limit: Only items scored at or below this count, None
+                            counts every score.
+        :return: The number of matching items.
+        """
+        return self._head(bisect_left(self.created, cutoff), karma_limit)
+
+    def count_between(self, first, last, cutoff, karma_limit):
+        """
+        :param first: Only items created at or after this count.
+        :param last: Only items created at or before this count.
+        :param cutoff: Only items created before this (epoch seconds) count.
+        :param karma_limit: Only items scored at or below this count.
+        :return: The number of matching items.
+        """
+        start = bisect_left(self.created, first)
+        end = min(bisect_right(self.created, last),
+                  bisect_left(self.created, cutoff))
+        if end <= start:
+            return 0
+
+        return self._head(end, karma_limit) - self._head(start, karma_limit)
+
+    def _head(self, end, karma_limit):
+        """
+        :param end: Only the first end items (by creation time) count.
+        :param karma_limit: Only items scored at or below this count, None
+                            counts every score.
+        :return: The number of matching items.
+        """
+        if karma_limit is None:
+            return end
+
+        whole, rest = divmod(end, PREVIEW_BLOCK_SIZE)
+
+        matches = sum(bisect_right(block, karma_limit)
+                      for block in self.blocks[:whole])
+        start = whole * PREVIEW_BLOCK_SIZE
+        matches += sum(1 for score in self.scores[start:start + rest]
+                       if score <= karma_limit)
+
+        return matches
+
+
+class HistoryIndex(object):
+    """
+    The preview index of a single account.
+    """
+
+    def __init__(self, items):
+        """
+        :param items: The account's HistoryItems.
+        """
+        self.types = self.index_types(items)
+
+        # Id -> HistoryItem, to take excluded items back out.
+        self.items = {item.id: item for item in items}
+
+        # (rule set key, types, items) of the items the last rule set's
+        # subreddit, score and text rules don't keep.
+        self._unruled = None
+
+    @staticmethod
+    def index_types(items):
+        """
+        :param items: HistoryItems.
+        :return: A dict of item type -> TypeIndex.
+        """
+        return {
+            item_type: TypeIndex([item for item in items
+                                  if item.item_type == item_type])
+            for item_type in ('Comment', 'Submission')
+        }
+
+    def unruled(self, rules):
+        """
+        Indexes the items the rules' subreddit, score and text rules don't
+        keep, once per rule set.
+
+        :param rules: The user's exclusion_rules.RuleMatcher, or None.
+        :return: A dict of item type -> TypeIndex and a dict of id ->
+                 HistoryItem.
+        """
+        if rules is None or rules.empty:
+            return self.types, self.items
+
+        cached = self._unruled
+        if cached is None or cached[0] != rules.key:
+            items = [item for item in self.items.values()
+                     if not rules.keeps_content(item)]
+            cached = self._unruled = (rules.key, self.index_types(items),
+                                      {item.id: item for item in items})
+
+        return cached[1], cached[2]
+
+    def preview(self, keep, karma_limit, everything=False,
+                excluded=frozenset(), rules=None):
+        """
+        Counts the items a manual run with the given settings would delete,
+        the same ones exclusion_rules.manual_selects picks. Rules see the
+        snapshot's bodies, cut to SNAPSHOT_BODY_LENGTH.
+
+        :param keep: The time cut-off in hours.
+        :param karma_limit: Items at or below this score are deleted.
+        :param everything: True to delete everything.
+        :param excluded: The ids of the user's excluded items.
+        :param rules: The user's exclusion_rules.RuleMatcher.
+        :return: A dict of item type -> count, plus the number of items
+                 (Kept) the settings would delete if not for the user's
+                 exclusions.
+        """
+        if everything:
+            counts = {item_type: index.count(float('inf'))
+                      for item_type, index in self.types.items()}
+            counts['Kept'] = 0
+            return counts
+
+        now = time.time()
+        cutoff = now - keep * 3600
+        selected = sum(index.count(cutoff, karma_limit)
+                       for index in self.types.values())
+
+        types, items = self.unruled(rules)
+        counts = {item_type: index.count(cutoff, karma_limit)
+                  for item_type, index in types.items()}
+
+        # Each age band keeps the items created within a range of times.
+        ages = rules.ages if rules is not None and not rules.empty else None
+        if ages:
+            for low, high in zip(ages.starts, ages.ends):
+                for item_type, index in types.items():
+                    counts[item_type] -= index.count_between(
+                        now - high * 3600, now - low * 3600, cutoff,
+                        karma_limit)
+
+        for item_id in excluded:
+            item = items.get(item_id)
+            if item is not None and item.created < cutoff \
+                    and item.score <= karma_limit \
+                    and not (ages and rules.keeps_age(item, now)):
+                counts[item.item_type] -= 1
+
+        counts['Kept'] = selected - sum(counts.values())
+        return counts
+
+
+# Kept until the account's history snapshot changes.
+_indexes = IndexCache(HistoryIndex, PREVIEW_INDEXES)
+
+
+def get_index(account_id, token):
+    """
+    :param account_id: The RedditAccounts PK.
+    :param token: The user's refresh token.
+    :return: The account's HistoryIndex.
+    """
+    return _indexes.get(account_id, token)
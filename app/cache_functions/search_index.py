@@ -0,0 +1,180 @@
+"""
+Full text search over an account's history snapshot, so the delete and exclude
+pages can find an item without shipping the whole history to the browser.
+
+The index is an in-process inverted index: token -> positions of the items
+that contain it, with positions in snapshot order (newest first.) Words in a
+query match as prefixes (so results update while the user types), quoted
+phrases must appear as is, and results can be limited to a subreddit. The
+items are also kept presorted by age, score and body, so the paged tables can
+serve any page of an unfiltered history without sorting it.
+"""
+
+import re
+from bisect import bisect_left
+
+from Reddit_Shredder.settings import SEARCH_INDEXES
+from app.cache_functions.history_snapshot import IndexCache
+
+# Words, and "quoted phrases", in a query.
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+WORD_PATTERN = re.compile(r'\w+')
+
+# Sort orders -> the HistoryItem value sorted on.
+SORT_FIELDS = {
+    'created': lambda item: item.created,
+    'score': lambda item: item.score,
+    'body': lambda item: item.body.lower(),
+}
+
+
+def tokenize(text):
+    """
+    :param text: A body, title or query.
+    :return: The lower case words in the text.
+    """
+    return WORD_PATTERN.findall(text.lower())
+
+
+class SearchIndex(object):
+    """
+    The search index of a single account.
+    """
+
+    def __init__(self, items):
+        """
+        :param items: The account's HistoryItems, newest first.
+        """
+        self.items = items
+
+        # Normalized text of each item, for checking phrases.
+        self.texts = []
+
+        postings = {}
+        self.subreddits = {}
+        for position, item in enumerate(items):
+            tokens = tokenize(item.body)
+            self.texts.append(' {} '.format(' '.join(tokens)))
+
+            for token in set(tokens):
+                postings.setdefault(token, []).append(position)
+            self.subreddits.setdefault(item.subreddit.lower(), []).append(
+                position)
+
+        self.postings = postings
+
+        # Sorted vocabulary, for prefix lookups.
+        self.vocabulary = sorted(postings)
+
+        # Every position in each sort order, ascending.
+        self.orders = {
+            order: sorted(range(len(items)), key=self.sort_key(order))
+            for order in SORT_FIELDS
+        }
+
+    def sort_key(self, order):
+        """
+        :param order: A SORT_FIELDS key.
+        :return: A function mapping a position to its sort value.
+        """
+        get = SORT_FIELDS[order]
+        return lambda position: get(self.items[position])
+
+    def prefix_matches(self, prefix):
+        """
+        :param prefix: A lower case word prefix.
+        :return: The set of positions containing a word with the prefix.
+        """
+        matches = set()
+
+        start = bisect_left(self.vocabulary, prefix)
+        for token in self.vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            matches.update(self.postings[token])
+
+        return matches
+
+    def matches(self, query, subreddit=None):
+        """
+        :param query: Words (matched as prefixes) and "quoted phrases", all of
+                      which must match.
+        :param subreddit: Only match items from this subreddit.
+        :return: The matching positions in snapshot order, or None if there
+                 is nothing to match on (everything matches.)
+        """
+        phrases = []
+        candidates = None
+
+        # Every word and phrase must match.
+        for phrase, word in QUERY_PATTERN.findall(query):
+            tokens = tokenize(phrase or word)
+            if not tokens:
+                continue
+
+            if phrase:
+                phrases.append(' {} '.format(' '.join(tokens)))
+                words = [set(self.postings.get(token, ()))
+                         for token in tokens]
+            else:
+                words = [self.prefix_matches(token) for token in tokens]
+
+            for matches in words:
+                candidates = matches if candidates is None \
+                    else candidates & matches
+
+        if subreddit:
+            matches = set(self.subreddits.get(subreddit.lower(), ()))
+            candidates = matches if candidates is None \
+                else candidates & matches
+
+        if candidates is None:
+            return None
+
+        return [position for position in sorted(candidates)
+                if all(phrase in self.texts[position] for phrase in phrases)]
+
+    def search(self, query, subreddit=None, limit=None):
+        """
+        :param query: See matches.
+        :param subreddit: Only return items from this subreddit.
+        :param limit: Return at most this many items.
+        :return: The matching HistoryItems, newest first.
+        """
+        positions = self.matches(query, subreddit)
+        if positions is None:
+            positions = range(len(self.items))
+
+        return [self.items[position] for position in positions[:limit]]
+
+    def ordered(self, positions, order, descending=False):
+        """
+        Sorts matches. Without a search the presorted order is used as is, so
+        paging through it costs nothing.
+
+        :param positions: Positions from matches (None for every item.)
+        :param order: A SORT_FIELDS key.
+        :param descending: True to sort descending.
+        :return: An iterator of HistoryItems.
+        """
+        if positions is None:
+            positions = self.orders[order]
+            positions = reversed(positions) if descending else iter(positions)
+        else:
+            positions = sorted(positions, key=self.sort_key(order),
+                               reverse=descending)
+
+        return (self.items[position] for position in positions)
+
+
+# Kept until the account's history snapshot changes.
+_indexes = IndexCache(SearchIndex, SEARCH_INDEXES)
+
+
+def get_index(account_id, token):
+    """
+    :param account_id: The RedditAccounts PK.
+    :param token: The user's refresh token.
+    :return: The account's SearchIndex.
+    """
+    return _indexes.get(account_id, token)
@@ -0,0 +1,124 @@
+"""
+Request coalescing for expensive fetches. Concurrent callers asking for the
+same key attach to the one fetch already in flight and share its result,
+instead of each walking the same Reddit listing.
+
+Within a process the callers share a Future. Across processes the leader
+holds a short lived lock in the cache. The fetch already stores its result
+(the history snapshot), so waiters in other processes don't get a second copy
+through the cache, once the lock is gone they reload what the leader saved.
+If the leader failed its error is left behind for SINGLE_FLIGHT_FAILURE_TTL
+seconds and the waiters raise it too, rather than all retrying the fetch at
+once.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from django.core.cache import cache
+
+from Reddit_Shredder.settings import SINGLE_FLIGHT_FAILURE_TTL
+from Reddit_Shredder.settings import SINGLE_FLIGHT_TIMEOUT
+
+# Seconds between checks for another process's result.
+POLL_INTERVAL = 0.5
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+class FlightFailed(Exception):
+    """
+    The fetch failed in the process that was running it.
+    """
+    pass
+
+
+def lock_key(key):
+    return 'flight_lock_{}'.format(key)
+
+
+def failure_key(key, token):
+    return 'flight_failed_{}_{}'.format(key, token)
+
+
+def single_flight(key, func, *args, reload, **kwargs):
+    """
+    Calls func, unless a call for the same key is already in flight, in which
+    case its result is returned instead.
+
+    :param key: Identifies the fetch, e.g. 'history:<account id>'.
+    :param func: The fetch. It must store its result where reload finds it.
+    :param reload: Called without arguments, returns the result a finished
+                   fetch stored or None if there isn't a usable one.
+    :return: The fetch's result. Exceptions raised by the fetch are raised in
+             every caller in the same process, callers in other processes get
+             a FlightFailed.
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+
+    # Another thread is already on it.
+    if not leader:
+        return future.result(timeout=SINGLE_FLIGHT_TIMEOUT)
+
+    try:
+        future.set_result(_fetch_across_processes(key, func, reload, *args,
+                                                  **kwargs))
+    except BaseException as err:
+        future.set_exception(err)
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+
+    return future.result()
+
+
+def _fetch_across_processes(key, func, reload, *args, **kwargs):
+    """
+    Runs func under the key's cache lock, or waits for the process holding
+    the lock to finish and reloads its result.
+
+    :return: The fetch's result.
+    """
+    deadline = time.time() + SINGLE_FLIGHT_TIMEOUT
+
+    while time.time() < deadline:
+        token = uuid.uuid4().hex
+
+        # We are the leader, run the fetch.
+        if cache.add(lock_key(key), token, SINGLE_FLIGHT_TIMEOUT):
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:
+                cache.set(failure_key(key, token),
+                          '{}: {}'.format(type(err).__name__, err),
+                          SINGLE_FLIGHT_FAILURE_TTL)
+                raise
+            finally:
+                cache.delete(lock_key(key))
+
+        # Wait for the leader's lock to go away.
+        leader_token = cache.get(lock_key(key))
+        while leader_token is not None and time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+            if cache.get(lock_key(key)) != leader_token:
+                break
+
+        if leader_token is not None:
+            failure = cache.get(failure_key(key, leader_token))
+            if failure is not None:
+                raise FlightFailed(failure)
+
+        result = reload()
+        if result is not None:
+            return result
+
+        # Nothing usable was stored, the next add picks one new leader.
+
+    raise FlightFailed('Timed out waiting for {}.'.format(key))
@@ -0,0 +1,100 @@
+"""
+Background snapshot warmer. Runs via cron and refreshes the history snapshots
+of recently active users before they open the delete or exclude pages, so the
+first visit after a snapshot goes stale doesn't pay for the listing.
+
+The warmer is low priority: it runs one account at a time, stops once it has
+used WARM_REQUEST_BUDGET API requests and stays out of the way while the
+circuit breaker is open.
+"""
+
+import time
+from functools import partial
+
+from django.core.cache import cache
+
+from Reddit_Shredder.settings import WARM_FRESHNESS
+from Reddit_Shredder.settings import WARM_REQUEST_BUDGET
+from app import metrics
+from app.cache_functions.active_users import active_users
+from app.cache_functions.history_snapshot import flight_key, load, load_fresh
+from app.cache_functions.history_snapshot import refresh
+from app.cache_functions.single_flight import single_flight
+from app.logger.exception_decor import exception
+from app.logger.exception_logger import logger
+from app.models import RedditAccounts
+from app.reddit_connection.client import reddit_client
+from app.reddit_connection.lease import Lease
+from app.reddit_connection.token_cache import TokenRevoked
+
+
+def is_fresh(account_id):
+    """
+    :param account_id: The RedditAccounts PK.
+    :return: True if the account's snapshot meets the freshness target.
+    """
+    snapshot = load(account_id)
+
+    return snapshot is not None \
+        and time.time() - snapshot['fetched'] < WARM_FRESHNESS
+
+
+@exception(logger)
+def warm_snapshots():
+    """
+    Refreshes the stale snapshots of recently active users, most recently
+    active first, until the request budget is used up.
+
+    :return: Nothing, writes directly to the cache.
+    """
+    # Runs don't overlap, a slow run just means the next one is skipped.
+    lease = Lease('snapshot_warmer')
+    if not lease.acquire():
+        return
+
+    try:
+        accounts = list(RedditAccounts.objects.filter(
+            token_valid=True).values_list('user_id', 'id', 'reddit_token'))
+        seen = active_users({account[0] for account in accounts})
+
+        accounts = sorted((account for account in accounts
+                           if account[0] in seen),
+                          key=lambda account: seen[account[0]], reverse=True)
+
+        requests = 0
+        warmed = 0
+        for user_id, account_id, token in accounts:
+            if requests >= WARM_REQUEST_BUDGET:
+                break
+
+            # Leave the API alone while the scheduler is backing off.
+            if cache.get('circuit_open_until', 0) > time.time():
+                break
+
+            if is_fresh(account_id):
+                continue
+
+            reddit_refresh = reddit_client(token)
+            try:
+                with metrics.job('warmer'):
+                    single_flight(flight_key(account_id), refresh, account_id,
+                                  token, reddit_refresh=reddit_refresh,
+                                  reload=partial(load_fresh, account_id))
+                warmed += 1
+            except TokenRevoked:
+                pass
+
+            # One bad account shouldn't stop the rest from being warmed.
+            except Exception:
+                logger.exception('Could not warm the snapshot of account %s.',
+                                  account_id)
+            finally:
+                requests += reddit_refresh._core.request_count
+
+            lease.heartbeat()
+
+        logger.info('Warmed %s snapshots using %s requests.', warmed,
+                    requests)
+        metrics.dump()
+    finally:
+        lease.release()
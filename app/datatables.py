@@ -0,0 +1,74 @@
+"""
+Helpers for DataTables' server-side processing protocol. The table sends the
+page it wants (draw, start, length), the sort column and direction and the
+search box; the server answers with just that page and the record counts.
+"""
+
+from collections import namedtuple
+
+from django.http import JsonResponse
+
+from Reddit_Shredder.settings import TABLE_MAX_LENGTH
+
+TableQuery = namedtuple('TableQuery', [
+    'draw',
+    'start',
+    'length',
+    'search',
+    'order',
+    'descending',
+])
+
+
+def int_param(params, name, default):
+    """
+    :return: The named parameter as an int, or the default if it is missing
+             or not a number.
+    """
+    try:
+        return int(params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse(params):
+    """
+    Reads a DataTables request.
+
+    :param params: The request's GET parameters.
+    :return: A TableQuery. order is the data name of the sort column (None if
+             the table isn't sorted) and length is capped at TABLE_MAX_LENGTH.
+    """
+    length = int_param(params, 'length', TABLE_MAX_LENGTH)
+    if length < 0 or length > TABLE_MAX_LENGTH:
+        length = TABLE_MAX_LENGTH
+
+    # The sort column is sent as an index, map it back to its data name.
+    order = None
+    column = int_param(params, 'order[0][column]', None)
+    if column is not None \
+            and params.get('columns[{}][orderable]'.format(column)) == 'true':
+        order = params.get('columns[{}][data]'.format(column))
+
+    return TableQuery(draw=int_param(params, 'draw', 0),
+                      start=max(int_param(params, 'start', 0), 0),
+                      length=length,
+                      search=params.get('search[value]', '').strip(),
+                      order=order,
+                      descending=params.get('order[0][dir]') == 'desc')
+
+
+def response(query, total, filtered, data):
+    """
+    :param query: The TableQuery being answered.
+    :param total: The number of records before searching.
+    :param filtered: The number of records matching the search.
+    :param data: The page's rows.
+    :return: A DataTables JsonResponse.
+    """
+    return JsonResponse({
+        'draw': query.draw,
+        'recordsTotal': total,
+        'recordsFiltered': filtered,
+        'data': data,
+    })
@@ -0,0 +1,107 @@
+"""
+Batch changes to a user's manual exclusions. Many set / unset operations are
+applied in one transaction against the unique (user_id, excluded_item_id)
+key, and every change bumps the user's exclusion version so anything holding
+a copy of the exclusions can tell it is out of date and patch it with the
+added and removed ids.
+"""
+
+import re
+import time
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from app.models import ExcludedItems
+
+# Longest id the excluded_item_id column holds.
+MAX_ID_LENGTH = 20
+
+# Reddit ids are base 36.
+ITEM_ID = re.compile('[0-9a-z]{{1,{}}}'.format(MAX_ID_LENGTH))
+
+
+def valid_id(item_id):
+    """
+    :param item_id: An item id from a request.
+    :return: True if it looks like a Reddit id that fits the column.
+    """
+    return isinstance(item_id, str) and ITEM_ID.fullmatch(item_id) is not None
+
+
+def version_key(user_id):
+    return 'exclusions_version_{}'.format(user_id)
+
+
+def exclusion_version(user_id):
+    """
+    :param user_id: The user's PK.
+    :return: The user's current exclusion version.
+    """
+    version = cache.get(version_key(user_id))
+    if version is not None:
+        return version
+
+    # The cache is cleared nightly, a lost version restarts from the current
+    # time so versions keep going up.
+    cache.add(version_key(user_id), int(time.time()), None)
+    return cache.get(version_key(user_id))
+
+
+def bump_version(user_id):
+    """
+    :param user_id: The user's PK.
+    :return: The new exclusion version.
+    """
+    exclusion_version(user_id)
+    try:
+        return cache.incr(version_key(user_id))
+    except ValueError:
+        # Cleared in between.
+        return exclusion_version(user_id)
+
+
+def apply_exclusions(user_id, set_ids=(), unset_ids=()):
+    """
+    Adds and removes exclusions in one transaction. Ids that are already set
+    (or not set) are left alone, an id in both lists ends up unset.
+
+    :param user_id: The user's PK.
+    :param set_ids: Item ids to exclude.
+    :param unset_ids: Item ids to stop excluding.
+    :return: A tuple of (version, added ids, removed ids.)
+    """
+    unset_ids = set(unset_ids)
+    set_ids = set(set_ids) - unset_ids
+
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                existing = set(ExcludedItems.objects.filter(
+                    user_id=user_id,
+                    excluded_item_id__in=set_ids | unset_ids).values_list(
+                    'excluded_item_id', flat=True))
+
+                added = set_ids - existing
+                removed = unset_ids & existing
+
+                ExcludedItems.objects.bulk_create(
+                    ExcludedItems(user_id=user_id, excluded_item_id=item_id)
+                    for item_id in added)
+                ExcludedItems.objects.filter(
+                    user_id=user_id,
+                    excluded_item_id__in=removed).delete()
+            break
+
+        # A concurrent request set some of the same ids, go again with them
+        # counted as existing.
+        except IntegrityError:
+            if attempt:
+                raise
+
+    if added or removed:
+        version = bump_version(user_id)
+    else:
+        version = exclusion_version(user_id)
+
+    return version, sorted(added), sorted(removed)
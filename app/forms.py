@@ -2,11 +2,14 @@
 Definition of forms.
 """
 
+import re
+
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.utils.translation import ugettext_lazy as _
 
 from app.models import *
+from app.reddit_connection.exclusion_rules import regex_problem
 
 
 class BootstrapAuthenticationForm(AuthenticationForm):
@@ -91,6 +94,78 @@ class KarmaExcludeForm(forms.ModelForm):
         }
 
 
+class ExclusionRuleForm(forms.ModelForm):
+    """
+    Allows user's to add automatic exclusion rules.
+    """
+
+    class Meta:
+        model = ExclusionRule
+        fields = ['kind', 'value', 'minimum', 'maximum']
+        labels = ({'kind': _('Rule'),
+                   'value': _('Subreddit, Keyword or Regex'),
+                   'minimum': _('From'),
+                   'maximum': _('To')})
+        widgets = {
+            'kind': forms.Select(attrs={
+                'class': 'form-control',
+            }),
+            'value': forms.TextInput(attrs={
+                'class': 'form-control',
+                'placeholder': 'Subreddit, keyword or regex',
+            }),
+            'minimum': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'placeholder': 'From',
+            }),
+            'maximum': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'placeholder': 'To',
+            }),
+        }
+
+    def clean(self):
+        """
+        Checks the fields the selected kind of rule needs.
+
+        :return: The cleaned data.
+        """
+        cleaned_data = super(ExclusionRuleForm, self).clean()
+        kind = cleaned_data.get('kind')
+        value = cleaned_data.get('value', '').strip()
+        minimum = cleaned_data.get('minimum')
+        maximum = cleaned_data.get('maximum')
+
+        if kind in (ExclusionRule.AGE, ExclusionRule.SCORE):
+            if minimum is None and maximum is None:
+                raise forms.ValidationError(_('Enter a lower or upper bound.'))
+            if minimum is not None and maximum is not None \
+                    and minimum > maximum:
+                raise forms.ValidationError(_('The bounds are reversed.'))
+            cleaned_data['value'] = ''
+
+        elif kind is not None:
+            if not value:
+                raise forms.ValidationError(
+                    _('Enter a subreddit, keyword or regex.'))
+            if kind == ExclusionRule.REGEX:
+                problem = regex_problem(value)
+                if problem is not None:
+                    raise forms.ValidationError(
+                        _('That regex can not be used, %(problem)s'),
+                        params={'problem': problem})
+
+            # Subreddits are stored without the r/ prefix.
+            if kind in (ExclusionRule.KEEP_SUBREDDIT,
+                        ExclusionRule.ONLY_SUBREDDIT):
+                value = re.sub(r'^/?r/', '', value)
+
+            cleaned_data['value'] = value
+            cleaned_data['minimum'] = cleaned_data['maximum'] = None
+
+        return cleaned_data
+
+
 class SchedulerForm(forms.ModelForm):
     """
     Allows user's to set auto-shred schedules for their accounts.
@@ -23,8 +23,9 @@ def exception(logger):
                 err += func.__name__
                 logger.exception(err)
 
-            # re-raise the exception
-            raise Exception
+                # re-raise the exception, keeping its type so callers can
+                # tell transient API errors from permanent ones.
+                raise
 
         return wrapper
 
@@ -1,7 +1,97 @@
 """
 Basic logger, used by the logging decorator.
+
+Logging calls never touch the disk: the logger's only handler puts records on
+an in-memory queue, and a listener thread writes them to LOG_FILE as JSON
+lines. If LOG_FILE can't be opened the records go to stderr instead.
+
+The web and cron processes all append to the same file, so none of them
+rotates it, that is left to logrotate, e.g.
+
+    /path/to/reddit_connection.log {
+        daily
+        rotate 10
+        compress
+        delaycompress
+        missingok
+    }
+
+Each process notices the file was moved away and reopens LOG_FILE.
 """
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import timezone
+
+from Reddit_Shredder.settings import LOG_FILE
+from Reddit_Shredder.settings import LOG_LEVEL
+
+# Attributes every LogRecord has, anything else was passed in extra= and is
+# written out as a field of its own.
+RECORD_ATTRIBUTES = frozenset(logging.LogRecord(
+    '', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single JSON line.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class EnqueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that leaves the formatting to the listener thread. Only the
+    message and any traceback are rendered up front, the arguments and the
+    exception objects may not outlive the call.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def file_handler():
+    """
+    :return: The handler for LOG_FILE, or a stderr handler if the file can't
+             be opened.
+    """
+    try:
+        os.makedirs(os.path.dirname(LOG_FILE) or '.', exist_ok=True)
+        return logging.handlers.WatchedFileHandler(LOG_FILE)
+
+    except OSError:
+        return logging.StreamHandler(sys.stderr)
 
 
 def create_logger():
@@ -9,18 +99,21 @@ def create_logger():
     Creates a logging object and returns it
     """
     logger = logging.getLogger("shredder_logger")
-    logger.setLevel(logging.INFO)
+    logger.setLevel(LOG_LEVEL)
+
+    # Records are written by the listener thread, off the callers' threads.
+    handler = file_handler()
+    handler.setFormatter(JsonFormatter())
 
-    # create the logging file handler
-    fh = logging.FileHandler(
-        "/var/www/redditshredder.joshharkema.com/reddit_connection.log")
+    # Unbounded, so logging never blocks the caller.
+    records = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
 
-    fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    formatter = logging.Formatter(fmt)
-    fh.setFormatter(formatter)
+    # Write out whatever is still queued when the process exits.
+    atexit.register(listener.stop)
 
-    # add handler to logger object
-    logger.addHandler(fh)
+    logger.addHandler(EnqueueHandler(records))
     return logger
 
 
@@ -0,0 +1,104 @@
+"""
+Lists, shows and diffs the profiles stored by app.profiling.
+
+    manage.py shred_profiles list
+    manage.py shred_profiles show <report>
+    manage.py shred_profiles diff <before> <after>
+"""
+
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.profiling import function_name, list_reports, load_report
+
+
+class Command(BaseCommand):
+    help = 'Lists, shows and diffs stored shred run profiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'show', 'diff'])
+        parser.add_argument('reports', nargs='*',
+                            help='Report names, one for show, two for diff.')
+        parser.add_argument('--limit', type=int, default=25,
+                            help='Reports / functions to print.')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        reports = options['reports']
+        limit = options['limit']
+
+        if action == 'list':
+            self.list_reports(limit)
+        elif action == 'show':
+            if len(reports) != 1:
+                raise CommandError('show takes one report name.')
+            self.show(reports[0], limit)
+        else:
+            if len(reports) != 2:
+                raise CommandError('diff takes two report names.')
+            self.diff(reports[0], reports[1], limit)
+
+    def load(self, name):
+        try:
+            return load_report(name)
+        except FileNotFoundError:
+            raise CommandError('No report named {}.'.format(name))
+
+    def list_reports(self, limit):
+        """
+        Prints the newest reports with their run metadata.
+        """
+        for name in list_reports()[:limit]:
+            metadata, stats = self.load(name)
+            self.stdout.write('{}  account={} {:.2f}s peak={:.1f}MiB{}'.format(
+                name,
+                metadata.get('account_id'),
+                metadata['duration'],
+                metadata['peak_memory'] / 2 ** 20,
+                ' FAILED' if metadata['failed'] else ''))
+
+    def show(self, name, limit):
+        """
+        Prints a report's metadata and its slowest functions.
+        """
+        metadata, stats = self.load(name)
+        for key, value in sorted(metadata.items()):
+            if key != 'top':
+                self.stdout.write('{}: {}'.format(key, value))
+
+        stats.stream = io.StringIO()
+        stats.sort_stats('cumulative').print_stats(limit)
+        self.stdout.write(stats.stream.getvalue())
+
+    def diff(self, before, after, limit):
+        """
+        Prints the functions whose cumulative time changed most between two
+        reports.
+        """
+        old_metadata, old_stats = self.load(before)
+        new_metadata, new_stats = self.load(after)
+
+        self.stdout.write('duration: {:.3f}s -> {:.3f}s'.format(
+            old_metadata['duration'], new_metadata['duration']))
+        self.stdout.write('peak memory: {:.1f}MiB -> {:.1f}MiB'.format(
+            old_metadata['peak_memory'] / 2 ** 20,
+            new_metadata['peak_memory'] / 2 ** 20))
+
+        # Function -> (calls, cumulative time) in each report.
+        old = {key: (row[1], row[3]) for key, row in old_stats.stats.items()}
+        new = {key: (row[1], row[3]) for key, row in new_stats.stats.items()}
+
+        changes = sorted(
+            old.keys() | new.keys(),
+            key=lambda key: abs(new.get(key, (0, 0))[1]
+                                - old.get(key, (0, 0))[1]),
+            reverse=True)[:limit]
+
+        self.stdout.write('{:>12} {:>12} {:>10} {:>10}  {}'.format(
+            'before', 'after', 'calls', 'calls', 'function'))
+        for key in changes:
+            old_calls, old_time = old.get(key, (0, 0))
+            new_calls, new_time = new.get(key, (0, 0))
+            self.stdout.write('{:>12.6f} {:>12.6f} {:>10} {:>10}  {}'.format(
+                old_time, new_time, old_calls, new_calls, function_name(key)))
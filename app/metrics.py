@@ -0,0 +1,301 @@
+"""
+Counters, gauges and latency histograms for the shredder's hot paths (API
+requests, page fetches, edits, deletes, DB flushes, queue wait and rate
+limiting), labelled by the kind of job doing the work.
+
+Recording a value is a dict update under a lock, cheap next to the API call it
+measures. Each process keeps its own values; dump() folds them into a shared
+total in the cache, which is what the /metrics/ endpoint serves in the
+Prometheus text format. Cron jobs dump at the end of every cycle.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from app.logger.exception_logger import logger
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# Name -> (type, help text), every metric has to be listed here.
+METRICS = {
+    'shredder_api_requests_total': (
+        COUNTER, 'Reddit API requests made.'),
+    'shredder_api_request_seconds': (
+        HISTOGRAM, 'Reddit API request latency, rate limit waits included.'),
+    'shredder_page_fetch_seconds': (
+        HISTOGRAM, 'Listing page fetch latency.'),
+    'shredder_edit_seconds': (
+        HISTOGRAM, 'Comment overwrite latency.'),
+    'shredder_delete_seconds': (
+        HISTOGRAM, 'Comment / submission delete latency.'),
+    'shredder_db_flush_seconds': (
+        HISTOGRAM, 'Latency of the per-page record and checkpoint writes.'),
+    'shredder_queue_wait_seconds': (
+        HISTOGRAM, 'Time from an account being due to a worker starting it.'),
+    'shredder_items_total': (
+        COUNTER, 'Items processed, by status.'),
+    'shredder_rate_limited_total': (
+        COUNTER, 'Requests rejected by Reddit for rate limiting.'),
+    'shredder_ratelimit_remaining': (
+        GAUGE, 'Requests left in the current rate limit window.'),
+}
+
+# Histogram bucket upper bounds (seconds.)
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300,
+           900)
+
+# The cache key of the shared totals and of the lock guarding them.
+TOTALS_KEY = 'metrics_totals'
+TOTALS_LOCK = 'metrics_totals_lock'
+
+# Seconds to wait for the totals lock before giving up on a dump.
+LOCK_TIMEOUT = 5
+
+_local = threading.local()
+
+
+def current_job():
+    """
+    :return: The kind of job running on this thread, 'web' by default.
+    """
+    return getattr(_local, 'job', 'web')
+
+
+@contextmanager
+def job(kind):
+    """
+    Labels the metrics recorded on this thread with a job kind.
+
+    :param kind: The job kind, e.g. 'scheduled' or 'manual'.
+    """
+    previous = getattr(_local, 'job', None)
+    _local.job = kind
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _local.job
+        else:
+            _local.job = previous
+
+
+def label_key(labels):
+    """
+    :param labels: A dict of labels, the job label is added if missing.
+    :return: The labels as a sorted tuple of pairs.
+    """
+    labels.setdefault('job', current_job())
+    return tuple(sorted(labels.items()))
+
+
+class Registry(object):
+    """
+    The values recorded in this process since the last dump.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # (name, labels) -> value, or [bucket counts, sum] for histograms.
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds to a counter.
+
+        :param name: The metric name.
+        :param value: The amount to add.
+        :param labels: The metric labels.
+        :return: Nothing.
+        """
+        key = (name, label_key(labels))
+        with self._lock:
+            self._counters[key] += value
+
+    def set(self, name, value, **labels):
+        """
+        Sets a gauge.
+
+        :param name: The metric name.
+        :param value: The new value.
+        :param labels: The metric labels.
+        :return: Nothing.
+        """
+        key = (name, label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Records a value in a histogram.
+
+        :param name: The metric name.
+        :param value: The observed value (seconds.)
+        :param labels: The metric labels.
+        :return: Nothing.
+        """
+        key = (name, label_key(labels))
+        bucket = bisect_left(BUCKETS, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [
+                    [0] * (len(BUCKETS) + 1), 0.0]
+            histogram[0][bucket] += 1
+            histogram[1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Records the time spent in the with block in a histogram.
+
+        :param name: The metric name.
+        :param labels: The metric labels.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def take(self):
+        """
+        Returns the values recorded since the last call and starts over.
+
+        :return: A dict of counters, gauges and histograms.
+        """
+        with self._lock:
+            values = {'counters': dict(self._counters),
+                      'gauges': self._gauges,
+                      'histograms': self._histograms}
+            self._reset()
+
+        return values
+
+
+registry = Registry()
+inc = registry.inc
+set_gauge = registry.set
+observe = registry.observe
+timer = registry.timer
+
+
+def merge(totals, values):
+    """
+    Adds the values taken from a registry to the totals.
+
+    :param totals: The totals, as stored in the cache.
+    :param values: The values from Registry.take.
+    :return: The totals.
+    """
+    for key, value in values['counters'].items():
+        totals['counters'][key] = totals['counters'].get(key, 0) + value
+
+    totals['gauges'].update(values['gauges'])
+
+    for key, (buckets, total) in values['histograms'].items():
+        merged = totals['histograms'].setdefault(
+            key, [[0] * (len(BUCKETS) + 1), 0.0])
+        merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+        merged[1] += total
+
+    return totals
+
+
+def load_totals():
+    """
+    :return: The totals of every process, from the cache.
+    """
+    return cache.get(TOTALS_KEY) or {'counters': {},
+                                     'gauges': {},
+                                     'histograms': {}}
+
+
+def dump(log=False):
+    """
+    Folds this process's values into the totals in the cache.
+
+    :param log: True to also log a summary of the counters dumped.
+    :return: Nothing.
+    """
+    values = registry.take()
+    if not any(values.values()):
+        return
+
+    if log:
+        logger.info('Metrics: %s', ', '.join(
+            '{}{} {:g}'.format(name, dict(labels), value)
+            for (name, labels), value in sorted(values['counters'].items())))
+
+    # Dumps from other processes must not overwrite each other.
+    deadline = time.time() + LOCK_TIMEOUT
+    while not cache.add(TOTALS_LOCK, 1, LOCK_TIMEOUT):
+        if time.time() > deadline:
+            logger.warning('Metrics totals locked, values dropped.')
+            return
+        time.sleep(0.05)
+
+    try:
+        cache.set(TOTALS_KEY, merge(load_totals(), values), None)
+    finally:
+        cache.delete(TOTALS_LOCK)
+
+
+def format_labels(labels, **extra):
+    """
+    :param labels: The label pairs.
+    :param extra: Labels to append, e.g. le for histogram buckets.
+    :return: The labels in the text format, e.g. {job="scheduled"}.
+    """
+    pairs = list(labels) + list(extra.items())
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace(
+        '\\', '\\\\').replace('"', '\\"')) for name, value in pairs) + '}'
+
+
+def render_text(totals):
+    """
+    Renders the totals in the Prometheus text exposition format.
+
+    :param totals: The totals, see load_totals.
+    :return: The text.
+    """
+    series = defaultdict(list)
+    for kind in ('counters', 'gauges', 'histograms'):
+        for (name, labels), value in totals[kind].items():
+            series[name].append((labels, value))
+
+    lines = []
+    for name in sorted(series):
+        kind, text = METRICS[name]
+        lines.append('# HELP {} {}'.format(name, text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+
+        for labels, value in sorted(series[name]):
+            if kind != HISTOGRAM:
+                lines.append('{}{} {:g}'.format(name, format_labels(labels),
+                                                value))
+                continue
+
+            buckets, total = value
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels, le=bound), cumulative))
+            lines.append('{}_sum{} {:g}'.format(name, format_labels(labels),
+                                                total))
+            lines.append('{}_count{} {}'.format(name, format_labels(labels),
+                                                cumulative))
+
+    return '\n'.join(lines) + '\n'
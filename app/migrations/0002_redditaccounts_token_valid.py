@@ -0,0 +1,18 @@
+# Generated by Django 2.0 on 2026-10-19 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='redditaccounts',
+            name='token_valid',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0 on 2026-10-19 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_redditaccounts_token_valid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='redditaccounts',
+            name='token_checked',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.0 on 2026-10-19 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_redditaccounts_token_checked'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShredCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.IntegerField(default=0)),
+                ('run_kind', models.CharField(max_length=9)),
+                ('params', models.CharField(max_length=100)),
+                ('phase', models.CharField(choices=[('Comments', 'Comments'), ('Submissions', 'Submissions'), ('Done', 'Done')], default='Comments', max_length=11)),
+                ('cursor', models.CharField(blank=True, max_length=20)),
+                ('processed_ids', models.TextField(blank=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='shredcheckpoint',
+            unique_together={('account_id', 'run_kind')},
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0 on 2026-10-19 12:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_shredcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='redditaccounts',
+            name='shred_latency',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shredcheckpoint',
+            name='due',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shredcheckpoint',
+            name='yielded',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.0 on 2026-10-19 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_shred_budgets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShredLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('owner', models.CharField(max_length=32)),
+                ('expires', models.DateTimeField()),
+            ],
+        ),
+    ]
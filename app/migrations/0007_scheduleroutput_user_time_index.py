@@ -0,0 +1,17 @@
+# Generated by Django 2.0 on 2026-10-19 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_shredlease'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scheduleroutput',
+            index=models.Index(fields=['user_id', 'op_run_time', 'id'], name='output_user_time_idx'),
+        ),
+    ]
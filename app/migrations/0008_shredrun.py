@@ -0,0 +1,38 @@
+# Generated by Django 2.0 on 2026-10-19 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_scheduleroutput_user_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShredRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.IntegerField()),
+                ('user_id', models.IntegerField()),
+                ('reddit_user_name', models.CharField(max_length=150)),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField()),
+                ('deleted', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('duration', models.FloatField(default=0)),
+                ('api_calls', models.IntegerField(default=0)),
+                ('completed', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='redditaccounts',
+            name='skipped_ids',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddIndex(
+            model_name='shredrun',
+            index=models.Index(fields=['user_id', 'finished'], name='run_user_finished_idx'),
+        ),
+    ]
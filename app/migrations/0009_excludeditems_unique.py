@@ -0,0 +1,37 @@
+# Generated by Django 2.0 on 2026-10-19 12:29
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Keeps the oldest row of every duplicated exclusion, so the unique
+    constraint can be added.
+    """
+    ExcludedItems = apps.get_model('app', 'ExcludedItems')
+
+    duplicates = ExcludedItems.objects.values(
+        'user_id', 'excluded_item_id').annotate(
+        keep=Min('id'), rows=Count('id')).filter(rows__gt=1)
+
+    for duplicate in duplicates:
+        ExcludedItems.objects.filter(
+            user_id=duplicate['user_id'],
+            excluded_item_id=duplicate['excluded_item_id']).exclude(
+            id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_shredrun'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='excludeditems',
+            unique_together={('user_id', 'excluded_item_id')},
+        ),
+    ]
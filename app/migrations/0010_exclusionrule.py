@@ -0,0 +1,24 @@
+# Generated by Django 2.0 on 2026-10-19 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_excludeditems_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExclusionRule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('kind', models.CharField(choices=[('Keep Subreddit', 'Keep everything in subreddit'), ('Only Subreddit', 'Only shred in subreddit'), ('Keyword', 'Keep items containing keyword'), ('Regex', 'Keep items matching regex'), ('Age', 'Keep items aged (hours) between'), ('Score', 'Keep items scored between')], max_length=14)),
+                ('value', models.CharField(blank=True, max_length=200)),
+                ('minimum', models.FloatField(blank=True, null=True)),
+                ('maximum', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -3,10 +3,13 @@ Custom db model definitions for Django.
 """
 
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
 from django.db import models
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from app.cache_functions.active_users import mark_active
+
 
 class Profile(models.Model):
     """
@@ -41,6 +44,13 @@ class SchedulerOutput(models.Model):
                                        blank=True
                                        )
 
+    class Meta:
+        # Serves the records pages, newest first per user.
+        indexes = [
+            models.Index(fields=['user_id', 'op_run_time', 'id'],
+                         name='output_user_time_idx'),
+        ]
+
 
 class RedditAccounts(models.Model):
     """
@@ -73,6 +83,20 @@ class RedditAccounts(models.Model):
         default=NONE,
     )
 
+    token_valid = models.BooleanField(default=True)
+
+    token_checked = models.DateTimeField(null=True,
+                                         blank=True)
+
+    # Seconds from the last scheduled run being due to it finishing.
+    shred_latency = models.FloatField(null=True,
+                                      blank=True)
+
+    # Comma separated ids of the items the last scheduled run skipped, only
+    # changes are logged so these aren't logged again.
+    skipped_ids = models.TextField(blank=True,
+                                   default='')
+
 
 class ExcludedItems(models.Model):
     """
@@ -83,6 +107,47 @@ class ExcludedItems(models.Model):
 
     excluded_item_id = models.CharField(max_length=20)
 
+    class Meta:
+        unique_together = ('user_id', 'excluded_item_id')
+
+
+class ExclusionRule(models.Model):
+    """
+    Model for the automatic exclusion rules. Items matching any of a user's
+    rules are kept by both shredders.
+    """
+    KEEP_SUBREDDIT = 'Keep Subreddit'
+    ONLY_SUBREDDIT = 'Only Subreddit'
+    KEYWORD = 'Keyword'
+    REGEX = 'Regex'
+    AGE = 'Age'
+    SCORE = 'Score'
+
+    CHOICES = (
+        (KEEP_SUBREDDIT, 'Keep everything in subreddit'),
+        (ONLY_SUBREDDIT, 'Only shred in subreddit'),
+        (KEYWORD, 'Keep items containing keyword'),
+        (REGEX, 'Keep items matching regex'),
+        (AGE, 'Keep items aged (hours) between'),
+        (SCORE, 'Keep items scored between'),
+    )
+
+    user_id = models.IntegerField()
+
+    kind = models.CharField(max_length=14,
+                            choices=CHOICES)
+
+    # The subreddit, keyword or regex.
+    value = models.CharField(max_length=200,
+                             blank=True)
+
+    # The band for age and score rules, either end may be open.
+    minimum = models.FloatField(null=True,
+                                blank=True)
+
+    maximum = models.FloatField(null=True,
+                                blank=True)
+
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -102,3 +167,109 @@ def create_user_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+
+@receiver(user_logged_in)
+def track_login(sender, request, user, **kwargs):
+    """
+    Marks the user as active so the snapshot warmer picks up their accounts.
+    """
+    mark_active(user.id)
+
+
+class ShredCheckpoint(models.Model):
+    """
+    Model stores the progress of an unfinished shred run, so a run that dies
+    half way through can be picked up where it left off.
+    """
+    SCHEDULED = 'Scheduled'
+    MANUAL = 'Manual'
+
+    COMMENTS = 'Comments'
+    SUBMISSIONS = 'Submissions'
+    DONE = 'Done'
+
+    PHASES = (
+        (COMMENTS, 'Comments'),
+        (SUBMISSIONS, 'Submissions'),
+        (DONE, 'Done'),
+    )
+
+    account_id = models.IntegerField(max_length=None,
+                                     default=0)
+
+    run_kind = models.CharField(max_length=9)
+
+    # The shredder settings the run was started with.
+    params = models.CharField(max_length=100)
+
+    phase = models.CharField(
+        max_length=11,
+        choices=PHASES,
+        default=COMMENTS,
+    )
+
+    # Fullname of the last item left standing in the listing.
+    cursor = models.CharField(max_length=20,
+                              blank=True)
+
+    processed_ids = models.TextField(blank=True)
+
+    # When the run was due and whether it ran out of budget and was re-queued.
+    due = models.DateTimeField(null=True,
+                               blank=True)
+
+    yielded = models.BooleanField(default=False)
+
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('account_id', 'run_kind')
+
+
+class ShredLease(models.Model):
+    """
+    Model stores the leases that keep two workers from shredding the same
+    account (or running the same scheduler tick) at the same time.
+    """
+    name = models.CharField(max_length=50,
+                            unique=True)
+
+    owner = models.CharField(max_length=32)
+
+    expires = models.DateTimeField()
+
+
+class ShredRun(models.Model):
+    """
+    Model stores a summary of every scheduled shred run. Item records are only
+    kept for deleted items and items whose status changed, the run row covers
+    the rest.
+    """
+    account_id = models.IntegerField()
+
+    user_id = models.IntegerField()
+
+    reddit_user_name = models.CharField(max_length=150)
+
+    started = models.DateTimeField()
+
+    finished = models.DateTimeField()
+
+    deleted = models.IntegerField(default=0)
+
+    skipped = models.IntegerField(default=0)
+
+    # Seconds and API requests the run used.
+    duration = models.FloatField(default=0)
+
+    api_calls = models.IntegerField(default=0)
+
+    # False if the run ran out of budget and carries on at the next tick.
+    completed = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'finished'],
+                         name='run_user_finished_idx'),
+        ]
@@ -0,0 +1,184 @@
+"""
+Opt-in profiling for shred runs and history loads. A profiled run is traced
+with cProfile and tracemalloc, and its report is stored under PROFILE_DIR as a
+pstats dump (<name>.prof) plus the run's metadata, peak memory and top
+functions (<name>.json). Use the shred_profiles management command to list,
+show and diff reports.
+
+Profiling is switched on for the accounts in PROFILE_ACCOUNTS, for staff
+requests carrying profile=1 and for a PROFILE_SAMPLE_RATE share of all runs.
+Only one run per process is profiled at a time, cProfile and tracemalloc are
+process wide and concurrent runs would muddle each other's numbers.
+"""
+
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import timezone
+
+from Reddit_Shredder.settings import PROFILE_ACCOUNTS
+from Reddit_Shredder.settings import PROFILE_DIR
+from Reddit_Shredder.settings import PROFILE_KEEP
+from Reddit_Shredder.settings import PROFILE_SAMPLE_RATE
+from app.logger.exception_logger import logger
+
+# Functions listed in each report's metadata, by cumulative time.
+TOP_FUNCTIONS = 25
+
+_active = threading.Lock()
+
+
+def wants_profile(account_id=None, request=None):
+    """
+    Decides whether a run is profiled.
+
+    :param account_id: The RedditAccounts PK being shredded, if any.
+    :param request: The HTTP request that started the run, if any.
+    :return: True to profile the run.
+    """
+    if account_id is not None and account_id in PROFILE_ACCOUNTS:
+        return True
+
+    if request is not None and request.user.is_staff \
+            and request.GET.get('profile', request.POST.get('profile')) == '1':
+        return True
+
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+def function_name(key):
+    """
+    :param key: A pstats function key, (file, line, function).
+    :return: A readable name, e.g. reddit_connection.py:250(shred_item).
+    """
+    filename, line, name = key
+    return '{}:{}({})'.format(os.path.basename(filename), line, name)
+
+
+def top_functions(stats, limit=TOP_FUNCTIONS):
+    """
+    :param stats: A pstats.Stats.
+    :param limit: The number of functions to return.
+    :return: The functions with the most cumulative time, as dicts.
+    """
+    rows = sorted(stats.stats.items(), key=lambda row: row[1][3],
+                  reverse=True)[:limit]
+
+    return [{'function': function_name(key),
+             'calls': calls,
+             'tottime': round(tottime, 6),
+             'cumtime': round(cumtime, 6)}
+            for key, (primitive, calls, tottime, cumtime, callers) in rows]
+
+
+def save_report(profiler, metadata):
+    """
+    Writes a profile and its metadata to PROFILE_DIR, then drops the oldest
+    reports past PROFILE_KEEP.
+
+    :param profiler: The stopped cProfile.Profile.
+    :param metadata: A dict describing the run.
+    :return: The report name.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    name = '{:%Y%m%d-%H%M%S}-{}-{}'.format(
+        datetime.datetime.now(tz=timezone.utc), metadata['kind'],
+        uuid.uuid4().hex[:8])
+    path = os.path.join(PROFILE_DIR, name)
+
+    profiler.dump_stats(path + '.prof')
+    metadata['top'] = top_functions(pstats.Stats(path + '.prof'))
+    with open(path + '.json', 'w') as file:
+        json.dump(metadata, file, indent=1, default=str)
+
+    for old in list_reports()[PROFILE_KEEP:]:
+        for extension in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old + extension))
+            except FileNotFoundError:
+                pass
+
+    return name
+
+
+def list_reports():
+    """
+    :return: The names of the stored reports, newest first.
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+
+    return sorted((filename[:-5] for filename in os.listdir(PROFILE_DIR)
+                   if filename.endswith('.json')), reverse=True)
+
+
+def load_report(name):
+    """
+    :param name: The report name.
+    :return: The report's metadata dict and its pstats.Stats.
+    """
+    path = os.path.join(PROFILE_DIR, name)
+    with open(path + '.json') as file:
+        metadata = json.load(file)
+
+    return metadata, pstats.Stats(path + '.prof')
+
+
+@contextmanager
+def profiled(kind, enabled, **metadata):
+    """
+    Profiles the with block if enabled, and stores the report.
+
+    :param kind: The kind of run, e.g. 'scheduled', 'manual' or 'history'.
+    :param enabled: True to profile, see wants_profile.
+    :param metadata: Anything else worth keeping with the report, e.g. the
+                     account id.
+    """
+    # Another run in this process is already being profiled.
+    if not enabled or not _active.acquire(blocking=False):
+        yield
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    memory_start = tracemalloc.get_traced_memory()[0]
+
+    metadata.update(kind=kind,
+                    started=datetime.datetime.now(tz=timezone.utc),
+                    failed=False)
+    profiler = cProfile.Profile()
+    start = time.monotonic()
+    profiler.enable()
+    try:
+        yield
+    except BaseException:
+        metadata['failed'] = True
+        raise
+    finally:
+        profiler.disable()
+        metadata['duration'] = round(time.monotonic() - start, 6)
+        metadata['peak_memory'] = tracemalloc.get_traced_memory()[1] \
+            - memory_start
+        if started_tracing:
+            tracemalloc.stop()
+
+        # A failed report must never fail the run itself.
+        try:
+            name = save_report(profiler, metadata)
+            logger.info('Stored profile %s.', name)
+        except Exception:
+            logger.exception('Could not store the %s profile.', kind)
+        finally:
+            _active.release()
@@ -0,0 +1,140 @@
+"""
+Per-request query and latency budgets. QueryBudgetMiddleware counts the DB
+queries, the time spent in them and the Reddit API requests made while
+handling a request, and sends the numbers back as X-DB-Queries, X-DB-Time,
+X-Reddit-Calls and X-Response-Time headers. Requests over their view's budget
+(QUERY_BUDGETS, or QUERY_BUDGET for views not listed) are logged as warnings
+with the numbers as log fields.
+
+Tests can hold views to a budget with assert_budget:
+
+    with assert_budget(queries=6, api_calls=0):
+        client.get('/profile/')
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+from Reddit_Shredder.settings import QUERY_BUDGET
+from Reddit_Shredder.settings import QUERY_BUDGETS
+from app.logger.exception_logger import logger
+
+_local = threading.local()
+
+
+class RequestStats(object):
+    """
+    The queries and API calls made on a thread while the stats are active.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.db_time = 0.0
+        self.api_calls = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        """
+        A connection.execute_wrapper, times and records each query.
+        """
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.monotonic() - start
+            self.queries.append(sql)
+
+    @contextmanager
+    def active(self):
+        """
+        Records the thread's queries and API calls in the with block.
+        """
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+
+        stack.append(self)
+        try:
+            with connection.execute_wrapper(self.record_query):
+                yield self
+        finally:
+            stack.remove(self)
+
+
+def count_api_call():
+    """
+    Counts a Reddit API request against every active RequestStats on this
+    thread. Called by client.CountingSession.
+
+    :return: Nothing.
+    """
+    for stats in getattr(_local, 'stack', ()):
+        stats.api_calls += 1
+
+
+class QueryBudgetMiddleware(object):
+    """
+    Reports each request's queries, DB time and Reddit API calls.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.monotonic()
+        with RequestStats().active() as stats:
+            response = self.get_response(request)
+        elapsed = time.monotonic() - start
+
+        response['X-DB-Queries'] = len(stats.queries)
+        response['X-DB-Time'] = '{:.1f}ms'.format(stats.db_time * 1000)
+        response['X-Reddit-Calls'] = stats.api_calls
+        response['X-Response-Time'] = '{:.1f}ms'.format(elapsed * 1000)
+
+        view = request.resolver_match.url_name \
+            if request.resolver_match is not None else None
+        budget = QUERY_BUDGETS.get(view, QUERY_BUDGET)
+        fields = {'view': view,
+                  'path': request.path,
+                  'queries': len(stats.queries),
+                  'db_time': round(stats.db_time, 4),
+                  'reddit_calls': stats.api_calls,
+                  'response_time': round(elapsed, 4)}
+
+        if len(stats.queries) > budget:
+            logger.warning('%s made %s queries, over its budget of %s.', view,
+                           len(stats.queries), budget, extra=fields)
+        else:
+            logger.debug('%s made %s queries.', view, len(stats.queries),
+                         extra=fields)
+
+        return response
+
+
+@contextmanager
+def assert_budget(queries=None, api_calls=None, db_time=None):
+    """
+    Fails with an AssertionError if the with block makes more queries or
+    Reddit API calls, or spends longer in the DB, than allowed.
+
+    :param queries: The most DB queries allowed, None for no limit.
+    :param api_calls: The most Reddit API requests allowed.
+    :param db_time: The most seconds allowed in DB queries.
+    :return: The RequestStats, for further checks.
+    """
+    with RequestStats().active() as stats:
+        yield stats
+
+    if queries is not None and len(stats.queries) > queries:
+        raise AssertionError('{} queries, the budget is {}:\n{}'.format(
+            len(stats.queries), queries, '\n'.join(stats.queries)))
+
+    if api_calls is not None and stats.api_calls > api_calls:
+        raise AssertionError('{} Reddit API calls, the budget is {}.'.format(
+            stats.api_calls, api_calls))
+
+    if db_time is not None and stats.db_time > db_time:
+        raise AssertionError('{:.3f}s in DB queries, the budget is {}s.'.format(
+            stats.db_time, db_time))
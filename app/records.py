@@ -0,0 +1,233 @@
+"""
+Keyset pagination for the auto shredder records. Pages are ordered newest
+first on (op_run_time, id) within a user, which the output_user_time_idx index
+serves directly, and each page ends with a cursor pointing after its last row.
+Fetching the next page is an index seek from the cursor, so it costs the same
+no matter how many records come before it.
+
+Records older than a day live in the archive (see archive.py), pages carry on
+into it seamlessly once the table runs out. Archived records keep their ids,
+so the same cursors work in both tiers.
+"""
+
+import base64
+import datetime
+import itertools
+from datetime import timezone
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from Reddit_Shredder.settings import RECORDS_PAGE_SIZE
+from app import archive
+from app.models import SchedulerOutput
+
+
+class BadCursor(ValueError):
+    """
+    Raised for cursors that weren't made by encode_cursor.
+    """
+
+
+def encode_cursor(run_time, record_id):
+    """
+    :param run_time: The op_run_time of the last row on the page.
+    :param record_id: The id of the last row on the page.
+    :return: An opaque cursor string.
+    """
+    raw = '{}|{}'.format(run_time.isoformat(), record_id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    :param cursor: A cursor from encode_cursor.
+    :return: A tuple of (op_run_time, id).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        run_time, record_id = raw.split('|')
+        run_time = parse_datetime(run_time)
+        record_id = int(record_id)
+    except (TypeError, ValueError, UnicodeError):
+        raise BadCursor(cursor)
+
+    if run_time is None:
+        raise BadCursor(cursor)
+
+    return run_time, record_id
+
+
+def parse_day(value, end=False):
+    """
+    :param value: A date (YYYY-MM-DD) or datetime string.
+    :param end: True to turn a bare date into the end of that day.
+    :return: An aware datetime, or None if value is blank.
+    """
+    if not value:
+        return None
+
+    moment = parse_datetime(value)
+    if moment is None:
+        day = datetime.datetime.strptime(value, '%Y-%m-%d')
+        moment = day + datetime.timedelta(days=1) if end else day
+
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+
+    return moment
+
+
+def utc_day(moment):
+    """
+    :param moment: An aware datetime.
+    :return: Its UTC day, as YYYY-MM-DD.
+    """
+    return moment.astimezone(timezone.utc).date().isoformat()
+
+
+def archived_rows(user_id, cursor=None, account=None, status=None,
+                  since=None, until=None):
+    """
+    Yields a user's archived records that match the filters, newest first.
+    Takes the same filters as record_page, with cursor as (op_run_time, id).
+
+    :return: A generator of row dicts.
+    """
+    # Only open the days the filters can match.
+    last_day = None
+    if cursor:
+        last_day = utc_day(cursor[0])
+    if until is not None:
+        last_day = min(filter(None, (last_day, utc_day(until))))
+
+    rows = archive.iter_rows(user_id,
+                             first_day=utc_day(since) if since else None,
+                             last_day=last_day)
+
+    for row in rows:
+        if cursor and (row['op_run_time'], row['id']) >= cursor:
+            continue
+        if until is not None and row['op_run_time'] >= until:
+            continue
+        if since is not None and row['op_run_time'] < since:
+            break
+        if account and row['reddit_user_name'] != account:
+            continue
+        if status and row['sub_comment_status'] != status:
+            continue
+
+        yield row
+
+
+def record_page(user_id, cursor=None, limit=RECORDS_PAGE_SIZE, account=None,
+                status=None, since=None, until=None):
+    """
+    Returns one page of a user's records, newest first.
+
+    :param user_id: The user's PK.
+    :param cursor: The previous page's cursor, None for the first page.
+    :param limit: The page size, capped at RECORDS_PAGE_SIZE.
+    :param account: Only records for this Reddit username.
+    :param status: Only records with this status (DELETED / SKIPPED.)
+    :param since: Only records from this datetime onwards.
+    :param until: Only records from before this datetime.
+    :return: A tuple of (rows, next cursor), the cursor is None on the last
+             page.
+    """
+    limit = max(1, min(limit, RECORDS_PAGE_SIZE))
+
+    records = SchedulerOutput.objects.filter(user_id=user_id,
+                                             op_run_time__isnull=False)
+    if account:
+        records = records.filter(reddit_user_name=account)
+    if status:
+        records = records.filter(sub_comment_status=status)
+    if since is not None:
+        records = records.filter(op_run_time__gte=since)
+    if until is not None:
+        records = records.filter(op_run_time__lt=until)
+
+    # Seek past the last row of the previous page.
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None:
+        records = records.filter(Q(op_run_time__lt=after[0])
+                                 | Q(op_run_time=after[0], id__lt=after[1]))
+
+    # One extra row tells us if there is another page.
+    rows = list(records.order_by('-op_run_time', '-id').values(
+        *archive.COLUMNS)[:limit + 1])
+
+    # The archive holds everything older than the table, carry on into it.
+    if len(rows) <= limit:
+        if rows:
+            after = (rows[-1]['op_run_time'], rows[-1]['id'])
+
+        rows += itertools.islice(
+            archived_rows(user_id, after, account, status, since, until),
+            limit + 1 - len(rows))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['op_run_time'], rows[-1]['id'])
+
+    return rows, next_cursor
+
+
+def matches_search(row, search):
+    """
+    :return: True if an archived row matches the logs table's search, the
+             same way table_page searches the DB.
+    """
+    return search.lower() in row['sub_comment_body'].lower() \
+        or search.lower() == row['sub_comment_status'].lower()
+
+
+def table_page(user_id, search, start, length):
+    """
+    Returns one page of a user's records for the logs table, newest first,
+    across the table and the archive.
+
+    :param user_id: The user's PK.
+    :param search: Matches a body substring or a status, blank for none.
+    :param start: The offset of the page.
+    :param length: The page size.
+    :return: A tuple of (total records, records matching the search, rows).
+             With a search the archive is only read until the page is full,
+             so the match count is exact up to the page and one more than
+             the page when there are further matches.
+    """
+    records = SchedulerOutput.objects.filter(user_id=user_id,
+                                             op_run_time__isnull=False)
+    total = records.count()
+    archived = archive.count(user_id)
+
+    if search:
+        records = records.filter(Q(sub_comment_body__icontains=search)
+                                 | Q(sub_comment_status__iexact=search))
+        hot = records.count()
+    else:
+        hot = total
+
+    rows = list(records.order_by('-op_run_time', '-id').values(
+        *archive.COLUMNS)[start:start + length])
+
+    # Without a search whole archive days are skipped by their counts. A
+    # search has to read the archive, it stops one match past the page so the
+    # table still knows there is a next page, instead of opening every day.
+    if not search:
+        filtered = total + archived
+        rows += itertools.islice(
+            archive.iter_rows(user_id, skip=max(start - hot, 0)),
+            length - len(rows))
+    else:
+        skip = max(start - hot, 0)
+        matches = list(itertools.islice(
+            (row for row in archive.iter_rows(user_id)
+             if matches_search(row, search)),
+            skip + length - len(rows) + 1))
+        filtered = hot + len(matches)
+        rows += matches[skip:skip + length - len(rows)]
+
+    return total + archived, filtered, rows
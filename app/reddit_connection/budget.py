@@ -0,0 +1,39 @@
+"""
+Time and request budgets for scheduled shred runs. A run that uses up its
+budget stops at the next page boundary, so one huge account can't hold up the
+rest of the cycle.
+"""
+
+from time import monotonic
+
+from Reddit_Shredder.settings import SHRED_REQUEST_BUDGET
+from Reddit_Shredder.settings import SHRED_TIME_BUDGET
+
+
+class RunBudget(object):
+    """
+    Tracks the time and API requests used by a single run.
+    """
+
+    def __init__(self, reddit_refresh, seconds=SHRED_TIME_BUDGET,
+                 requests=SHRED_REQUEST_BUDGET):
+        """
+        :param reddit_refresh: The run's Reddit object, from reddit_client.
+        :param seconds: The time budget.
+        :param requests: The API request budget.
+        """
+        self._session = reddit_refresh._core
+        self._first_request = self._session.request_count
+        self._deadline = monotonic() + seconds
+        self._requests = requests
+
+    @property
+    def requests_used(self):
+        return self._session.request_count - self._first_request
+
+    def exhausted(self):
+        """
+        :return: True once either budget is used up.
+        """
+        return monotonic() >= self._deadline \
+            or self.requests_used >= self._requests
@@ -0,0 +1,183 @@
+"""
+Checkpoints for shred runs. Listings are walked one page at a time and the
+progress (phase, listing cursor and processed ids) is saved after every page,
+so a run that dies half way through continues from its last page instead of
+starting from scratch.
+
+The cursor is the fullname of the last item on a page that was kept. Deleted
+items drop out of the listing, so the next page always starts right after the
+last surviving item.
+
+Only the ids handled since the cursor last moved (at most WINDOW of them) are
+saved, items before the cursor can't turn up in the listing again. Lagging
+deletes that Reddit still lists are only ever a page or so behind.
+"""
+
+import datetime
+from datetime import timezone
+
+from django.utils.timezone import timedelta
+
+from Reddit_Shredder.settings import CHECKPOINT_MAX_AGE
+from Reddit_Shredder.settings import OUTPUT_BODY_LENGTH
+from app import metrics
+from app.models import ShredCheckpoint
+from app.reddit_connection.listing import PAGE_SIZE, fetch_page
+from app.reddit_connection.retry import call_with_retry
+
+# The most processed ids kept in a saved checkpoint.
+WINDOW = 2 * PAGE_SIZE
+
+
+class ShredProgress(object):
+    """
+    Tracks and persists the progress of a single shred run.
+    """
+
+    def __init__(self, account_id, run_kind, params, due=None):
+        """
+        Loads the account's checkpoint, a checkpoint that is too old or was
+        saved with different settings is discarded.
+
+        :param account_id: The RedditAccounts PK, None disables persistence
+                           (i.e. one-off runs with a session token.)
+        :param run_kind: ShredCheckpoint.SCHEDULED or ShredCheckpoint.MANUAL.
+        :param params: A string of the settings the run uses.
+        :param due: When the run was due, kept across carried over runs.
+        """
+        self.persist = account_id is not None
+        self._kept = None
+
+        oldest = datetime.datetime.now(tz=timezone.utc) - timedelta(
+            seconds=CHECKPOINT_MAX_AGE)
+
+        checkpoint = None
+        if self.persist:
+            checkpoint = ShredCheckpoint.objects.filter(
+                account_id=account_id, run_kind=run_kind).first()
+
+        # True when carrying on from a saved checkpoint, the ids handled
+        # before it was saved aren't known.
+        self.resumed = checkpoint is not None
+
+        if checkpoint is None or checkpoint.params != params \
+                or checkpoint.updated < oldest:
+            self.resumed = False
+            if checkpoint is None:
+                checkpoint = ShredCheckpoint(account_id=account_id or 0,
+                                             run_kind=run_kind)
+            checkpoint.params = params
+            checkpoint.due = due
+            checkpoint.phase = ShredCheckpoint.COMMENTS
+            checkpoint.cursor = ''
+            checkpoint.processed_ids = ''
+
+        checkpoint.yielded = False
+        self.checkpoint = checkpoint
+
+        # The ids handled since the cursor last moved, oldest first.
+        self._window = list(filter(None, checkpoint.processed_ids.split(',')))
+
+        # Every id handled by this process, and the window of earlier ones.
+        self.processed_ids = set(self._window)
+
+    @property
+    def phase(self):
+        return self.checkpoint.phase
+
+    @property
+    def yielded(self):
+        return self.checkpoint.yielded
+
+    def is_processed(self, item_id):
+        """
+        :param item_id: A comment or submission ID.
+        :return: True if the item was handled earlier in this run.
+        """
+        return item_id in self.processed_ids
+
+    def processed(self, item, kept):
+        """
+        Records an item as handled.
+
+        :param item: The listing.ItemRecord.
+        :param kept: True if the item stays in the listing (i.e. SKIPPED.)
+        :return: Nothing.
+        """
+        self.processed_ids.add(item.id)
+
+        # The cursor moves to the kept item, everything before it is behind.
+        if kept:
+            self._kept = item.fullname
+            self._window = []
+        else:
+            self._window.append(item.id)
+            del self._window[:-WINDOW]
+
+    def pages(self, reddit_refresh, user_name, token=None, budget=None):
+        """
+        Yields listing pages from the checkpoint onwards, comments first then
+        submissions. The checkpoint is saved after each page is handled.
+
+        :param reddit_refresh: The Reddit object, from reddit_client.
+        :param user_name: The Reddit username being shredded.
+        :param token: The refresh token in use, see retry.call_with_retry.
+        :param budget: An optional budget.RunBudget, the run stops (and is
+                       flagged as yielded) once it is exhausted.
+        :return: A generator of lists of listing.ItemRecords.
+        """
+        while self.checkpoint.phase != ShredCheckpoint.DONE:
+            if budget is not None and budget.exhausted():
+                self.checkpoint.yielded = True
+                self.save()
+                return
+
+            page = call_with_retry(fetch_page, reddit_refresh, user_name,
+                                   self.checkpoint.phase,
+                                   self.checkpoint.cursor,
+                                   body_length=OUTPUT_BODY_LENGTH,
+                                   token=token)
+            new_items = [item for item in page
+                         if item.id not in self.processed_ids]
+
+            self._kept = None
+            yield page
+
+            # Move the cursor past the last kept item. If the page held nothing
+            # new (the listing lags behind our deletes) skip the whole page.
+            if self._kept is not None:
+                self.checkpoint.cursor = self._kept
+            elif page and not new_items:
+                self.checkpoint.cursor = page[-1].fullname
+                self._window = []
+
+            # A short page is the end of the listing.
+            if len(page) < PAGE_SIZE:
+                if self.checkpoint.phase == ShredCheckpoint.COMMENTS:
+                    self.checkpoint.phase = ShredCheckpoint.SUBMISSIONS
+                else:
+                    self.checkpoint.phase = ShredCheckpoint.DONE
+                self.checkpoint.cursor = ''
+                self._window = []
+
+            self.save()
+
+    def save(self):
+        """
+        Writes the checkpoint to the DB.
+
+        :return: Nothing.
+        """
+        if self.persist:
+            self.checkpoint.processed_ids = ','.join(self._window)
+            with metrics.timer('shredder_db_flush_seconds'):
+                self.checkpoint.save()
+
+    def finish(self):
+        """
+        Removes the checkpoint once the run is complete.
+
+        :return: Nothing.
+        """
+        if self.persist and self.checkpoint.pk is not None:
+            self.checkpoint.delete()
@@ -0,0 +1,65 @@
+"""
+Builds the PRAW Reddit objects used for refresh token based API access.
+"""
+
+import praw
+import prawcore
+
+from Reddit_Shredder.settings import CLIENT_ID
+from Reddit_Shredder.settings import CLIENT_SECRET
+from Reddit_Shredder.settings import USER_AGENT
+from app import metrics
+from app.query_budget import count_api_call
+from app.reddit_connection.retry import RateLimited
+from app.reddit_connection.token_cache import CachedAuthorizer
+
+
+class CountingSession(prawcore.Session):
+    """
+    A prawcore Session that counts the API requests it makes, and records
+    their latency and the rate limit headroom left.
+    """
+    request_count = 0
+
+    def request(self, *args, **kwargs):
+        self.request_count += 1
+        count_api_call()
+        metrics.inc('shredder_api_requests_total')
+        try:
+            with metrics.timer('shredder_api_request_seconds'):
+                return super(CountingSession, self).request(*args, **kwargs)
+
+        # prawcore has no exception for 429s.
+        except AssertionError as error:
+            if str(error) == 'Unexpected status code: 429':
+                raise RateLimited from error
+            raise
+
+        finally:
+            remaining = self._rate_limiter.remaining
+            if remaining is not None:
+                metrics.set_gauge('shredder_ratelimit_remaining', remaining)
+
+
+def reddit_client(token, check_revoked=True):
+    """
+    Returns a PRAW Reddit object for a refresh token. The access token is read
+    from and written to the shared token cache, see token_cache.py.
+
+    :param token: The user's saved refresh token.
+    :param check_revoked: False to ask Reddit even if the token is flagged as
+                          revoked, see CachedAuthorizer.
+    :return: A PRAW Reddit object.
+    """
+    reddit_refresh = praw.Reddit(client_id=CLIENT_ID,
+                                 client_secret=CLIENT_SECRET,
+                                 refresh_token=token,
+                                 user_agent=USER_AGENT
+                                 )
+
+    # Swap PRAW's authorizer for the cached one, re-using its authenticator.
+    authenticator = reddit_refresh._core._authorizer._authenticator
+    reddit_refresh._core = reddit_refresh._authorized_core = CountingSession(
+        CachedAuthorizer(authenticator, token, check_revoked))
+
+    return reddit_refresh
@@ -0,0 +1,260 @@
+"""
+The automatic exclusion rules, compiled once per run into a RuleMatcher.
+
+All of a user's keywords are folded into a single pattern so an item's body
+is scanned once for them, subreddits become set lookups, and the age and score
+bands are merged into sorted, non-overlapping intervals checked with a binary
+search. Regexes are compiled one by one, so their groups and backreferences
+can't clash, and a regex that fails to compile only loses that one rule.
+
+Regexes run on shared worker threads, so they are matched with the regex
+module under a RULE_REGEX_TIMEOUT time limit, on the first RULE_BODY_LENGTH
+characters of a body only. A regex that runs out of time keeps the item, and
+every later item checked by the same matcher: a runaway rule must never get
+items deleted that it was meant to protect. regex_problem turns the obvious
+runaway shapes away when the rule is saved.
+"""
+
+import re
+import time
+from bisect import bisect_right
+from collections import defaultdict
+
+import regex as timed_re
+
+from Reddit_Shredder.settings import RULE_BODY_LENGTH
+from Reddit_Shredder.settings import RULE_REGEX_MAX_LENGTH
+from Reddit_Shredder.settings import RULE_REGEX_TIMEOUT
+from app.logger.exception_logger import logger
+from app.models import ExclusionRule
+
+# Groups and backreferences a regex may not use: named groups, named and
+# numbered backreferences and conditionals on a group. A backslash only starts
+# a backreference if it isn't escaped itself.
+GROUP_REFERENCE = re.compile(
+    r'\(\?P[<=]|\(\?\(|(?:^|[^\\])(?:\\\\)*\\(?:[1-9]|g<)')
+
+# A quantified group whose contents are quantified or alternatives, e.g.
+# (a+)+ or (a|aa)*, the classic catastrophic backtracking shapes.
+NESTED_QUANTIFIER = re.compile(
+    r'\((?:[^()\\]|\\.)*[+*}|](?:[^()\\]|\\.)*\)[+*{]')
+
+
+class Bands(object):
+    """
+    A union of numeric intervals, both ends inclusive.
+    """
+
+    def __init__(self, intervals):
+        """
+        :param intervals: (minimum, maximum) tuples, None for an open end.
+        """
+        intervals = sorted(
+            (float('-inf') if low is None else low,
+             float('inf') if high is None else high)
+            for low, high in intervals)
+
+        # Merge overlapping intervals.
+        merged = []
+        for low, high in intervals:
+            if merged and low <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], high)
+            else:
+                merged.append([low, high])
+
+        self.starts = [low for low, high in merged]
+        self.ends = [high for low, high in merged]
+
+    def __contains__(self, value):
+        position = bisect_right(self.starts, value) - 1
+        return position >= 0 and value <= self.ends[position]
+
+    def __bool__(self):
+        return bool(self.starts)
+
+
+def compile_patterns(keywords, regexes):
+    """
+    Compiles keywords and regexes into case insensitive patterns, one for all
+    of the keywords and one per regex. Regexes that aren't accepted are left
+    out.
+
+    :param keywords: Plain text keywords.
+    :param regexes: Regular expressions.
+    :return: A list of compiled regex module patterns.
+    """
+    patterns = []
+    if keywords:
+        patterns.append(timed_re.compile(
+            '|'.join(timed_re.escape(keyword) for keyword in keywords),
+            timed_re.IGNORECASE))
+
+    for regex in regexes:
+        problem = regex_problem(regex)
+        if problem is not None:
+            logger.warning('Ignored exclusion regex %r: %s', regex, problem)
+            continue
+
+        patterns.append(timed_re.compile(regex, timed_re.IGNORECASE))
+
+    return patterns
+
+
+def regex_problem(regex):
+    """
+    :param regex: A user supplied regex.
+    :return: Why the regex can't be used, None if it can.
+    """
+    if len(regex) > RULE_REGEX_MAX_LENGTH:
+        return 'it is longer than {} characters.'.format(
+            RULE_REGEX_MAX_LENGTH)
+
+    try:
+        timed_re.compile(regex)
+    except timed_re.error:
+        return 'it is not a valid regex.'
+
+    if GROUP_REFERENCE.search(regex):
+        return 'named groups and backreferences are not supported.'
+
+    if NESTED_QUANTIFIER.search(regex):
+        return 'repeated groups may not contain repeats or alternatives.'
+
+    return None
+
+
+def is_valid_regex(regex):
+    """
+    :param regex: A user supplied regex.
+    :return: True if the regex can be used, see regex_problem.
+    """
+    return regex_problem(regex) is None
+
+
+class RuleMatcher(object):
+    """
+    A user's exclusion rules, compiled.
+    """
+
+    def __init__(self, rules):
+        """
+        :param rules: The user's ExclusionRules, or (kind, value, minimum,
+                      maximum) tuples.
+        """
+        values = defaultdict(list)
+        bands = defaultdict(list)
+        for kind, value, minimum, maximum in rules:
+            if kind in (ExclusionRule.AGE, ExclusionRule.SCORE):
+                bands[kind].append((minimum, maximum))
+            elif value:
+                values[kind].append(value)
+
+        self.keep_subreddits = frozenset(
+            name.lower() for name in values[ExclusionRule.KEEP_SUBREDDIT])
+        self.only_subreddits = frozenset(
+            name.lower() for name in values[ExclusionRule.ONLY_SUBREDDIT])
+        self.patterns = compile_patterns(values[ExclusionRule.KEYWORD],
+                                         values[ExclusionRule.REGEX])
+        self.ages = Bands(bands[ExclusionRule.AGE])
+        self.scores = Bands(bands[ExclusionRule.SCORE])
+
+        self.empty = not (self.keep_subreddits or self.only_subreddits
+                          or self.patterns or self.ages or self.scores)
+
+        # Identifies the rule set, e.g. to cache verdicts between requests.
+        self.key = frozenset(tuple(rule) for rule in rules)
+
+        # Set once a regex runs out of time, every item is kept from then on.
+        self.timed_out = False
+
+    def keeps(self, item, now=None):
+        """
+        :param item: A listing.ItemRecord.
+        :param now: The run's current time (epoch seconds.)
+        :return: True if the rules protect the item.
+        """
+        if self.empty:
+            return False
+
+        return self.keeps_age(item, now) or self.keeps_content(item)
+
+    def keeps_age(self, item, now=None):
+        """
+        :param item: A listing.ItemRecord.
+        :param now: The run's current time (epoch seconds.)
+        :return: True if the age rules protect the item.
+        """
+        if not self.ages:
+            return False
+
+        age = ((now or time.time()) - item.created) / 3600
+        return age in self.ages
+
+    def keeps_content(self, item):
+        """
+        The rules that don't depend on the time, so their verdict on an item
+        never changes.
+
+        :param item: A listing.ItemRecord.
+        :return: True if the subreddit, score or text rules protect the item.
+        """
+        if self.timed_out:
+            return True
+
+        subreddit = item.subreddit.lower()
+        if subreddit in self.keep_subreddits:
+            return True
+        if self.only_subreddits and subreddit not in self.only_subreddits:
+            return True
+
+        if item.score in self.scores:
+            return True
+
+        body = item.body[:RULE_BODY_LENGTH]
+        try:
+            return any(pattern.search(body, timeout=RULE_REGEX_TIMEOUT)
+                       is not None for pattern in self.patterns)
+        except TimeoutError:
+            logger.warning('An exclusion regex timed out on %s, keeping it '
+                           'and every item after it.', item.id)
+            self.timed_out = True
+            return True
+
+
+def manual_selects(item, cutoff, karma_limit, everything=False,
+                   excluded=frozenset(), rules=None, now=None):
+    """
+    Decides whether a manual run deletes an item. Shared by manual_shred and
+    the shredder preview, so the preview counts exactly what a run deletes.
+
+    :param item: A listing.ItemRecord or history_snapshot.HistoryItem.
+    :param cutoff: Only items created before this (epoch seconds) are deleted.
+    :param karma_limit: Items at or below this score are deleted.
+    :param everything: True to delete everything, exclusions included.
+    :param excluded: The ids of the user's excluded items.
+    :param rules: The user's RuleMatcher, None for anonymous users.
+    :param now: The run's current time (epoch seconds.)
+    :return: True to delete the item.
+    """
+    if everything:
+        return True
+
+    return item.created < cutoff \
+        and item.score <= karma_limit \
+        and item.id not in excluded \
+        and (rules is None or not rules.keeps(item, now))
+
+
+def load_matchers(user_ids):
+    """
+    Compiles the rules of several users with one query.
+
+    :param user_ids: The users' PKs.
+    :return: A dict of user PK -> RuleMatcher, for every user in user_ids.
+    """
+    rules = defaultdict(list)
+    for rule in ExclusionRule.objects.filter(user_id__in=user_ids).values_list(
+            'user_id', 'kind', 'value', 'minimum', 'maximum'):
+        rules[rule[0]].append(rule[1:])
+
+    return {user_id: RuleMatcher(rules[user_id]) for user_id in user_ids}
@@ -0,0 +1,100 @@
+"""
+Lease locks for shred runs. A lease is a ShredLease row with an owner and an
+expiry; whoever holds an unexpired lease owns the account (or scheduler tick)
+and keeps the lease alive with heartbeats. A worker that dies simply lets its
+lease expire, after which the next worker can take it over.
+"""
+
+import datetime
+import uuid
+from datetime import timezone
+from time import monotonic
+
+from django.db import IntegrityError, transaction
+from django.utils.timezone import timedelta
+
+from Reddit_Shredder.settings import LEASE_TTL
+from app.models import ShredLease
+
+
+def account_lease(account_id):
+    """
+    :param account_id: The RedditAccounts PK.
+    :return: The lease guarding the account.
+    """
+    return Lease('account:{}'.format(account_id))
+
+
+class Lease(object):
+    """
+    A single named lease.
+    """
+
+    def __init__(self, name, ttl=LEASE_TTL):
+        """
+        :param name: The lease name.
+        :param ttl: Seconds until the lease expires without a heartbeat.
+        """
+        self.name = name
+        self.ttl = ttl
+        self.owner = uuid.uuid4().hex
+        self._renewed = monotonic()
+
+    def _expiry(self):
+        return datetime.datetime.now(tz=timezone.utc) + timedelta(
+            seconds=self.ttl)
+
+    def acquire(self):
+        """
+        Takes the lease if it is free or expired.
+
+        :return: True if the lease is now held.
+        """
+        now = datetime.datetime.now(tz=timezone.utc)
+
+        self._renewed = monotonic()
+
+        # Take over an expired lease.
+        if ShredLease.objects.filter(name=self.name, expires__lt=now).update(
+                owner=self.owner, expires=self._expiry()):
+            return True
+
+        # Otherwise create it, the unique name means only one worker wins.
+        try:
+            with transaction.atomic():
+                ShredLease.objects.create(name=self.name,
+                                          owner=self.owner,
+                                          expires=self._expiry())
+            return True
+        except IntegrityError:
+            return False
+
+    def heartbeat(self):
+        """
+        Extends the lease.
+
+        :return: False if the lease was lost (it expired and was taken over.)
+        """
+        self._renewed = monotonic()
+        return ShredLease.objects.filter(
+            name=self.name, owner=self.owner).update(
+            expires=self._expiry()) == 1
+
+    def keep_alive(self):
+        """
+        Heartbeats once a third of the TTL has passed since the last renewal,
+        cheap enough to call for every item.
+
+        :return: False if the lease was lost.
+        """
+        if monotonic() - self._renewed < self.ttl / 3:
+            return True
+        return self.heartbeat()
+
+    def release(self):
+        """
+        Gives the lease up.
+
+        :return: Nothing.
+        """
+        ShredLease.objects.filter(name=self.name, owner=self.owner).delete()
@@ -0,0 +1,99 @@
+"""
+A light listing layer. Comment and submission listings are read as raw JSON
+and turned straight into compact ItemRecords, instead of PRAW model objects
+that each carry their full attribute dict and a reference back to the Reddit
+instance. Only the fields the shredder reads are kept, and the body can be cut
+to a display length.
+
+Items are changed through handle(), a lazy PRAW object that holds nothing but
+the item's id.
+"""
+
+from app import metrics
+from app.models import ShredCheckpoint
+
+# Reddit's maximum listing page size.
+PAGE_SIZE = 100
+
+# Listing path and item type of each shred phase.
+LISTINGS = {
+    ShredCheckpoint.COMMENTS: ('comments', 'Comment'),
+    ShredCheckpoint.SUBMISSIONS: ('submitted', 'Submission'),
+}
+
+# Fullname prefixes.
+KINDS = {
+    'Comment': 't1',
+    'Submission': 't3',
+}
+
+
+class ItemRecord(object):
+    """
+    The parts of a comment or submission the shredder uses.
+    """
+    __slots__ = ('id', 'item_type', 'created', 'score', 'body', 'subreddit')
+
+    def __init__(self, data, item_type, body_length=None):
+        """
+        :param data: The item's JSON data from a listing.
+        :param item_type: Comment / Submission
+        :param body_length: Cut the body to this many characters, None keeps
+                            all of it.
+        """
+        # Comments have a body, submissions have a title.
+        if item_type == 'Comment':
+            body = data['body']
+        else:
+            body = data['title']
+
+        self.id = data['id']
+        self.item_type = item_type
+        self.created = data['created']
+        self.score = data['score']
+        self.body = body[:body_length]
+        self.subreddit = data['subreddit']
+
+    @property
+    def fullname(self):
+        return '{}_{}'.format(KINDS[self.item_type], self.id)
+
+
+def fetch_page(reddit_refresh, user_name, phase, after=None,
+               body_length=None):
+    """
+    Fetches a single listing page (one API request.)
+
+    :param reddit_refresh: The Reddit object, from reddit_client.
+    :param user_name: The account's Reddit username.
+    :param phase: ShredCheckpoint.COMMENTS or ShredCheckpoint.SUBMISSIONS.
+    :param after: The fullname to list after, blank for the newest items.
+    :param body_length: See ItemRecord.
+    :return: A list of ItemRecords, newest first.
+    """
+    where, item_type = LISTINGS[phase]
+
+    params = {'limit': PAGE_SIZE, 'sort': 'new', 'raw_json': 1}
+    if after:
+        params['after'] = after
+
+    with metrics.timer('shredder_page_fetch_seconds'):
+        listing = reddit_refresh._core.request(
+            'GET', '/user/{}/{}'.format(user_name, where), params=params)
+
+        return [ItemRecord(child['data'], item_type, body_length)
+                for child in listing['data']['children']]
+
+
+def handle(reddit_refresh, record):
+    """
+    Returns a lazy PRAW object for changing an item, it isn't fetched.
+
+    :param reddit_refresh: The Reddit object, from reddit_client.
+    :param record: The ItemRecord.
+    :return: A PRAW Comment or Submission.
+    """
+    if record.item_type == 'Comment':
+        return reddit_refresh.comment(record.id)
+
+    return reddit_refresh.submission(record.id)
@@ -5,6 +5,7 @@ API. All of the functions are documented below.
 
 import datetime
 import random
+import re
 import string
 import uuid
 from datetime import timezone
@@ -17,11 +18,26 @@ from django.utils.timezone import timedelta
 
 from Reddit_Shredder.settings import CLIENT_ID
 from Reddit_Shredder.settings import CLIENT_SECRET
+from Reddit_Shredder.settings import OVERWRITE_MARKER
 from Reddit_Shredder.settings import REDIRECT_URI
 from Reddit_Shredder.settings import USER_AGENT
+from app import metrics, profiling
 from app.logger.exception_decor import exception
 from app.logger.exception_logger import logger
-from app.models import RedditAccounts
+from app.cache_functions.history_snapshot import get_snapshot, remove_items
+from app.models import ExcludedItems, RedditAccounts, ShredCheckpoint
+from app.reddit_connection.checkpoint import ShredProgress
+from app.reddit_connection.client import reddit_client
+from app.reddit_connection.exclusion_rules import load_matchers
+from app.reddit_connection.exclusion_rules import manual_selects
+from app.reddit_connection.lease import account_lease
+from app.reddit_connection.listing import handle
+from app.reddit_connection.retry import SkipItem, call_with_retry
+from app.reddit_connection.token_cache import TokenRevoked
+
+# Matches comment bodies written by overwrite_text.
+OVERWRITTEN_PATTERN = re.compile(
+    re.escape(OVERWRITE_MARKER) + r'[a-zA-Z0-9]{36}$')
 
 # Initialize Reddit object for non-authenticated functions.
 reddit = praw.Reddit(client_id=CLIENT_ID,
@@ -42,23 +58,16 @@ def delete_comment(_id, token, item_type):
     :param item_type: Comment / Submission
     :return: A success / error message. Depending on the result.
     """
-    reddit_refresh = praw.Reddit(client_id=CLIENT_ID,
-                                 client_secret=CLIENT_SECRET,
-                                 refresh_token=token,
-                                 user_agent=USER_AGENT
-                                 )
+    reddit_refresh = reddit_client(token)
 
     # Catch and delete submission types.
     if item_type == "Submission":
-        submission = reddit_refresh.submission(_id)
-        submission.delete()
+        delete_item(reddit_refresh, _id, item_type, token)
         message = "Great Success! Submission deleted!"
 
     # Catch and delete comment types.
     elif item_type == "Comment":
-        comment = reddit_refresh.comment(_id)
-        comment.edit(string_generator())
-        comment.delete()
+        delete_item(reddit_refresh, _id, item_type, token)
         message = "Great Success! Comment overwritten and deleted!"
 
     # Otherwise, return an error.
@@ -69,6 +78,57 @@ def delete_comment(_id, token, item_type):
     return message
 
 
+def delete_item(reddit_refresh, item_id, item_type, token):
+    """
+    Overwrites (comments only) and deletes a single item.
+
+    :param reddit_refresh: The Reddit object, from reddit_client.
+    :param item_id: The comment or submission ID.
+    :param item_type: Comment / Submission
+    :param token: The refresh token in use, see retry.call_with_retry.
+    :return: Nothing.
+    """
+    if item_type == "Comment":
+        comment = reddit_refresh.comment(item_id)
+        call_with_retry(comment.edit, overwrite_text(), token=token)
+        call_with_retry(comment.delete, token=token)
+    else:
+        submission = reddit_refresh.submission(item_id)
+        call_with_retry(submission.delete, token=token)
+
+
+def delete_items(token, items):
+    """
+    Deletes a batch of one account's items with a single client.
+
+    :param token: The account's refresh token.
+    :param items: A list of (item ID, Comment / Submission) tuples.
+    :return: A dict of item ID -> DELETED, SKIPPED (Reddit refused) or FAILED.
+    """
+    reddit_refresh = reddit_client(token)
+
+    results = {}
+    for item_id, item_type in items:
+        try:
+            delete_item(reddit_refresh, item_id, item_type, token)
+            results[item_id] = 'DELETED'
+
+        except SkipItem:
+            results[item_id] = 'SKIPPED'
+
+        # A dead token fails the rest of the batch too.
+        except TokenRevoked:
+            for remaining, _ in items:
+                results.setdefault(remaining, 'FAILED')
+            break
+
+        except Exception:
+            logger.exception('Could not delete %s.', item_id)
+            results[item_id] = 'FAILED'
+
+    return results
+
+
 @exception(logger)
 @login_required
 def get_json_reddit(request):
@@ -87,38 +147,25 @@ def get_json_reddit(request):
 
     # Get all of the user's reddit accounts.
     accounts = RedditAccounts.objects.filter(user_id=user.id).values_list(
-        'reddit_token', flat=True)
+        'id', 'reddit_user_name', 'reddit_token')
 
     # Init an empty object to hold the output data.
     data = []
 
-    # Iterate through all accounts.
-    for account in accounts:
-        # Get user_name as a string, this makes it possible to append it to
-        # a dict key.
-        user_name = str(get_reddit_username(account))
-
-        # Get all the comments and append them to the list.
-        for comment in get_comments(account):
-            temp_data = {
-                'cid': comment.id,
-                'body': comment.body,
-                'karma': comment.score,
-                'user_name': user_name,
-                'item_type': "Comment",
-            }
-            data.append(temp_data)
-
-        # Get all the submission and append them to the list.
-        for submission in get_submissions(account):
-            temp_data = {
-                'cid': submission.id,
-                'body': submission.title,
-                'karma': submission.score,
-                'user_name': user_name,
-                'item_type': "Submission",
-            }
-            data.append(temp_data)
+    # Iterate through all accounts, the items come from the account's history
+    # snapshot rather than a full walk of the listings.
+    with profiling.profiled('history', profiling.wants_profile(
+            request=request), user_id=user.id):
+        for account_id, user_name, token in accounts:
+            for item in get_snapshot(account_id, token):
+                temp_data = {
+                    'cid': item.id,
+                    'body': item.body,
+                    'karma': item.score,
+                    'user_name': user_name,
+                    'item_type': item.item_type,
+                }
+                data.append(temp_data)
 
     return JsonResponse(data, safe=False)
 
@@ -143,12 +190,21 @@ def run_shredder(request):
     # Get the token from the user's account if the user is authorized.
     if user.is_authenticated:
         account = request.POST.get('account')
-        account_object = RedditAccounts.objects.get(reddit_user_name=account)
+        account_object = RedditAccounts.objects.get(user_id=user.id,
+                                                    reddit_user_name=account)
+        account_id = account_object.id
         token = account_object.reddit_token
+        rules = load_matchers([user.id])[user.id]
+        excluded = frozenset(ExcludedItems.objects.filter(
+            user_id=user.id).values_list('excluded_item_id', flat=True))
 
-    # Otherwise, get the token from the session store.
+    # Otherwise, get the token from the session store (there is no account to
+    # checkpoint against.)
     elif request.session['token']:
+        account_id = None
         token = request.session['token']
+        rules = None
+        excluded = frozenset()
 
     # If none of these options exist, raise an error.
     else:
@@ -159,89 +215,126 @@ def run_shredder(request):
     karma_limit = int(request.POST.get('karma_limit'))
     delete_everything = request.POST.get('delete_everything')
 
-    # stores the output from the shredding process.
-    output = []
-
     # Delete everything if the user selects delete_everything. Also, use
     # the delete everything function if the user sets no karma_limit or keep
     # values.
-    if delete_everything == 'on' or keep == 0 and karma_limit == 1:
-        for comment in get_comments(token):
-            temp_data = {
-                'cid': comment.id,
-                'body': comment.body,
-                'status': 'DELETED',
-            }
-            comment.edit(string_generator())
-            comment.delete()
-            output.append(temp_data)
+    everything = delete_everything == 'on' or keep == 0 and karma_limit == 1
+
+    # Only one run may shred an account at a time, manual or scheduled.
+    lease = None
+    if account_id is not None:
+        lease = account_lease(account_id)
+        if not lease.acquire():
+            return JsonResponse([{
+                'cid': '',
+                'body': 'This account is being shredded right now, please try '
+                        'again in a few minutes.',
+                'status': 'BUSY',
+            }], safe=False)
+
+    enabled = profiling.wants_profile(account_id, request)
+    try:
+        with metrics.job('manual'), profiling.profiled(
+                'manual', enabled, account_id=account_id, user_id=user.id,
+                keep=keep, karma_limit=karma_limit, everything=everything):
+            output = manual_shred(token, account_id, keep, karma_limit,
+                                  everything, lease, rules, excluded)
+    finally:
+        if lease is not None:
+            lease.release()
 
-        for submission in get_submissions(token):
-            temp_data = {
-                'cid': submission.id,
-                'body': submission.title,
-                'status': 'DELETED',
-            }
-            submission.delete()
-            output.append(temp_data)
+    # Log successful run.
+    logger.info('Manual Shredder ran successfully')
+    metrics.dump()
+    return JsonResponse(output, safe=False)
 
-        # Log successful run.
-        logger.info('Manual Shredder ran successfully')
-        return JsonResponse(output, safe=False)
 
-    # overwrites and deletes a user's comments.
-    for comment in get_comments(token):
-        # Get the comment creation time.
-        time = datetime.datetime.fromtimestamp(comment.created)
-        time = time.replace(tzinfo=pytz.utc)
+def manual_shred(token, account_id, keep, karma_limit, everything, lease=None,
+                 rules=None, excluded=frozenset()):
+    """
+    Runs the manual shredder for a single account.
 
-        # this overwrites the comment, saves it and deletes it
-        if time < delta_now(keep) and comment.score <= karma_limit:
-            temp_data = {
-                'cid': comment.id,
-                'body': comment.body,
-                'status': 'DELETED',
-            }
-            comment.edit(string_generator())
-            comment.delete()
-            output.append(temp_data)
+    :param token: The user's refresh token.
+    :param account_id: The RedditAccounts PK, None for session tokens.
+    :param keep: The time cut-off in hours.
+    :param karma_limit: Items at or below this score are deleted.
+    :param everything: True to delete everything.
+    :param lease: The account's lease.Lease, renewed after every page.
+    :param rules: The user's exclusion_rules.RuleMatcher, None for anonymous
+                  users. Ignored when deleting everything.
+    :param excluded: The ids of the user's excluded items. Ignored when
+                     deleting everything.
+    :return: A list of dicts, one per item.
+    """
+    # stores the output from the shredding process.
+    output = []
 
-        # skip the comment
-        else:
+    # Resume from the last checkpoint if a run with the same settings died.
+    progress = ShredProgress(account_id, ShredCheckpoint.MANUAL,
+                             '{}|{}|{}'.format(keep, karma_limit, everything))
+    reddit_refresh = reddit_client(token)
+    redditor = call_with_retry(reddit_refresh.user.me, token=token)
+
+    for page in progress.pages(reddit_refresh, redditor.name, token=token):
+        if lease is not None:
+            lease.heartbeat()
+
+        for item in page:
+            if progress.is_processed(item.id):
+                continue
+
+            # A page can take longer than the lease, renew it as we go.
+            if lease is not None:
+                lease.keep_alive()
+
+            # overwrites (comments only) and deletes the item, items Reddit
+            # refuses to delete are skipped.
+            status = 'SKIPPED'
+            if manual_selects(item, delta_now(keep).timestamp(), karma_limit,
+                              everything, excluded, rules):
+                try:
+                    shred_item(reddit_refresh, item, token=token)
+                    status = 'DELETED'
+                except SkipItem:
+                    logger.warning('Skipped %s, it could not be deleted.',
+                                   item.id)
+
+            metrics.inc('shredder_items_total', status=status.lower())
             temp_data = {
-                'cid': comment.id,
-                'body': comment.body,
-                'status': 'SKIPPED',
+                'cid': item.id,
+                'body': item.body,
+                'status': status,
             }
+            progress.processed(item, kept=status == 'SKIPPED')
             output.append(temp_data)
 
-    # deletes a user's subs.
-    for submission in get_submissions(token):
-        # Get the submission creation time.
-        time = datetime.datetime.fromtimestamp(submission.created)
-        time = time.replace(tzinfo=pytz.utc)
+    progress.finish()
 
-        # delete the submission
-        if time < delta_now(keep) and submission.score <= karma_limit:
-            temp_data = {
-                'cid': submission.id,
-                'body': submission.title,
-                'status': 'DELETED',
-            }
-            submission.delete()
-            output.append(temp_data)
+    # Drop the deleted items from the account's history snapshot.
+    if account_id is not None:
+        remove_items(account_id, [row['cid'] for row in output
+                                  if row['status'] == 'DELETED'])
 
-        # skip the submission
-        else:
-            temp_data = {
-                'cid': submission.id,
-                'body': submission.title,
-                'status': 'SKIPPED',
-            }
-            output.append(temp_data)
-    # Log successful run.
-    logger.info('Manual Shredder ran successfully')
-    return JsonResponse(output, safe=False)
+    return output
+
+
+def shred_item(reddit_refresh, item, token=None):
+    """
+    Overwrites (comments only) and deletes a comment or submission. Comments
+    that already carry the overwrite marker are only deleted. Each API call is
+    retried on its own, so a failed delete doesn't repeat the edit.
+
+    :param reddit_refresh: The Reddit object, from reddit_client.
+    :param item: The listing.ItemRecord.
+    :param token: The refresh token in use, see retry.call_with_retry.
+    :return: Nothing.
+    """
+    target = handle(reddit_refresh, item)
+    if item.item_type == 'Comment' and not is_overwritten(item.body):
+        with metrics.timer('shredder_edit_seconds'):
+            call_with_retry(target.edit, overwrite_text(), token=token)
+    with metrics.timer('shredder_delete_seconds'):
+        call_with_retry(target.delete, token=token)
 
 
 @exception(logger)
@@ -278,57 +371,41 @@ def get_reddit_username(token):
     :return: The user's Reddit username.
     """
 
-    reddit_refresh = praw.Reddit(client_id=CLIENT_ID,
-                                 client_secret=CLIENT_SECRET,
-                                 refresh_token=token,
-                                 user_agent=USER_AGENT
-                                 )
+    reddit_refresh = reddit_client(token)
 
     return reddit_refresh.user.me()
 
 
 @exception(logger)
-def get_comments(token):
+def string_generator(size=36, chars=string.ascii_letters + string.digits):
     """
-    Returns a comments object from PRAW.
+    Generates a random string of numbers and letters.
 
-    :param token: The user's saved refresh token.
-    :return: A comments object from PRAW.
+    :param size: The length of the string.
+    :param chars: The characters to include (default is letters and numbers.)
+    :return: A string of random letters and numbers.
     """
-    reddit_refresh = praw.Reddit(client_id=CLIENT_ID,
-                                 client_secret=CLIENT_SECRET,
-                                 refresh_token=token,
-                                 user_agent=USER_AGENT
-                                 )
-    return reddit_refresh.user.me().comments.new(limit=None)
+    return "".join(random.choice(chars) for _ in range(size))
 
 
 @exception(logger)
-def get_submissions(token):
+def overwrite_text():
     """
-    Returns a submissions object from PRAW.
+    Returns the text comments are overwritten with before they are deleted.
 
-    :param token: The user's refresh token.
-    :return: A submissions object from PRAW.
+    :return: The overwrite marker followed by a random string.
     """
-    reddit_refresh = praw.Reddit(client_id=CLIENT_ID,
-                                 client_secret=CLIENT_SECRET,
-                                 refresh_token=token,
-                                 user_agent=USER_AGENT
-                                 )
-    return reddit_refresh.user.me().submissions.new(limit=None)
+    return OVERWRITE_MARKER + string_generator()
 
 
-@exception(logger)
-def string_generator(size=36, chars=string.ascii_letters + string.digits):
+def is_overwritten(body):
     """
-    Generates a random string of numbers and letters.
+    Checks if a comment body was written by overwrite_text.
 
-    :param size: The length of the string.
-    :param chars: The characters to include (default is letters and numbers.)
-    :return: A string of random letters and numbers.
+    :param body: The comment body.
+    :return: True if the comment is already overwritten.
     """
-    return "".join(random.choice(chars) for _ in range(size))
+    return OVERWRITTEN_PATTERN.match(body) is not None
 
 
 @exception(logger)
@@ -6,16 +6,25 @@ mismatch, the entire program logic will fail.
 Also handles requests to /profile/schedule, updating the user's schedule.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from multiprocessing import Process
+from time import sleep
 
 from django.contrib import messages
-from django.contrib.auth.models import User
+from django.db import connection
 from django.shortcuts import redirect
 
+from Reddit_Shredder.settings import SCHEDULER_TICK
+from Reddit_Shredder.settings import SHRED_WORKERS
+from app import archive, metrics, profiling
 from app.forms import SchedulerForm
-from app.models import SchedulerOutput, ExcludedItems
+from app.models import SchedulerOutput, ShredCheckpoint, ShredLease, ShredRun
+from app.reddit_connection.budget import RunBudget
+from app.reddit_connection.lease import Lease, account_lease
 from app.reddit_connection.reddit_connection import *
+from app.reddit_connection.retry import SkipItem
+from app.reddit_connection.shred_context import load_contexts
+from app.reddit_connection.slots import due_in_tick, tick_start
 
 
 @exception(logger)
@@ -61,27 +70,24 @@ def change_schedule(request):
         return redirect('/profile/')
 
 
-@exception(logger)
-def save_output(_id, item_id, item_body, user_name, status):
+def output_record(context, item_id, item_body, status):
     """
-    Saves auto shredder output to DB.
+    Builds an auto shredder output record, records are saved in bulk once per
+    listing page.
 
-    :param _id: The user's PK.
+    :param context: The account's ShredContext.
     :param item_id: The sub or comment ID.
     :param item_body: The comment body or submission title.
-    :param user_name: The Reddit user name.
     :param status: DELETED or SKIPPED.
-    :return: Nothing, writes directly to db.
+    :return: An unsaved SchedulerOutput object.
     """
-    output = SchedulerOutput(user_id=_id,
-                             sub_comment_id=item_id,
-                             sub_comment_body=item_body,
-                             op_run_time=datetime.datetime.utcnow(),
-                             reddit_user_name=user_name,
-                             sub_comment_status=status,
-                             )
-
-    output.save()
+    return SchedulerOutput(user_id=context.user_id,
+                           sub_comment_id=item_id,
+                           sub_comment_body=item_body,
+                           op_run_time=datetime.datetime.now(tz=timezone.utc),
+                           reddit_user_name=context.user_name,
+                           sub_comment_status=status,
+                           )
 
 
 @exception(logger)
@@ -98,141 +104,262 @@ def get_item_time(item):
 
 
 @exception(logger)
-def schedule_shredder(account):
+def schedule_shredder(context, due=None, lease=None):
     """
     Function runs the scheduled shreds by iterating through the db and
     deleting comments/subs based on the schedule set by the user. Must be
     called via run_shredder function.
 
-    :return: Nothing, writes directly to DB.
-    """
-
-    # Set the time delay, if time is None time = None.
-    if account[1] != "None":
-        # Daily schedule.
-        if account[1] == "Daily":
-            time = 24
-        # Weekly schedule.
-        if account[1] == "Weekly":
-            time = 168
-        # Monthly schedule.
-        if account[1] == "Monthly":
-            time = 672
-
-    # Get the users account object.
-    user = User.objects.get(pk=account[0])
-
-    # Get exclusion params (karma_exclude = the karma threshold, excluded_list=
-    # the manual comment/sub exclusions.)
-    karma_exclude = user.profile.karma_exclude
-    excluded_list = ExcludedItems.objects.filter(
-        user_id=account[0]).values_list('excluded_item_id', flat=True)
-
-    # Iterate through all comments.
-    for comment in get_comments(account[3]):
-        item_time = get_item_time(comment.created)
-        if item_time < delta_now(time) and comment.score < karma_exclude \
-                and comment.id not in excluded_list:
-            if user.profile.record_keeping == 1:
-                save_output(user.id,
-                            comment.id,
-                            comment.body,
-                            user_name=account[2],
-                            status="DELETED",
-                            )
-            comment.edit(string_generator())
-            comment.delete()
-
-        else:
-            if user.profile.record_keeping == 1:
-                save_output(user.id,
-                            comment.id,
-                            comment.body,
-                            user_name=account[2],
-                            status="SKIPPED")
-
-    # Iterate through all submissions.
-    for submission in get_submissions(account[3]):
-        item_time = get_item_time(submission.created)
-        if item_time < delta_now(time) and submission.score < karma_exclude \
-                and submission.id not in excluded_list:
-            if user.profile.record_keeping == 1:
-                save_output(user.id,
-                            submission.id,
-                            submission.title,
-                            user_name=account[2],
-                            status="DELETED",
-                            )
-            submission.delete()
-
-        else:
-            if user.profile.record_keeping == 1:
-                save_output(user.id,
-                            submission.id,
-                            submission.title,
-                            user_name=account[2],
-                            status="SKIPPED")
-
-    logger.info(account[0], 'shredded successfully.')
+    Each run is limited to SHRED_TIME_BUDGET seconds and SHRED_REQUEST_BUDGET
+    API requests, a run that runs out of budget is picked up again at the next
+    tick.
 
+    With record keeping on, each run writes a ShredRun summary, and item
+    records only for deleted items and items that weren't skipped last time.
 
-@exception(logger)
-def check_tokens():
+    :param context: The account's ShredContext, preloaded by run_shredder.
+    :param due: When the run was due (a datetime), used for the latency stats.
+    :param lease: The account's lease.Lease, renewed after every page.
+    :return: Nothing, writes directly to DB.
     """
-    Verifies all Reddit tokens are working, deletes those that aren't.
+    time = context.keep_hours
+    started = datetime.datetime.now(tz=timezone.utc)
+
+    # Resume from the last checkpoint if a run with the same settings died.
+    progress = ShredProgress(context.account_id, ShredCheckpoint.SCHEDULED,
+                             '{}|{}'.format(time, context.karma_exclude),
+                             due=due)
+    reddit_refresh = reddit_client(context.token)
+    budget = RunBudget(reddit_refresh)
+
+    # Iterate through all comments, then all submissions, page by page. Items
+    # skipped last time are only logged again if their status changes.
+    deleted = []
+    skipped = set(context.skipped_ids)
+    skipped_count = 0
+    for page in progress.pages(reddit_refresh, context.user_name,
+                               token=context.token, budget=budget):
+        # Stop if the lease expired and another worker took the account over.
+        if lease is not None and not lease.heartbeat():
+            logger.warning('%s lease lost, stopping.', context.user_id)
+            return
+
+        records = []
+        for item in page:
+            if progress.is_processed(item.id):
+                continue
+
+            # A page can take longer than the lease, renew it as we go.
+            if lease is not None and not lease.keep_alive():
+                logger.warning('%s lease lost, stopping.', context.user_id)
+                return
+
+            status = "SKIPPED"
+            item_time = get_item_time(item.created)
+            if item_time < delta_now(time) \
+                    and item.score < context.karma_exclude \
+                    and item.id not in context.excluded_ids \
+                    and not context.rules.keeps(item):
+                # Items Reddit refuses to delete are skipped, not retried.
+                try:
+                    shred_item(reddit_refresh, item, token=context.token)
+                    status = "DELETED"
+                    deleted.append(item.id)
+                except SkipItem:
+                    logger.warning('Skipped %s, it could not be deleted.',
+                                   item.id)
+
+            changed = status == "DELETED" or item.id not in skipped
+            if status == "SKIPPED":
+                skipped.add(item.id)
+                skipped_count += 1
+            else:
+                skipped.discard(item.id)
+
+            metrics.inc('shredder_items_total', status=status.lower())
+            if context.record_keeping and changed:
+                records.append(output_record(context, item.id, item.body,
+                                             status))
+            progress.processed(item, kept=status == "SKIPPED")
+
+        # Flush the page's records in one insert.
+        with metrics.timer('shredder_db_flush_seconds'):
+            SchedulerOutput.objects.bulk_create(records)
+
+    # Drop the deleted items from the account's history snapshot.
+    remove_items(context.account_id, deleted)
+
+    # The skipped items only keep records from repeating, without record
+    # keeping there is nothing to remember. Once the listing is done, forget
+    # skipped items that have since gone from it (deleted on Reddit by the
+    # user.) A resumed run only saw part of the listing, so only prune after a
+    # complete one.
+    if not context.record_keeping:
+        skipped = set()
+    elif not progress.yielded and not progress.resumed:
+        skipped &= progress.processed_ids
+
+    if skipped != context.skipped_ids:
+        RedditAccounts.objects.filter(pk=context.account_id).update(
+            skipped_ids=','.join(skipped))
+
+    if context.record_keeping:
+        finished = datetime.datetime.now(tz=timezone.utc)
+        ShredRun.objects.create(account_id=context.account_id,
+                                user_id=context.user_id,
+                                reddit_user_name=context.user_name,
+                                started=started,
+                                finished=finished,
+                                deleted=len(deleted),
+                                skipped=skipped_count,
+                                duration=(finished - started).total_seconds(),
+                                api_calls=budget.requests_used,
+                                completed=not progress.yielded)
+
+    # Out of budget, the checkpoint is saved and the run carries on next tick.
+    if progress.yielded:
+        logger.info('%s ran out of budget after %s requests, re-queued.',
+                    context.user_id, budget.requests_used)
+        return
+
+    # Record the latency from the run being due to it finishing.
+    due = progress.checkpoint.due
+    progress.finish()
+    if due is not None:
+        latency = datetime.datetime.now(tz=timezone.utc) - due
+        RedditAccounts.objects.filter(pk=context.account_id).update(
+            shred_latency=latency.total_seconds())
+        logger.info('%s shredded successfully, %.0fs after it was due.',
+                    context.user_id, latency.total_seconds())
+    else:
+        logger.info('%s shredded successfully.', context.user_id)
+
+
+def shred_account(context, due):
+    """
+    Runs schedule_shredder on a worker thread. A failed account (i.e. a token
+    revoked mid-run) is already logged, so the error stops here and the rest of
+    the cycle carries on.
 
+    :param context: The account's ShredContext.
+    :param due: When the run was due.
     :return: Nothing.
     """
-    accounts = RedditAccounts.objects.values_list('reddit_token', flat=True)
-
-    for account in accounts:
-        try:
-            name = get_reddit_username(account)
-
-        # :TODO: not this.
-        except:
-            bad_token = RedditAccounts.objects.filter(reddit_token=account)
-            bad_token.delete()
+    # Only one worker may shred an account at a time. A contended account is
+    # already being shredded, so it is skipped.
+    lease = account_lease(context.account_id)
+    if not lease.acquire():
+        logger.info('%s is already being shredded, skipped.', context.user_id)
+        connection.close()
+        return
+
+    metrics.observe('shredder_queue_wait_seconds',
+                    (datetime.datetime.now(tz=timezone.utc) - due)
+                    .total_seconds(), job='scheduled')
+
+    enabled = profiling.wants_profile(context.account_id)
+    try:
+        with metrics.job('scheduled'), profiling.profiled(
+                'scheduled', enabled, account_id=context.account_id,
+                user_id=context.user_id, keep_hours=context.keep_hours):
+            schedule_shredder(context, due, lease)
+    except Exception:
+        pass
+
+    # Worker threads open their own DB connections, close them when done.
+    finally:
+        lease.release()
+        connection.close()
 
 
 @exception(logger)
 def run_shredder():
     """
-    Wrapper to add threading to the auto shredder jobs.
+    Runs the auto shredder for every account whose slot falls within the
+    current tick (see slots.py). Called by cron every SCHEDULER_TICK minutes,
+    each account is released to the worker pool at its own slot.
 
     :return: Nothing.
     """
-    procs = []
-
-    # Verify all available tokens are valid.
-    # check_tokens() Disabled until I can do better error checking.
-
-    # Init proc for each account in the DB.
-    logger.info('Auto shredder started.')
-    for account in RedditAccounts.objects.values_list('user_id',
-                                                      'schedule',
-                                                      'reddit_user_name',
-                                                      'reddit_token',
-                                                      'id'):
-        proc = Process(target=schedule_shredder(account))
-        logger.info('shredding...', account[0])
-        procs.append(proc)
-        proc.start()
-
-    for proc in procs:
-        proc.join()
+    now = datetime.datetime.now(tz=timezone.utc).timestamp()
+
+    # Make sure each tick only runs once, even if cron fires it twice. The
+    # lease is left to expire rather than released.
+    if not Lease('tick:{}'.format(int(tick_start(now))),
+                 ttl=SCHEDULER_TICK * 120).acquire():
+        logger.info('Tick already running, skipped.')
+        return
+
+    # Get every scheduled account, skipping dead tokens (validity is kept up to
+    # date in the background by token_health.check_tokens.)
+    accounts = list(RedditAccounts.objects.filter(token_valid=True).exclude(
+        schedule=RedditAccounts.NONE).values_list('user_id',
+                                                  'schedule',
+                                                  'reddit_user_name',
+                                                  'reddit_token',
+                                                  'id'))
+    due = due_in_tick(accounts, now)
+
+    # Runs that ran out of budget last time are released first.
+    carried_over = set(ShredCheckpoint.objects.filter(
+        run_kind=ShredCheckpoint.SCHEDULED, yielded=True).values_list(
+        'account_id', flat=True))
+    due_ids = set(account[4] for release, account in due)
+    due = [(now, account) for account in accounts
+           if account[4] in carried_over and account[4] not in due_ids] + due
+
+    # Load the settings and exclusions for every due account in one go, the
+    # workers don't read them from the DB again.
+    contexts = load_contexts([account for release, account in due])
+
+    logger.info('Auto shredder started, %s accounts due.', len(contexts))
+    with ThreadPoolExecutor(max_workers=SHRED_WORKERS) as pool:
+        for release, account in due:
+            if account[4] not in contexts:
+                continue
+
+            # Wait for the account's slot.
+            now = datetime.datetime.now(tz=timezone.utc).timestamp()
+            if release > now:
+                sleep(release - now)
+
+            logger.info('shredding %s...', account[0])
+            release = datetime.datetime.fromtimestamp(release, tz=timezone.utc)
+            pool.submit(shred_account, contexts[account[4]], release)
+
+    # The workers are done, publish the cycle's metrics.
+    metrics.dump(log=True)
 
 
 @exception(logger)
 def purge_db():
     """
     Purges old records from the DB to save space and protect user privacy.
-    Deletes all records older than one day.
+    Records older than one day are moved to the archive (see archive.py),
+    run summaries older than one day and any expired leases are deleted.
 
     :return: Noting, writes directly to DB.
     """
-    model = SchedulerOutput.objects.all()
+    aged = SchedulerOutput.objects.filter(op_run_time__lt=delta_now(24))
+
+    # Archive and delete the aged records a batch at a time.
+    while True:
+        rows = list(aged.order_by('id').values(
+            'user_id', *archive.COLUMNS)[:archive.BATCH_SIZE])
+        if not rows:
+            break
+
+        archive.archive(rows)
+        SchedulerOutput.objects.filter(
+            id__in=[row['id'] for row in rows]).delete()
+
+    # Records without a run time can't be archived by day.
+    SchedulerOutput.objects.filter(op_run_time__isnull=True).delete()
+    archive.expire()
+
+    # Run summaries are kept for the same day.
+    ShredRun.objects.filter(finished__lt=delta_now(24)).delete()
 
-    for item in model:
-        if item.op_run_time < delta_now(24):
-            item.delete()
+    # Expired leases are left behind by finished ticks and dead workers.
+    ShredLease.objects.filter(
+        expires__lt=datetime.datetime.now(tz=timezone.utc)).delete()
@@ -0,0 +1,243 @@
+"""
+Retry layer for Reddit API calls. Errors are sorted into three classes:
+
+    * Transient (network errors, 429s and 5xx responses) are retried with
+      jittered exponential backoff.
+    * Auth failures are retried once with a freshly exchanged access token,
+      then raise AuthFailed. Only the token cache revokes a refresh token,
+      when Reddit refuses to exchange it (TokenRevoked), since a 401 from an
+      ordinary call doesn't mean the refresh token is dead.
+    * Permanent failures (404s, 403s, bad requests) raise SkipItem so the
+      caller can skip the item and carry on.
+
+Transient failures also feed a circuit breaker whose state lives in the shared
+cache. Once Reddit is failing across the board every worker pauses until the
+cool down has passed, instead of hammering the API through the outage.
+"""
+
+import random
+import time
+
+from django.core.cache import cache
+from praw.exceptions import APIException, PRAWException
+from prawcore.exceptions import InvalidToken, OAuthException, PrawcoreException
+from prawcore.exceptions import RequestException, ResponseException
+
+from Reddit_Shredder.settings import CIRCUIT_COOLDOWN
+from Reddit_Shredder.settings import CIRCUIT_THRESHOLD
+from Reddit_Shredder.settings import CIRCUIT_WINDOW
+from Reddit_Shredder.settings import RETRY_ATTEMPTS
+from Reddit_Shredder.settings import RETRY_BACKOFF
+from app import metrics
+from app.logger.exception_logger import logger
+from app.reddit_connection.token_cache import TokenRevoked
+from app.reddit_connection.token_cache import forget_access_token
+
+TRANSIENT = 'Transient'
+AUTH = 'Auth'
+PERMANENT = 'Permanent'
+
+# How often (seconds) a worker re-reads the shared circuit state.
+CIRCUIT_POLL = 1
+
+
+class SkipItem(Exception):
+    """
+    Raised when an API call failed permanently and the item should be skipped.
+    """
+
+
+class AuthFailed(Exception):
+    """
+    Raised when an API call keeps failing auth although the refresh token was
+    exchanged fine. The token is left alone, the call can be tried again later.
+    """
+
+
+class RateLimited(Exception):
+    """
+    Raised by client.CountingSession for 429 responses, which prawcore only
+    reports as an AssertionError.
+    """
+
+
+def classify(error):
+    """
+    Sorts an API error into TRANSIENT, AUTH or PERMANENT.
+
+    :param error: The exception raised by PRAW / prawcore.
+    :return: The error class, None for errors that didn't come from the API.
+    """
+    if isinstance(error, (TokenRevoked, InvalidToken, OAuthException)):
+        return AUTH
+
+    if isinstance(error, (RequestException, RateLimited)):
+        return TRANSIENT
+
+    if isinstance(error, ResponseException):
+        status = error.response.status_code
+        if status == 401:
+            return AUTH
+        if status == 429 or status >= 500:
+            return TRANSIENT
+
+    # Reddit reports rate limiting on edits as an API error.
+    if isinstance(error, APIException) and error.error_type == 'RATELIMIT':
+        return TRANSIENT
+
+    if isinstance(error, (PrawcoreException, PRAWException)):
+        return PERMANENT
+
+    # Not an API error at all.
+    return None
+
+
+def is_rate_limited(error):
+    """
+    :param error: The exception raised by PRAW / prawcore.
+    :return: True if Reddit turned the request down for rate limiting.
+    """
+    if isinstance(error, RateLimited):
+        return True
+
+    if isinstance(error, ResponseException):
+        return error.response.status_code == 429
+
+    return isinstance(error, APIException) and error.error_type == 'RATELIMIT'
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker shared by every worker through the cache. The breaker
+    opens when CIRCUIT_THRESHOLD transient failures happen within
+    CIRCUIT_WINDOW seconds, and stays open for CIRCUIT_COOLDOWN seconds.
+    """
+
+    def __init__(self):
+        self._open_until = 0
+        self._checked = 0
+        self._failing = False
+
+    def wait(self):
+        """
+        Blocks while the circuit is open.
+
+        :return: Nothing.
+        """
+        now = time.time()
+
+        # Only poll the shared state every CIRCUIT_POLL seconds, this is called
+        # before every API request.
+        if now - self._checked > CIRCUIT_POLL:
+            self._open_until = cache.get('circuit_open_until', 0)
+            self._checked = now
+
+        if self._open_until > now:
+            logger.warning('Circuit open, pausing for %.1fs.',
+                           self._open_until - now)
+            time.sleep(self._open_until - now)
+
+    def record_failure(self):
+        """
+        Counts a transient failure and opens the circuit past the threshold.
+
+        :return: Nothing.
+        """
+        self._failing = True
+        cache.add('circuit_failures', 0, CIRCUIT_WINDOW)
+        try:
+            failures = cache.incr('circuit_failures')
+        except ValueError:
+            failures = 1
+            cache.set('circuit_failures', failures, CIRCUIT_WINDOW)
+
+        if failures >= CIRCUIT_THRESHOLD:
+            self._open_until = time.time() + CIRCUIT_COOLDOWN
+            self._checked = time.time()
+            cache.set('circuit_open_until', self._open_until, CIRCUIT_COOLDOWN)
+            cache.delete('circuit_failures')
+
+    def record_success(self):
+        """
+        Resets the failure count after this worker has seen failures.
+
+        :return: Nothing.
+        """
+        if self._failing:
+            self._failing = False
+            cache.delete('circuit_failures')
+
+
+breaker = CircuitBreaker()
+
+
+def backoff(attempt):
+    """
+    Returns a jittered exponential backoff delay ("full jitter").
+
+    :param attempt: The number of failed attempts so far, starting at 0.
+    :return: The delay in seconds.
+    """
+    return random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+
+
+def call_with_retry(func, *args, token=None, **kwargs):
+    """
+    Calls an API function, retrying transient errors.
+
+    :param func: The function to call.
+    :param args: Passed to func.
+    :param token: The refresh token in use, its cached access token is dropped
+                  on auth errors.
+    :param kwargs: Passed to func.
+    :return: Whatever func returns.
+    """
+    retried_auth = False
+    for attempt in range(RETRY_ATTEMPTS):
+        breaker.wait()
+
+        try:
+            result = func(*args, **kwargs)
+
+        except Exception as error:
+            kind = classify(error)
+
+            if kind is None:
+                raise
+
+            if kind == AUTH:
+                # Reddit refused the refresh token itself, the token cache
+                # has already marked it as invalid.
+                if isinstance(error, TokenRevoked):
+                    raise
+
+                # A 401 usually means a stale access token, try once more
+                # with a fresh one. The refresh token is only revoked if the
+                # exchange fails, which raises TokenRevoked above.
+                if token is not None:
+                    forget_access_token(token)
+                if not retried_auth and attempt < RETRY_ATTEMPTS - 1:
+                    retried_auth = True
+                    logger.warning('Auth error in %s (%s), retrying.',
+                                   func.__name__, error)
+                    continue
+
+                raise AuthFailed from error
+
+            if kind == PERMANENT:
+                raise SkipItem from error
+
+            # Transient, give up once out of attempts.
+            if is_rate_limited(error):
+                metrics.inc('shredder_rate_limited_total')
+            breaker.record_failure()
+            if attempt == RETRY_ATTEMPTS - 1:
+                raise
+
+            logger.warning('Transient error in %s (%s), retrying.',
+                           func.__name__, error)
+            time.sleep(backoff(attempt))
+            continue
+
+        breaker.record_success()
+        return result
@@ -0,0 +1,89 @@
+"""
+Per-account context for a scheduler cycle. Everything a scheduled run needs to
+know about an account (its token, the owner's settings, exclusions and compiled
+exclusion rules, and the items its last run skipped) is loaded for every due
+account up front, in a fixed number of queries, instead of one round of queries
+per account.
+"""
+
+from collections import defaultdict, namedtuple
+
+from app.models import ExcludedItems, Profile, RedditAccounts
+from app.reddit_connection.exclusion_rules import load_matchers
+
+# Schedule -> the age (in hours) past which items are shredded.
+KEEP_HOURS = {
+    RedditAccounts.DAILY: 24,
+    RedditAccounts.WEEKLY: 168,
+    RedditAccounts.MONTHLY: 672,
+}
+
+ShredContext = namedtuple('ShredContext', [
+    'account_id',
+    'user_id',
+    'user_name',
+    'token',
+    'keep_hours',
+    'karma_exclude',
+    'record_keeping',
+    'excluded_ids',
+    'skipped_ids',
+    'rules',
+])
+
+
+def load_contexts(accounts):
+    """
+    Builds the contexts for a list of accounts, using four queries no matter
+    how many accounts there are.
+
+    :param accounts: Tuples of (user_id, schedule, reddit_user_name,
+                     reddit_token, id) as selected by run_shredder.
+    :return: A dict of RedditAccounts PK -> ShredContext.
+    """
+    user_ids = set(account[0] for account in accounts)
+
+    # The owners' karma threshold and record keeping settings.
+    profiles = {}
+    for user_id, karma_exclude, record_keeping in Profile.objects.filter(
+            user_id__in=user_ids).values_list('user_id',
+                                              'karma_exclude',
+                                              'record_keeping'):
+        profiles[user_id] = (karma_exclude, record_keeping)
+
+    # The owners' manual exclusions.
+    excluded = defaultdict(set)
+    for user_id, item_id in ExcludedItems.objects.filter(
+            user_id__in=user_ids).values_list('user_id', 'excluded_item_id'):
+        excluded[user_id].add(item_id)
+
+    # The items each account's last run skipped.
+    skipped = dict(RedditAccounts.objects.filter(
+        id__in=[account[4] for account in accounts]).values_list(
+        'id', 'skipped_ids'))
+
+    # The owners' exclusion rules, compiled.
+    rules = load_matchers(user_ids)
+
+    contexts = {}
+    for user_id, schedule, user_name, token, account_id in accounts:
+        # Skip orphaned accounts and accounts without a schedule.
+        if user_id not in profiles or schedule not in KEEP_HOURS:
+            continue
+
+        karma_exclude, record_keeping = profiles[user_id]
+        contexts[account_id] = ShredContext(
+            account_id=account_id,
+            user_id=user_id,
+            user_name=user_name,
+            token=token,
+            keep_hours=KEEP_HOURS[schedule],
+            karma_exclude=karma_exclude,
+            record_keeping=record_keeping,
+            excluded_ids=frozenset(excluded[user_id]),
+            skipped_ids=frozenset(filter(None, skipped.get(
+                account_id, '').split(','))),
+            rules=rules[user_id],
+        )
+
+    return contexts
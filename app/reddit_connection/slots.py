@@ -0,0 +1,56 @@
+"""
+Slot assignment for the auto shredder. Every account gets a stable slot within
+the schedule period, derived from a hash of its PK, so the accounts are spread
+evenly across the hour instead of all starting at minute zero. Cron wakes the
+scheduler every SCHEDULER_TICK minutes and it releases the accounts whose slots
+fall within that tick, each at its own slot plus a little jitter.
+"""
+
+import hashlib
+import random
+
+from Reddit_Shredder.settings import SCHEDULE_PERIOD
+from Reddit_Shredder.settings import SCHEDULER_TICK
+from Reddit_Shredder.settings import SLOT_JITTER
+
+
+def account_slot(account_id):
+    """
+    Returns the account's slot, in seconds from the start of the period.
+
+    :param account_id: The RedditAccounts PK.
+    :return: The slot offset in seconds.
+    """
+    digest = hashlib.sha256('slot:{}'.format(account_id).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % SCHEDULE_PERIOD
+
+
+def tick_start(now):
+    """
+    Returns the start of the tick that contains now.
+
+    :param now: A unix timestamp.
+    :return: A unix timestamp.
+    """
+    return now - now % (SCHEDULER_TICK * 60)
+
+
+def due_in_tick(accounts, now):
+    """
+    Picks the accounts whose slots fall within the current tick.
+
+    :param accounts: Account tuples, the PK must be the last value.
+    :param now: A unix timestamp.
+    :return: A list of (release time, account) tuples, sorted by release time.
+    """
+    start = tick_start(now)
+    period_start = start - start % SCHEDULE_PERIOD
+    end = start + SCHEDULER_TICK * 60
+
+    due = []
+    for account in accounts:
+        release = period_start + account_slot(account[-1])
+        if start <= release < end:
+            due.append((release + random.uniform(0, SLOT_JITTER), account))
+
+    return sorted(due, key=lambda pair: pair[0])
@@ -0,0 +1,185 @@
+"""
+Shared access token cache. Every refresh token based client exchanges its
+refresh token for a one hour access token. The access tokens are stored in the
+Django cache (which is shared by the web workers and the cron jobs) keyed by a
+hash of the refresh token, so the exchange happens once per hour per account
+instead of once per client.
+
+Revoked tokens are marked as invalid on the RedditAccounts table and raise
+TokenRevoked, which callers can catch without aborting a batch run. Only a
+definite refusal (an OAuth error or a 400 / 401 invalid_grant) revokes a token,
+5xx, 429 and network errors are raised as they are so the retry layer treats
+them as transient.
+"""
+
+import hashlib
+import time
+
+from django.core.cache import cache
+from prawcore import Authorizer
+from prawcore.exceptions import OAuthException, ResponseException
+
+from Reddit_Shredder.settings import ACCESS_TOKEN_REFRESH_MARGIN
+from Reddit_Shredder.settings import REVOKED_TOKEN_TTL
+from app.logger.exception_logger import logger
+from app.models import RedditAccounts
+
+
+class TokenRevoked(Exception):
+    """
+    Raised when Reddit refuses to exchange a refresh token.
+    """
+
+
+def cache_key(token, prefix='access_token'):
+    """
+    Returns the cache key for a refresh token. The token itself is hashed so it
+    never ends up in a cache key.
+
+    :param token: The user's saved refresh token.
+    :param prefix: The key prefix.
+    :return: A cache key.
+    """
+    digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    return '{}_{}'.format(prefix, digest)
+
+
+def is_revoked(error):
+    """
+    Checks if a token endpoint error means the refresh token is dead.
+
+    :param error: The exception raised by the token exchange.
+    :return: True for OAuth errors and 400 / 401 invalid_grant responses.
+    """
+    if isinstance(error, OAuthException):
+        return True
+
+    if isinstance(error, ResponseException) \
+            and error.response.status_code in (400, 401):
+        try:
+            return error.response.json().get('error') == 'invalid_grant'
+        except ValueError:
+            return False
+
+    return False
+
+
+def mark_token_invalid(token):
+    """
+    Flags a refresh token as revoked, both in the cache (so other processes
+    fail fast for REVOKED_TOKEN_TTL seconds) and on the RedditAccounts table.
+
+    :param token: The user's saved refresh token.
+    :return: Nothing.
+    """
+    cache.delete(cache_key(token))
+    cache.set(cache_key(token, 'revoked_token'), True, REVOKED_TOKEN_TTL)
+    RedditAccounts.objects.filter(reddit_token=token).update(token_valid=False)
+    logger.info('Refresh token marked as revoked.')
+
+
+def forget_access_token(token):
+    """
+    Drops a refresh token's cached access token, so the next request exchanges
+    the refresh token again.
+
+    :param token: The user's saved refresh token.
+    :return: Nothing.
+    """
+    cache.delete(cache_key(token))
+
+
+def mark_token_valid(token):
+    """
+    Clears a refresh token's revoked flag, in the cache and on the
+    RedditAccounts table.
+
+    :param token: The user's saved refresh token.
+    :return: Nothing.
+    """
+    cache.delete(cache_key(token, 'revoked_token'))
+    RedditAccounts.objects.filter(reddit_token=token).update(token_valid=True)
+
+
+def forget_tokens(tokens):
+    """
+    Drops the cached access tokens and revoked flags of deleted accounts.
+
+    :param tokens: The accounts' refresh tokens.
+    :return: Nothing.
+    """
+    cache.delete_many([cache_key(token, prefix) for token in tokens
+                       for prefix in ('access_token', 'revoked_token')])
+
+
+class CachedAuthorizer(Authorizer):
+    """
+    A prawcore Authorizer that reads and writes its access token through the
+    shared cache.
+    """
+
+    def __init__(self, authenticator, refresh_token, check_revoked=True):
+        """
+        :param authenticator: The prawcore authenticator.
+        :param refresh_token: The user's saved refresh token.
+        :param check_revoked: False to ask Reddit even if the token is flagged
+                              as revoked (used by the token health check.)
+        """
+        super(CachedAuthorizer, self).__init__(authenticator, refresh_token)
+        self.check_revoked = check_revoked
+
+    def refresh(self):
+        """
+        Loads a cached access token, or exchanges the refresh token for a new
+        one and caches it until shortly before it expires.
+        """
+        key = cache_key(self.refresh_token)
+
+        if self.check_revoked and \
+                cache.get(cache_key(self.refresh_token, 'revoked_token')):
+            raise TokenRevoked
+
+        cached = cache.get(key)
+        if cached is not None and \
+                cached['expires'] - ACCESS_TOKEN_REFRESH_MARGIN > time.time():
+            self.access_token = cached['access_token']
+            self._expiration_timestamp = cached['expires']
+            self.scopes = set(cached['scopes'])
+            return
+
+        try:
+            super(CachedAuthorizer, self).refresh()
+
+        # Reddit answers a revoked refresh token with an OAuth error or a
+        # 400 invalid_grant, anything else is left to the retry layer.
+        except (OAuthException, ResponseException) as error:
+            if not is_revoked(error):
+                raise
+            mark_token_invalid(self.refresh_token)
+            raise TokenRevoked from error
+
+        # Cache the new token until the refresh margin is reached.
+        timeout = self._expiration_timestamp - ACCESS_TOKEN_REFRESH_MARGIN
+        timeout = int(timeout - time.time())
+        if timeout > 0:
+            cache.set(key,
+                      {
+                          'access_token': self.access_token,
+                          'expires': self._expiration_timestamp,
+                          'scopes': sorted(self.scopes),
+                      },
+                      timeout)
+
+    def _clear_access_token(self):
+        """
+        Evicts the cached access token when prawcore discards it (i.e. after a
+        401), otherwise the next refresh would load the same dead token.
+        """
+        if getattr(self, 'access_token', None) is not None:
+            key = cache_key(self.refresh_token)
+            cached = cache.get(key)
+            # Only evict our own token, another process may have replaced it.
+            if cached is not None and \
+                    cached['access_token'] == self.access_token:
+                cache.delete(key)
+        super(CachedAuthorizer, self)._clear_access_token()
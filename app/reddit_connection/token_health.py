@@ -0,0 +1,96 @@
+"""
+Background token health checks. Runs via cron, off the top of the hour, and
+validates every Reddit token that hasn't been checked recently. Checks run
+concurrently with a bounded number of workers, transient errors are retried
+with exponential backoff. The result is stored on the RedditAccounts row so the
+scheduler can skip dead tokens without touching the API.
+"""
+
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+from django.db.models import Q
+from django.utils.timezone import timedelta
+from prawcore.exceptions import Forbidden, InvalidToken, OAuthException
+from prawcore.exceptions import RequestException, ResponseException
+
+from Reddit_Shredder.settings import TOKEN_CHECK_BACKOFF
+from Reddit_Shredder.settings import TOKEN_CHECK_INTERVAL
+from Reddit_Shredder.settings import TOKEN_CHECK_RETRIES
+from Reddit_Shredder.settings import TOKEN_CHECK_WORKERS
+from app.logger.exception_decor import exception
+from app.logger.exception_logger import logger
+from app.models import RedditAccounts
+from app.reddit_connection.client import reddit_client
+from app.reddit_connection.retry import RateLimited
+from app.reddit_connection.token_cache import TokenRevoked
+from app.reddit_connection.token_cache import forget_access_token
+from app.reddit_connection.token_cache import mark_token_valid
+
+
+def check_token(token):
+    """
+    Checks a single token against the API. The check always asks Reddit, even
+    if the token is flagged as revoked, so a wrongly flagged token recovers.
+
+    :param token: The user's saved refresh token.
+    :return: True if the token works, False if it is dead and None if the
+             check kept failing for transient reasons.
+    """
+    for attempt in range(TOKEN_CHECK_RETRIES):
+        try:
+            reddit_client(token, check_revoked=False).user.me()
+            return True
+
+        # The token has been revoked or has lost its scopes.
+        except (TokenRevoked, Forbidden, OAuthException):
+            return False
+
+        # A 401 may only mean a stale cached access token, the next attempt
+        # exchanges the refresh token again.
+        except InvalidToken:
+            forget_access_token(token)
+            time.sleep(TOKEN_CHECK_BACKOFF * 2 ** attempt)
+
+        # Network errors and 5xx / 429 responses are worth another try.
+        except (RequestException, ResponseException, RateLimited):
+            time.sleep(TOKEN_CHECK_BACKOFF * 2 ** attempt)
+
+    return None
+
+
+@exception(logger)
+def check_tokens():
+    """
+    Verifies every token that is due for a check and stores the result. Dead
+    tokens are flagged, not deleted, so the user can re-authorize them.
+
+    :return: Nothing, writes directly to DB.
+    """
+    now = datetime.datetime.now(tz=timezone.utc)
+    due = now - timedelta(seconds=TOKEN_CHECK_INTERVAL)
+
+    accounts = list(RedditAccounts.objects.filter(
+        Q(token_checked__isnull=True) | Q(token_checked__lt=due)).values_list(
+        'id', 'reddit_token'))
+
+    # The workers only talk to the API, the DB writes happen on this thread.
+    with ThreadPoolExecutor(max_workers=TOKEN_CHECK_WORKERS) as pool:
+        results = pool.map(check_token, [account[1] for account in accounts])
+
+        for account, valid in zip(accounts, results):
+            # Leave the account alone if the API never gave a clear answer.
+            if valid is None:
+                continue
+
+            # A working token also loses any revoked flag left in the cache.
+            if valid:
+                mark_token_valid(account[1])
+
+            RedditAccounts.objects.filter(pk=account[0]).update(
+                token_valid=valid,
+                token_checked=datetime.datetime.now(tz=timezone.utc))
+
+    logger.info('Checked %s tokens.', len(accounts))
@@ -0,0 +1,25 @@
+"""
+Tests for the active user tracking behind the snapshot warmer.
+"""
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from app.cache_functions.active_users import active_users, mark_active
+
+
+class ActiveUserTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_users_are_tracked_separately(self):
+        mark_active(1)
+        mark_active(2)
+        self.assertEqual(set(active_users([1, 2, 3])), {1, 2})
+
+    def test_a_user_is_written_once_per_window(self):
+        mark_active(1)
+        first = active_users([1])[1]
+        mark_active(1)
+        self.assertEqual(active_users([1]), {1: first})
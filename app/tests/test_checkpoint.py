@@ -0,0 +1,138 @@
+"""
+Tests for checkpointed, resumable shred runs.
+"""
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from app.models import ShredCheckpoint
+from app.reddit_connection.checkpoint import WINDOW, ShredProgress
+from app.reddit_connection.lease import Lease
+from app.reddit_connection.listing import PAGE_SIZE, ItemRecord
+
+
+class FakeListing(object):
+    """
+    A user's comments, newest first. Deleted items drop out of the listing.
+    """
+
+    def __init__(self, count):
+        self.items = [ItemRecord({'id': 'c{:04d}'.format(number),
+                                  'created': 10000 - number,
+                                  'score': 1,
+                                  'body': 'comment',
+                                  'subreddit': 'test'}, 'Comment')
+                      for number in range(count)]
+
+    def fetch_page(self, reddit_refresh, user_name, phase, after=None,
+                   body_length=None):
+        if phase != ShredCheckpoint.COMMENTS:
+            return []
+
+        fullnames = [item.fullname for item in self.items]
+        start = fullnames.index(after) + 1 if after else 0
+        return self.items[start:start + PAGE_SIZE]
+
+    def delete(self, item):
+        self.items.remove(item)
+
+
+def shred(progress, listing, handled, stop_after=None):
+    """
+    Keeps every tenth item and deletes the rest, like a scheduled run.
+
+    :param stop_after: Stop (as if the worker died) once this many pages have
+                       been handled and checkpointed.
+    """
+    pages = 0
+    for page in progress.pages(None, 'shredder'):
+        if pages == stop_after:
+            return
+
+        for item in page:
+            if progress.is_processed(item.id):
+                continue
+
+            kept = int(item.id[1:]) % 10 == 0
+            if not kept:
+                listing.delete(item)
+            handled.append(item.id)
+            progress.processed(item, kept=kept)
+
+        pages += 1
+
+
+class CheckpointTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.listing = FakeListing(1000)
+        patcher = mock.patch('app.reddit_connection.checkpoint.fetch_page',
+                             self.listing.fetch_page)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resume_handles_every_item_once(self):
+        handled = []
+
+        # The first run dies after three pages.
+        progress = ShredProgress(1, ShredCheckpoint.SCHEDULED, '24|1')
+        shred(progress, self.listing, handled, stop_after=3)
+        self.assertFalse(progress.resumed)
+
+        progress = ShredProgress(1, ShredCheckpoint.SCHEDULED, '24|1')
+        self.assertTrue(progress.resumed)
+        shred(progress, self.listing, handled)
+
+        self.assertEqual(sorted(handled), sorted(set(handled)))
+        self.assertEqual(len(handled), 1000)
+        self.assertEqual(len(self.listing.items), 100)
+
+    def test_saved_ids_stay_within_the_window(self):
+        # Nothing is kept, so the cursor never moves.
+        progress = ShredProgress(1, ShredCheckpoint.SCHEDULED, '24|1')
+        for number, page in enumerate(progress.pages(None, 'shredder')):
+            # The checkpoint of the last page has been saved by now.
+            if number:
+                saved = ShredCheckpoint.objects.get(
+                    account_id=1).processed_ids
+                self.assertLessEqual(len(saved.split(',')), WINDOW)
+
+            for item in page:
+                self.listing.delete(item)
+                progress.processed(item, kept=False)
+
+        self.assertEqual(self.listing.items, [])
+
+    def test_changed_settings_start_over(self):
+        progress = ShredProgress(1, ShredCheckpoint.SCHEDULED, '24|1')
+        shred(progress, self.listing, [], stop_after=1)
+
+        progress = ShredProgress(1, ShredCheckpoint.SCHEDULED, '168|1')
+        self.assertFalse(progress.resumed)
+        self.assertEqual(progress.checkpoint.cursor, '')
+
+
+class LeaseTests(TestCase):
+
+    def test_keep_alive_renews_after_a_third_of_the_ttl(self):
+        lease = Lease('account:1', ttl=30)
+        self.assertTrue(lease.acquire())
+
+        with mock.patch.object(lease, 'heartbeat',
+                               return_value=True) as heartbeat:
+            lease.keep_alive()
+            self.assertFalse(heartbeat.called)
+
+            lease._renewed -= 11
+            lease.keep_alive()
+            self.assertTrue(heartbeat.called)
+
+    def test_lost_lease_is_reported(self):
+        lease = Lease('account:1', ttl=30)
+        self.assertTrue(lease.acquire())
+        lease.owner = 'someone else'
+        lease._renewed -= 11
+        self.assertFalse(lease.keep_alive())
@@ -0,0 +1,42 @@
+"""
+Tests for the manual delete page.
+"""
+
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from app.models import RedditAccounts
+
+
+@mock.patch('app.views.remove_items')
+@mock.patch('app.views.delete_comment', return_value='Deleted.')
+class DeleteTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('shredder', password='password')
+        other = User.objects.create_user('other', password='password')
+        RedditAccounts.objects.create(user_id=self.user.id,
+                                      reddit_user_name='mine',
+                                      reddit_token='my token')
+        RedditAccounts.objects.create(user_id=other.id,
+                                      reddit_user_name='theirs',
+                                      reddit_token='their token')
+        self.client.force_login(self.user)
+
+    def delete(self, user_name):
+        return self.client.get('/profile/delete/', {
+            'delete': 'abc', 'user_name': user_name, 'item_type': 'Comment'})
+
+    def test_own_account(self, delete_comment, remove_items):
+        response = self.delete('mine')
+        self.assertEqual(response.status_code, 302)
+        delete_comment.assert_called_once_with('abc', 'my token', 'Comment')
+
+    def test_other_users_account(self, delete_comment, remove_items):
+        for user_name in ('theirs', 'unknown'):
+            response = self.delete(user_name)
+            self.assertEqual(response.status_code, 302)
+        delete_comment.assert_not_called()
+        remove_items.assert_not_called()
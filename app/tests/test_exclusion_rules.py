@@ -0,0 +1,107 @@
+"""
+Tests for the compiled exclusion rules.
+"""
+
+from unittest import mock
+
+import time
+
+import regex
+from django.test import TestCase
+
+from app.cache_functions.history_snapshot import HistoryItem
+from app.forms import ExclusionRuleForm
+from app.models import ExclusionRule
+from app.reddit_connection.exclusion_rules import RuleMatcher, load_matchers
+from app.reddit_connection.exclusion_rules import is_valid_regex
+
+
+def item(body, subreddit='test', score=1, created=0):
+    return HistoryItem('abc', 'Comment', created, score, body, subreddit)
+
+
+def matcher(*regexes, keywords=()):
+    return RuleMatcher([(ExclusionRule.REGEX, regex, None, None)
+                        for regex in regexes]
+                       + [(ExclusionRule.KEYWORD, keyword, None, None)
+                          for keyword in keywords])
+
+
+class RuleMatcherTests(TestCase):
+
+    def test_keywords_and_regexes(self):
+        rules = matcher(r'\bfoo\d+', keywords=['a.b'])
+        self.assertTrue(rules.keeps(item('has FOO12 in it')))
+        self.assertTrue(rules.keeps(item('literal a.b')))
+        self.assertFalse(rules.keeps(item('axb, food')))
+
+    def test_groups_do_not_interfere(self):
+        # Each regex keeps its own group numbering.
+        rules = matcher('(a)x', '(b)y')
+        self.assertTrue(rules.keeps(item('by')))
+        self.assertTrue(rules.keeps(item('ax')))
+
+    def test_bad_regexes_only_lose_their_rule(self):
+        rules = matcher('(?P<x>a)', '(?P<x>b)', '(', r'(b)\1', 'keep')
+        self.assertTrue(rules.keeps(item('keep me')))
+        self.assertFalse(rules.keeps(item('a b bb')))
+
+    def test_only_the_start_of_the_body_is_searched(self):
+        rules = matcher('needle')
+        self.assertTrue(rules.keeps(item('needle' + 'x' * 1000)))
+        self.assertFalse(rules.keeps(item('x' * 1000 + 'needle')))
+
+    @mock.patch('app.reddit_connection.exclusion_rules.RULE_REGEX_TIMEOUT',
+                0.01)
+    def test_runaway_regexes_keep_everything(self):
+        rules = matcher('keep')
+        rules.patterns.append(regex.compile('(x+x+)+y'))
+        self.assertTrue(rules.keeps(item('x' * 300)))
+        self.assertTrue(rules.timed_out)
+        self.assertTrue(rules.keeps(item('nothing to see')))
+
+    def test_slow_shapes_stay_fast(self):
+        for pattern in ('[a-z]+[a-z]+[a-z]+[a-z]+[a-z]+!', r'\w*\w*\w*\w*!'):
+            rules = matcher(pattern)
+            start = time.monotonic()
+            rules.keeps(item('a' * 1000))
+            self.assertLess(time.monotonic() - start, 0.5, pattern)
+
+    def test_subreddits_scores_and_ages(self):
+        rules = RuleMatcher([
+            (ExclusionRule.KEEP_SUBREDDIT, 'Keep', None, None),
+            (ExclusionRule.SCORE, None, 10, None),
+            (ExclusionRule.AGE, None, None, 24),
+        ])
+        self.assertTrue(rules.keeps(item('', subreddit='keep')))
+        self.assertTrue(rules.keeps(item('', score=50)))
+        self.assertTrue(rules.keeps(item('', created=1000), now=3600))
+        self.assertFalse(rules.keeps(item('', created=0), now=48 * 3600))
+
+    def test_load_matchers_covers_every_user(self):
+        ExclusionRule.objects.create(user_id=1, kind=ExclusionRule.REGEX,
+                                     value='(?P<x>a)|(?P<x>b)')
+        ExclusionRule.objects.create(user_id=1, kind=ExclusionRule.KEYWORD,
+                                     value='keep')
+        matchers = load_matchers([1, 2])
+        self.assertTrue(matchers[1].keeps(item('keep')))
+        self.assertTrue(matchers[2].empty)
+
+
+class RegexValidationTests(TestCase):
+
+    def test_rejected(self):
+        for regex in ('(', '(?P<name>a)', '(a)(?P=name)', r'(a)\1',
+                      r'(?(1)a|b)', '(a+)+', r'(\w*)*', '(a|aa)+',
+                      'x' * 201):
+            self.assertFalse(is_valid_regex(regex), regex)
+
+    def test_accepted(self):
+        for regex in (r'\bfoo\b', '(?:ab)+', 'colou?r', '[0-9]{3}',
+                      '(a|b)c', r'\\1'):
+            self.assertTrue(is_valid_regex(regex), regex)
+
+    def test_form_rejects_backreferences(self):
+        form = ExclusionRuleForm({'kind': ExclusionRule.REGEX,
+                                  'value': r'(a)\1'})
+        self.assertFalse(form.is_valid())
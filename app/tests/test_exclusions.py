@@ -0,0 +1,48 @@
+"""
+Tests for the batch exclusions API.
+"""
+
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from app.models import ExcludedItems
+
+
+class ExcludeBatchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shredder', password='password')
+        self.client.force_login(self.user)
+
+    def post(self, batch):
+        return self.client.post('/profile/exclude/batch/', json.dumps(batch),
+                                content_type='application/json')
+
+    def excluded(self):
+        return sorted(ExcludedItems.objects.filter(
+            user_id=self.user.id).values_list('excluded_item_id', flat=True))
+
+    def test_set_and_unset(self):
+        response = self.post({'set': ['abc1', 'def2']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()['added']), ['abc1', 'def2'])
+
+        self.post({'unset': ['abc1']})
+        self.assertEqual(self.excluded(), ['def2'])
+
+    def test_a_bare_string_is_rejected(self):
+        response = self.post({'set': 'abc1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.excluded(), [])
+
+    def test_malformed_ids_are_rejected(self):
+        for batch in ({'set': ['x' * 21]}, {'set': ['abc', 'a b']},
+                      {'unset': ['y' * 50]}, {'set': [123]},
+                      {'set': ['']}, {'unset': [['abc']]}):
+            response = self.post(batch)
+            self.assertEqual(response.status_code, 400, batch)
+        self.assertEqual(self.excluded(), [])
@@ -0,0 +1,38 @@
+"""
+Tests for the metrics endpoint.
+"""
+
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+
+@mock.patch('app.views.METRICS_TOKEN', 'secret')
+class MetricsEndpointTests(TestCase):
+
+    def test_bearer_token(self):
+        response = self.client.get('/metrics/',
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_wrong_or_missing_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 404)
+        self.assertEqual(self.client.get(
+            '/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+
+    def test_local_address_is_not_enough(self):
+        response = self.client.get('/metrics/', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_staff(self):
+        user = User.objects.create_user('staff', password='password',
+                                        is_staff=True)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+
+    def test_blank_token_is_staff_only(self):
+        with mock.patch('app.views.METRICS_TOKEN', ''):
+            response = self.client.get('/metrics/',
+                                       HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(response.status_code, 404)
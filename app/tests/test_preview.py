@@ -0,0 +1,112 @@
+"""
+Tests that the shredder preview counts what manual_shred deletes.
+"""
+
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from app.cache_functions.history_snapshot import HistoryItem
+from app.cache_functions.preview_index import HistoryIndex
+from app.models import ExclusionRule, RedditAccounts
+from app.reddit_connection.exclusion_rules import RuleMatcher
+from app.reddit_connection.reddit_connection import manual_shred
+from app.tests.test_checkpoint import FakeListing
+
+
+def history(count):
+    """
+    :return: count HistoryItems of mixed types, ages, scores and bodies.
+    """
+    now = int(time.time())
+    return [HistoryItem('i{}'.format(number),
+                        'Comment' if number % 3 else 'Submission',
+                        now - number * 1800,
+                        number % 7 - 2,
+                        'secret plans' if number % 5 == 0 else 'hello',
+                        'keepme' if number % 11 == 0 else 'test')
+            for number in range(count)]
+
+
+class PreviewTests(TestCase):
+
+    def test_counts_match_the_manual_selection(self):
+        items = history(500)
+        index = HistoryIndex(items)
+        rules = RuleMatcher([(ExclusionRule.KEYWORD, 'secret', None, None),
+                             (ExclusionRule.KEEP_SUBREDDIT, 'keepme', None,
+                              None),
+                             (ExclusionRule.SCORE, None, 3, None),
+                             (ExclusionRule.AGE, None, 5, 40)])
+        excluded = frozenset({'i20', 'i21', 'i22', 'i400', 'missing'})
+
+        for keep, karma_limit in ((0, 10), (24, 1), (100, 0), (1000, 4)):
+            for matcher in (None, rules):
+                counts = index.preview(keep, karma_limit, False, excluded,
+                                       matcher)
+                cutoff = time.time() - keep * 3600
+
+                # The check manual_shred makes, item by item.
+                for item_type in ('Comment', 'Submission'):
+                    expected = sum(
+                        1 for item in items if item.item_type == item_type
+                        and item.created < cutoff
+                        and item.score <= karma_limit
+                        and item.id not in excluded
+                        and (matcher is None or not matcher.keeps(item)))
+                    self.assertEqual(counts[item_type], expected)
+
+    def test_rule_verdicts_are_reused(self):
+        index = HistoryIndex(history(200))
+        rules = RuleMatcher([(ExclusionRule.KEYWORD, 'secret', None, None)])
+        first = index.preview(24, 1, False, frozenset(), rules)
+
+        with mock.patch.object(RuleMatcher, 'keeps_content') as keeps:
+            again = index.preview(24, 1, False, frozenset(),
+                                  RuleMatcher([(ExclusionRule.KEYWORD,
+                                                'secret', None, None)]))
+        keeps.assert_not_called()
+        self.assertEqual(again, first)
+
+        changed = index.preview(24, 1, False, frozenset(),
+                                RuleMatcher([(ExclusionRule.KEYWORD,
+                                              'hello', None, None)]))
+        self.assertNotEqual(changed, first)
+
+    def test_everything_ignores_exclusions(self):
+        index = HistoryIndex(history(50))
+        rules = RuleMatcher([(ExclusionRule.KEYWORD, 'hello', None, None)])
+        counts = index.preview(0, 1, True, frozenset({'i1'}), rules)
+        self.assertEqual(counts['Comment'] + counts['Submission'], 50)
+        self.assertEqual(counts['Kept'], 0)
+
+
+class ManualShredTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.account = RedditAccounts.objects.create(
+            user_id=1, reddit_user_name='shredder', reddit_token='token')
+
+    def shred(self, **kwargs):
+        listing = FakeListing(5)
+        with mock.patch('app.reddit_connection.checkpoint.fetch_page',
+                        listing.fetch_page), \
+                mock.patch('app.reddit_connection.reddit_connection.'
+                           'reddit_client'), \
+                mock.patch('app.reddit_connection.reddit_connection.'
+                           'shred_item'):
+            output = manual_shred('token', self.account.id, 0, 10, **kwargs)
+        return {row['cid']: row['status'] for row in output}
+
+    def test_excluded_items_are_kept(self):
+        statuses = self.shred(everything=False,
+                              excluded=frozenset({'c0001'}))
+        self.assertEqual(statuses['c0001'], 'SKIPPED')
+        self.assertEqual(statuses['c0002'], 'DELETED')
+
+    def test_everything_deletes_excluded_items(self):
+        statuses = self.shred(everything=True, excluded=frozenset({'c0001'}))
+        self.assertEqual(statuses['c0001'], 'DELETED')
@@ -0,0 +1,96 @@
+"""
+Holds the busiest views to their query budgets, see query_budget.py. The
+budgets count the cache's queries too, production uses the database cache, so
+the tests do as well whatever the test settings say.
+"""
+
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from Reddit_Shredder.settings import QUERY_BUDGETS
+from app.models import ExcludedItems, ExclusionRule, RedditAccounts
+from app.query_budget import assert_budget
+
+
+DATABASE_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'app_cache',
+    }
+}
+
+
+@override_settings(CACHES=DATABASE_CACHE)
+class QueryBudgetTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with override_settings(CACHES=DATABASE_CACHE):
+            call_command('createcachetable', verbosity=0)
+        super(QueryBudgetTests, cls).setUpClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shredder', password='password')
+        self.client.force_login(self.user)
+
+    def add_rows(self, count):
+        """
+        Gives the user count accounts, rules and exclusions, the budgets must
+        hold however many there are.
+        """
+        start = RedditAccounts.objects.count()
+        for number in range(start, start + count):
+            RedditAccounts.objects.create(
+                user_id=self.user.id,
+                reddit_user_name='shredder{}'.format(number),
+                reddit_token='token{}'.format(number))
+            ExclusionRule.objects.create(user_id=self.user.id,
+                                         kind=ExclusionRule.KEYWORD,
+                                         value='keyword{}'.format(number))
+            ExcludedItems.objects.create(user_id=self.user.id,
+                                         excluded_item_id='c{}'.format(number))
+
+    def assert_view_budget(self, view, path):
+        """
+        Checks the view against its budget with few and with many rows, and
+        that the number of queries doesn't grow with the rows. The cache starts
+        out empty, the most expensive case.
+        """
+        counts = []
+        for rows in (1, 20):
+            self.add_rows(rows)
+            cache.clear()
+            with assert_budget(queries=QUERY_BUDGETS[view],
+                               api_calls=0) as stats:
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(stats.queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_profile(self):
+        self.assert_view_budget('profile', '/profile/')
+
+    def test_logs(self):
+        self.assert_view_budget('logs', '/profile/logs/')
+
+    def test_manual_exclude(self):
+        self.assert_view_budget('exclude', '/profile/exclude/')
+
+    @mock.patch('app.views.get_reddit_username', return_value='shredder')
+    @mock.patch('app.views.get_token', return_value='new token')
+    def test_authorize_callback(self, get_token, get_reddit_username):
+        self.add_rows(20)
+        with assert_budget(queries=QUERY_BUDGETS['authorize_callback'],
+                           api_calls=0):
+            response = self.client.get('/authorize_callback/',
+                                       {'code': 'code'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(RedditAccounts.objects.filter(
+            reddit_user_name='shredder', reddit_token='new token').exists())
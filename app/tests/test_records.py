@@ -0,0 +1,166 @@
+"""
+Tests for the record archive, keyset pagination across both tiers and
+account deletion.
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+from datetime import timezone
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from app import archive
+from app.cache_functions.history_snapshot import snapshot_key, stamp_key
+from app.models import RedditAccounts, SchedulerOutput, ShredCheckpoint
+from app.models import ShredRun
+from app.records import record_page, table_page
+from app.reddit_connection.token_cache import cache_key
+
+NOW = datetime.datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+
+
+def row(record_id, hours_ago, status='DELETED', user_name='shredder'):
+    return {'id': record_id,
+            'user_id': 1,
+            'op_run_time': NOW - datetime.timedelta(hours=hours_ago),
+            'reddit_user_name': user_name,
+            'sub_comment_id': 'c{}'.format(record_id),
+            'sub_comment_body': 'body {}'.format(record_id),
+            'sub_comment_status': status}
+
+
+class ArchiveTestCase(TestCase):
+    """
+    Points ARCHIVE_DIR at a temporary directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch('app.archive.ARCHIVE_DIR', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+
+class ArchiveTests(ArchiveTestCase):
+
+    def test_rows_round_trip_newest_first(self):
+        archive.archive([row(number, number * 5) for number in range(1, 21)])
+
+        rows = list(archive.iter_rows(1))
+        self.assertEqual([item['id'] for item in rows], list(range(1, 21)))
+        self.assertEqual(rows[0]['op_run_time'], NOW - datetime.timedelta(
+            hours=5))
+        self.assertEqual(archive.count(1), 20)
+
+    def test_archiving_twice_is_harmless(self):
+        archive.archive([row(1, 1), row(2, 2)])
+        archive.archive([row(2, 2), row(3, 3)])
+        self.assertEqual(archive.count(1), 3)
+
+    def test_skip_passes_whole_days(self):
+        archive.archive([row(number, number * 5) for number in range(1, 21)])
+        self.assertEqual([item['id'] for item in archive.iter_rows(1, skip=7)],
+                         list(range(8, 21)))
+
+    def test_remove(self):
+        archive.archive([row(1, 1)])
+        archive.remove(1)
+        self.assertEqual(archive.count(1), 0)
+        self.assertFalse(os.path.exists(archive.user_dir(1)))
+
+
+class RecordPageTests(ArchiveTestCase):
+
+    def setUp(self):
+        super(RecordPageTests, self).setUp()
+
+        # The newest 10 records in the table, the rest in the archive.
+        rows = [row(number, number, 'SKIPPED' if number % 4 == 0
+                    else 'DELETED') for number in range(1, 31)]
+        for item in rows[:10]:
+            SchedulerOutput.objects.create(**item)
+        archive.archive(rows[10:])
+
+    def pages(self, **filters):
+        ids, cursor = [], None
+        while True:
+            rows, cursor = record_page(1, cursor, limit=7, **filters)
+            ids.extend(item['id'] for item in rows)
+            if cursor is None:
+                return ids
+
+    def test_pages_cover_both_tiers_once(self):
+        self.assertEqual(self.pages(), list(range(1, 31)))
+
+    def test_filters_apply_to_both_tiers(self):
+        self.assertEqual(self.pages(status='SKIPPED'),
+                         list(range(4, 31, 4)))
+        self.assertEqual(
+            self.pages(since=NOW - datetime.timedelta(hours=15),
+                       until=NOW - datetime.timedelta(hours=5)),
+            list(range(6, 16)))
+
+    def test_search_reads_the_archive_up_to_the_page(self):
+        # 'body 1' matches 1 and 10 in the table and 11 - 19 in the archive.
+        total, filtered, rows = table_page(1, 'body 1', 0, 5)
+        self.assertEqual(total, 30)
+        self.assertEqual([item['id'] for item in rows], [1, 10, 11, 12, 13])
+        self.assertEqual(filtered, 6)
+
+        total, filtered, rows = table_page(1, 'body 1', 10, 5)
+        self.assertEqual([item['id'] for item in rows], [19])
+        self.assertEqual(filtered, 11)
+
+    def test_search_leaves_older_days_unread(self):
+        with mock.patch('app.archive.read_day',
+                        wraps=archive.read_day) as read_day:
+            total, filtered, rows = table_page(1, 'body 1', 0, 2)
+        self.assertEqual([item['id'] for item in rows], [1, 10])
+        self.assertEqual(filtered, 3)
+        self.assertEqual(read_day.call_count, 1)
+
+
+class DeleteAccountTests(ArchiveTestCase):
+
+    def test_everything_is_deleted(self):
+        cache.clear()
+        user = User.objects.create_user('shredder', password='password')
+        account = RedditAccounts.objects.create(
+            user_id=user.id, reddit_user_name='shredder', reddit_token='token')
+        SchedulerOutput.objects.create(**dict(row(1, 1), user_id=user.id))
+        archive.archive([dict(row(2, 48), user_id=user.id)])
+        ShredRun.objects.create(account_id=account.id, user_id=user.id,
+                                reddit_user_name='shredder', started=NOW,
+                                finished=NOW)
+        ShredCheckpoint.objects.create(account_id=account.id,
+                                       run_kind=ShredCheckpoint.SCHEDULED)
+        cache.set_many({snapshot_key(account.id): b'',
+                        stamp_key(account.id): 1,
+                        cache_key('token'): 'access'})
+
+        self.client.force_login(user)
+        self.client.get('/profile/delete_account/')
+
+        self.assertFalse(User.objects.filter(id=user.id).exists())
+        self.assertFalse(RedditAccounts.objects.exists())
+        self.assertFalse(SchedulerOutput.objects.exists())
+        self.assertFalse(ShredRun.objects.exists())
+        self.assertFalse(ShredCheckpoint.objects.exists())
+        self.assertEqual(archive.count(user.id), 0)
+        self.assertEqual(cache.get_many([snapshot_key(account.id),
+                                         stamp_key(account.id),
+                                         cache_key('token')]), {})
+
+    def test_archived_records_count_as_records(self):
+        user = User.objects.create_user('shredder', password='password')
+        archive.archive([dict(row(1, 48), user_id=user.id)])
+
+        self.client.force_login(user)
+        response = self.client.get('/profile/logs/')
+        self.assertTrue(response.context['has_records'])
@@ -0,0 +1,134 @@
+"""
+Tests for the retry layer and the API calls it wraps.
+"""
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from praw.exceptions import APIException
+from prawcore import Requestor, Session, TrustedAuthenticator
+from prawcore.exceptions import InvalidToken, NotFound, RequestException
+from prawcore.exceptions import ResponseException
+
+from app import metrics
+from app.models import RedditAccounts
+from app.reddit_connection.client import CountingSession
+from app.reddit_connection.listing import ItemRecord
+from app.reddit_connection.reddit_connection import shred_item
+from app.reddit_connection.retry import AUTH, PERMANENT, TRANSIENT
+from app.reddit_connection.retry import AuthFailed, RateLimited, SkipItem
+from app.reddit_connection.retry import call_with_retry, classify
+from app.reddit_connection.token_cache import CachedAuthorizer, TokenRevoked
+from app.reddit_connection.token_cache import cache_key
+from app.tests.test_token_cache import FakeResponse
+
+
+class Calls(object):
+    """
+    An API call that raises the given errors in turn, then returns 'ok'.
+    """
+    __name__ = 'call'
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+@mock.patch('app.reddit_connection.retry.time.sleep', lambda seconds: None)
+class RetryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.take()
+        RedditAccounts.objects.create(user_id=1,
+                                      reddit_user_name='shredder',
+                                      reddit_token='token')
+
+    def test_classify(self):
+        cases = [
+            (RateLimited(), TRANSIENT),
+            (RequestException(OSError(), (), {}), TRANSIENT),
+            (ResponseException(FakeResponse(429)), TRANSIENT),
+            (ResponseException(FakeResponse(503)), TRANSIENT),
+            (APIException('RATELIMIT', 'slow down', None), TRANSIENT),
+            (ResponseException(FakeResponse(401)), AUTH),
+            (InvalidToken(FakeResponse(401)), AUTH),
+            (TokenRevoked(), AUTH),
+            (NotFound(FakeResponse(404)), PERMANENT),
+            (ValueError(), None),
+        ]
+        for error, kind in cases:
+            self.assertEqual(classify(error), kind, repr(error))
+
+    def test_429_is_mapped_to_rate_limited(self):
+        session = CountingSession(CachedAuthorizer(
+            TrustedAuthenticator(Requestor('Reddit Shredder tests'), 'id',
+                                 'secret'), 'token'))
+        error = AssertionError('Unexpected status code: 429')
+        with mock.patch.object(Session, 'request', side_effect=error):
+            with self.assertRaises(RateLimited):
+                session.request('GET', '/api/v1/me')
+
+    def test_rate_limits_are_retried_and_counted(self):
+        call = Calls(RateLimited(), RateLimited())
+        self.assertEqual(call_with_retry(call, token='token'), 'ok')
+        self.assertEqual(call.count, 3)
+
+        counters = metrics.registry.take()['counters']
+        self.assertEqual(sum(value for (name, labels), value in counters.items()
+                             if name == 'shredder_rate_limited_total'), 2)
+
+    def test_permanent_errors_skip(self):
+        call = Calls(NotFound(FakeResponse(404)))
+        with self.assertRaises(SkipItem):
+            call_with_retry(call, token='token')
+        self.assertEqual(call.count, 1)
+
+    def test_one_auth_error_is_retried(self):
+        call = Calls(InvalidToken(FakeResponse(401)))
+        self.assertEqual(call_with_retry(call, token='token'), 'ok')
+        self.assertTrue(
+            RedditAccounts.objects.get(reddit_token='token').token_valid)
+
+    def test_repeated_auth_errors_keep_the_token(self):
+        call = Calls(InvalidToken(FakeResponse(401)),
+                     InvalidToken(FakeResponse(401)))
+        with self.assertRaises(AuthFailed):
+            call_with_retry(call, token='token')
+        self.assertEqual(call.count, 2)
+        self.assertTrue(
+            RedditAccounts.objects.get(reddit_token='token').token_valid)
+
+    def test_auth_errors_drop_the_access_token(self):
+        cache.set(cache_key('token'), {'access_token': 'stale'}, 60)
+        call = Calls(InvalidToken(FakeResponse(401)))
+        call_with_retry(call, token='token')
+        self.assertIsNone(cache.get(cache_key('token')))
+
+    def test_refused_refresh_revokes(self):
+        call = Calls(TokenRevoked())
+        with self.assertRaises(TokenRevoked):
+            call_with_retry(call, token='token')
+        self.assertEqual(call.count, 1)
+
+    def test_failed_delete_does_not_repeat_the_edit(self):
+        target = mock.Mock()
+        target.edit = Calls()
+        target.delete = Calls(RateLimited())
+        item = ItemRecord({'id': 'abc', 'created': 0, 'score': 1,
+                           'body': 'a comment', 'subreddit': 'test'},
+                          'Comment')
+
+        with mock.patch('app.reddit_connection.reddit_connection.handle',
+                        return_value=target):
+            shred_item(mock.Mock(), item, token='token')
+
+        self.assertEqual(target.edit.count, 1)
+        self.assertEqual(target.delete.count, 2)
@@ -0,0 +1,70 @@
+"""
+Tests for scheduled shred runs.
+"""
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from app.models import RedditAccounts, SchedulerOutput
+from app.reddit_connection.exclusion_rules import RuleMatcher
+from app.reddit_connection.reddit_schedule import schedule_shredder
+from app.reddit_connection.shred_context import ShredContext
+from app.tests.test_checkpoint import FakeListing
+
+
+class SkippedIdsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.account = RedditAccounts.objects.create(
+            user_id=1, reddit_user_name='shredder', reddit_token='token')
+
+    def run_shredder(self, record_keeping, skipped_ids=frozenset()):
+        """
+        Runs a scheduled shred over 20 comments that are all kept (the karma
+        threshold is below every score.)
+        """
+        context = ShredContext(account_id=self.account.id, user_id=1,
+                               user_name='shredder', token='token',
+                               keep_hours=0, karma_exclude=-100,
+                               record_keeping=record_keeping,
+                               excluded_ids=frozenset(),
+                               skipped_ids=skipped_ids,
+                               rules=RuleMatcher([]))
+        listing = FakeListing(20)
+        session = mock.Mock(request_count=0)
+        with mock.patch('app.reddit_connection.checkpoint.fetch_page',
+                        listing.fetch_page), \
+                mock.patch('app.reddit_connection.reddit_schedule.'
+                           'reddit_client',
+                           return_value=mock.Mock(_core=session)), \
+                mock.patch.object(RedditAccounts.objects, 'filter',
+                                  wraps=RedditAccounts.objects.filter) \
+                as account_filter:
+            schedule_shredder(context)
+
+        return account_filter.called
+
+    def stored(self):
+        self.account.refresh_from_db()
+        return frozenset(filter(None, self.account.skipped_ids.split(',')))
+
+    def test_record_keeping_remembers_skipped_items(self):
+        self.assertTrue(self.run_shredder(True))
+        skipped = self.stored()
+        self.assertEqual(len(skipped), 20)
+        self.assertEqual(SchedulerOutput.objects.count(), 20)
+
+        # Nothing changed, so nothing is written or logged again.
+        self.assertFalse(self.run_shredder(True, skipped))
+        self.assertEqual(SchedulerOutput.objects.count(), 20)
+
+    def test_without_record_keeping_nothing_is_stored(self):
+        self.assertFalse(self.run_shredder(False))
+        self.assertEqual(self.stored(), frozenset())
+
+        # A set left over from when record keeping was on is cleared once.
+        self.assertTrue(self.run_shredder(False, frozenset({'c0001'})))
+        self.assertEqual(self.stored(), frozenset())
@@ -0,0 +1,78 @@
+"""
+Tests that processes waiting on another's fetch reuse what it stored.
+"""
+
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from app.cache_functions import single_flight as flight
+from app.cache_functions.single_flight import FlightFailed, single_flight
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(flight, 'POLL_INTERVAL', 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def other_process(self, finish):
+        """
+        Holds the lock as another process's leader would, then calls finish
+        and releases it.
+        """
+        cache.set(flight.lock_key('k'), 'other', 60)
+
+        def run():
+            finish()
+            cache.delete(flight.lock_key('k'))
+
+        timer = threading.Timer(0.05, run)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_leader_stores_nothing_extra(self):
+        stored = {}
+        fetch = mock.Mock(side_effect=lambda: stored.setdefault('k', 'fresh'))
+
+        result = single_flight('k', fetch, reload=lambda: stored.get('k'))
+
+        self.assertEqual(result, 'fresh')
+        self.assertIsNone(cache.get(flight.lock_key('k')))
+        self.assertFalse([key for key in cache._cache
+                          if 'flight_' in key])
+
+    def test_waiter_reloads_the_leaders_result(self):
+        stored = {}
+        self.other_process(lambda: stored.setdefault('k', 'fresh'))
+        fetch = mock.Mock()
+
+        result = single_flight('k', fetch, reload=lambda: stored.get('k'))
+
+        self.assertEqual(result, 'fresh')
+        fetch.assert_not_called()
+
+    def test_waiter_raises_the_leaders_failure(self):
+        self.other_process(lambda: cache.set(flight.failure_key('k', 'other'),
+                                             'ValueError: down', 60))
+        fetch = mock.Mock()
+
+        with self.assertRaisesRegex(FlightFailed, 'down'):
+            single_flight('k', fetch, reload=lambda: None)
+        fetch.assert_not_called()
+
+    def test_leader_failure_is_left_for_waiters(self):
+        fetch = mock.Mock(side_effect=ValueError('down'))
+
+        with mock.patch.object(flight.uuid, 'uuid4',
+                               return_value=mock.Mock(hex='mine')):
+            with self.assertRaises(ValueError):
+                single_flight('k', fetch, reload=lambda: None)
+
+        self.assertEqual(cache.get(flight.failure_key('k', 'mine')),
+                         'ValueError: down')
+        self.assertIsNone(cache.get(flight.lock_key('k')))
@@ -0,0 +1,116 @@
+"""
+Tests for the shared access token cache.
+"""
+
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from prawcore import Authorizer, Requestor, Session, TrustedAuthenticator
+from prawcore.exceptions import OAuthException, ResponseException
+
+from app.models import RedditAccounts
+from app.reddit_connection.token_cache import CachedAuthorizer, TokenRevoked
+from app.reddit_connection.token_cache import cache_key
+from app.reddit_connection.token_health import check_tokens
+
+
+class FakeResponse(object):
+    """
+    Just enough of a requests response for the prawcore exceptions.
+    """
+
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        if self.payload is None:
+            raise ValueError
+        return self.payload
+
+
+class RefreshTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        RedditAccounts.objects.create(user_id=1,
+                                      reddit_user_name='shredder',
+                                      reddit_token='token')
+
+    def refresh(self, error):
+        authorizer = CachedAuthorizer(
+            TrustedAuthenticator(Requestor('shredder tests'), 'id', 'secret'), 'token')
+        with mock.patch.object(Authorizer, 'refresh', side_effect=error):
+            authorizer.refresh()
+
+    def assert_valid(self, valid):
+        self.assertEqual(
+            RedditAccounts.objects.get(reddit_token='token').token_valid,
+            valid)
+        self.assertEqual(cache.get(cache_key('token', 'revoked_token')),
+                         None if valid else True)
+
+    def test_server_error_is_not_a_revocation(self):
+        for status in (500, 503, 429):
+            with self.assertRaises(ResponseException):
+                self.refresh(ResponseException(FakeResponse(status)))
+        self.assert_valid(True)
+
+    def test_invalid_grant_revokes(self):
+        with self.assertRaises(TokenRevoked):
+            self.refresh(ResponseException(
+                FakeResponse(400, {'error': 'invalid_grant'})))
+        self.assert_valid(False)
+
+    def test_other_client_errors_are_not_a_revocation(self):
+        with self.assertRaises(ResponseException):
+            self.refresh(ResponseException(
+                FakeResponse(401, {'error': 'invalid_client'})))
+        self.assert_valid(True)
+
+    def test_oauth_error_revokes(self):
+        with self.assertRaises(TokenRevoked):
+            self.refresh(OAuthException(FakeResponse(200), 'invalid_grant',
+                                        None))
+        self.assert_valid(False)
+
+    def test_revoked_flag_fails_fast(self):
+        cache.set(cache_key('token', 'revoked_token'), True)
+        with self.assertRaises(TokenRevoked):
+            self.refresh(AssertionError('Reddit should not be asked.'))
+
+
+class HealthCheckTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        RedditAccounts.objects.create(user_id=1,
+                                      reddit_user_name='shredder',
+                                      reddit_token='token',
+                                      token_valid=False)
+        cache.set(cache_key('token', 'revoked_token'), True)
+
+    def test_check_ignores_and_clears_the_revoked_flag(self):
+        # Reddit hands out a new access token, and the API answers once it
+        # has been refreshed.
+        def exchange(authorizer):
+            authorizer.access_token = 'access'
+            authorizer._expiration_timestamp = time.time() + 3600
+            authorizer.scopes = {'*'}
+
+        def request(session, *args, **kwargs):
+            session._authorizer.refresh()
+            return {'name': 'shredder'}
+
+        with mock.patch.object(Authorizer, 'refresh', autospec=True,
+                               side_effect=exchange) as refresh, \
+                mock.patch.object(Session, 'request', autospec=True,
+                                  side_effect=request):
+            check_tokens()
+
+        self.assertTrue(refresh.called)
+        self.assertTrue(
+            RedditAccounts.objects.get(reddit_token='token').token_valid)
+        self.assertIsNone(cache.get(cache_key('token', 'revoked_token')))
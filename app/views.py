@@ -3,22 +3,55 @@ Definition of views.
 """
 
 import datetime
+import heapq
+import hmac
+import itertools
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone
 
 from django.contrib import messages
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
-from django.http import HttpRequest
+from django.db import connection
+from django.http import HttpRequest, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
-
+from django.utils import formats
+
+from Reddit_Shredder.settings import DELETE_BATCH_MAX
+from Reddit_Shredder.settings import DELETE_WORKERS
+from Reddit_Shredder.settings import EXCLUDE_BATCH_MAX
+from Reddit_Shredder.settings import METRICS_TOKEN
+from Reddit_Shredder.settings import RECORDS_PAGE_SIZE
+from Reddit_Shredder.settings import SEARCH_LIMIT
+from app import archive, datatables
+from app.cache_functions import search_index
+from app.cache_functions.active_users import mark_active
+from app.cache_functions import history_snapshot
+from app.cache_functions.history_snapshot import remove_items
+from app.cache_functions.preview_index import get_index
+from app.exclusions import apply_exclusions, exclusion_version, valid_id
 from app.forms import *
 from app.logger.exception_decor import exception
 from app.logger.exception_logger import logger
-from app.models import RedditAccounts
+from app.metrics import dump, job, load_totals, render_text
+from app.models import ExcludedItems, ExclusionRule, RedditAccounts
+from app.models import ShredCheckpoint, ShredRun
+from app.records import parse_day, record_page, table_page
+from app.reddit_connection.exclusion_rules import load_matchers
 from app.reddit_connection.reddit_connection import delete_comment
+from app.reddit_connection.reddit_connection import delete_items
 from app.reddit_connection.reddit_connection import get_auth_url
 from app.reddit_connection.reddit_connection import get_reddit_username
 from app.reddit_connection.reddit_connection import get_token
+from app.reddit_connection.token_cache import forget_tokens
+
+# Table data names -> history index sort orders.
+HISTORY_ORDERS = {
+    'body': 'body',
+    'karma': 'score',
+}
 
 
 def home(request):
@@ -71,7 +104,7 @@ def shredder(request):
     # to the RedditShredderForm class.
     if user.is_authenticated:
         # If the user has no authorized accounts, add warning and redirect.
-        if not RedditAccounts.objects.filter(user_id=user.id):
+        if not RedditAccounts.objects.filter(user_id=user.id).exists():
             messages.warning(request, "You haven't authorized an account, please"
                                       " authorize an account under 'Authorized "
                                       "Accounts' below to continue.")
@@ -102,6 +135,349 @@ def shredder(request):
         )
 
 
+@exception(logger)
+@login_required
+def shredder_preview(request):
+    """
+    Counts the comments and submissions the manual shredder would delete with
+    the settings in the query string, for the live counts on the shredder
+    page. Excluded items and items protected by exclusion rules are left out
+    of the counts, unless everything is being deleted.
+
+    :param request: The HTTP request.
+    :return: JsonResponse of the counts.
+    """
+    assert isinstance(request, HttpRequest)
+
+    user = request.user
+
+    try:
+        keep = int(request.GET.get('keep'))
+        karma_limit = int(request.GET.get('karma_limit'))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid settings.'}, status=400)
+
+    # Match run_shredder's idea of deleting everything.
+    everything = request.GET.get('delete_everything') == 'on' \
+        or keep == 0 and karma_limit == 1
+
+    account = RedditAccounts.objects.filter(
+        user_id=user.id,
+        reddit_user_name=request.GET.get('account')).values_list(
+        'id', 'reddit_token').first()
+    if account is None:
+        return JsonResponse({'error': 'Unknown account.'}, status=404)
+
+    excluded = frozenset(ExcludedItems.objects.filter(
+        user_id=user.id).values_list('excluded_item_id', flat=True))
+
+    counts = get_index(*account).preview(keep, karma_limit, everything,
+                                         excluded,
+                                         load_matchers([user.id])[user.id])
+
+    return JsonResponse({
+        'comments': counts['Comment'],
+        'submissions': counts['Submission'],
+        'kept': counts['Kept'],
+    })
+
+
+@exception(logger)
+@login_required
+def history_search(request):
+    """
+    Searches the user's comments and submissions across all of their
+    accounts, for the delete and exclude pages.
+
+    :param request: The HTTP request, with the query in q and optional
+                    subreddit and account filters.
+    :return: JsonResponse of the matching items, newest first per account.
+    """
+    assert isinstance(request, HttpRequest)
+
+    user = request.user
+    query = request.GET.get('q', '')
+    subreddit = request.GET.get('subreddit')
+
+    accounts = RedditAccounts.objects.filter(user_id=user.id)
+    if request.GET.get('account'):
+        accounts = accounts.filter(reddit_user_name=request.GET['account'])
+
+    data = []
+    for account_id, user_name, token in accounts.values_list(
+            'id', 'reddit_user_name', 'reddit_token'):
+        index = search_index.get_index(account_id, token)
+        for item in index.search(query, subreddit,
+                                 SEARCH_LIMIT - len(data)):
+            data.append({
+                'cid': item.id,
+                'body': item.body,
+                'karma': item.score,
+                'user_name': user_name,
+                'item_type': item.item_type,
+                'subreddit': item.subreddit,
+            })
+
+        if len(data) >= SEARCH_LIMIT:
+            break
+
+    return JsonResponse(data, safe=False)
+
+
+@exception(logger)
+@login_required
+def history_table(request):
+    """
+    Serves one page of the user's comments and submissions to the delete and
+    exclude tables (DataTables server-side processing.)
+
+    :param request: The HTTP request, see datatables.parse.
+    :return: A DataTables JsonResponse.
+    """
+    assert isinstance(request, HttpRequest)
+
+    user = request.user
+    query = datatables.parse(request.GET)
+
+    # The table's data name -> the index sort order, newest first by default.
+    order = HISTORY_ORDERS.get(query.order, 'created')
+    descending = query.descending if query.order else True
+
+    accounts = RedditAccounts.objects.filter(user_id=user.id).order_by(
+        'reddit_user_name').values_list('id', 'reddit_user_name',
+                                        'reddit_token')
+
+    total = 0
+    filtered = 0
+    listings = []
+    for account_id, user_name, token in accounts:
+        index = search_index.get_index(account_id, token)
+        positions = index.matches(query.search)
+
+        total += len(index.items)
+        filtered += len(index.items if positions is None else positions)
+        listings.append(account_rows(index, positions, order, descending,
+                                     user_name))
+
+    # Sorted by account, or merged across accounts on the sort order.
+    if query.order == 'user_name':
+        if descending:
+            listings.reverse()
+        rows = itertools.chain(*listings)
+    else:
+        key = search_index.SORT_FIELDS[order]
+        rows = heapq.merge(*listings, key=lambda row: key(row[0]),
+                           reverse=descending)
+
+    data = []
+    for item, user_name in itertools.islice(rows, query.start,
+                                            query.start + query.length):
+        data.append({
+            'cid': item.id,
+            'body': item.body,
+            'karma': item.score,
+            'user_name': user_name,
+            'item_type': item.item_type,
+            'subreddit': item.subreddit,
+        })
+
+    return datatables.response(query, total, filtered, data)
+
+
+def account_rows(index, positions, order, descending, user_name):
+    """
+    :return: An iterator of (HistoryItem, user_name) for one account, in the
+             table's sort order.
+    """
+    return ((item, user_name)
+            for item in index.ordered(positions, order, descending))
+
+
+@exception(logger)
+@login_required
+def logs_table(request):
+    """
+    Serves one page of the user's auto shredder records to the logs table
+    (DataTables server-side processing.)
+
+    :param request: The HTTP request, see datatables.parse.
+    :return: A DataTables JsonResponse.
+    """
+    assert isinstance(request, HttpRequest)
+
+    user = request.user
+    query = datatables.parse(request.GET)
+
+    # Records span the table and the archive, so they are always listed
+    # newest first.
+    total, filtered, rows = table_page(user.id, query.search, query.start,
+                                       query.length)
+
+    data = []
+    for row in rows:
+        data.append({
+            'op_run_time': formats.date_format(row['op_run_time'],
+                                               'DATETIME_FORMAT'),
+            'sub_comment_body': row['sub_comment_body'],
+            'sub_comment_status': row['sub_comment_status'],
+        })
+
+    return datatables.response(query, total, filtered, data)
+
+
+@exception(logger)
+@login_required
+def records_api(request):
+    """
+    Returns a page of the user's auto shredder records, newest first. Pages
+    are fetched with the cursor returned by the previous page.
+
+    :param request: The HTTP request, with optional cursor, limit, account,
+                    status, since and until (YYYY-MM-DD or ISO datetime)
+                    parameters.
+    :return: JsonResponse of the records and the next page's cursor.
+    """
+    assert isinstance(request, HttpRequest)
+
+    user = request.user
+    params = request.GET
+
+    try:
+        rows, next_cursor = record_page(
+            user.id,
+            cursor=params.get('cursor'),
+            limit=int(params.get('limit', RECORDS_PAGE_SIZE)),
+            account=params.get('account'),
+            status=params.get('status'),
+            since=parse_day(params.get('since')),
+            until=parse_day(params.get('until'), end=True))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid parameters.'}, status=400)
+
+    return JsonResponse({'records': rows, 'next': next_cursor})
+
+
+@exception(logger)
+@login_required
+def delete_batch(request):
+    """
+    Deletes a batch of the user's comments and submissions, for the delete
+    page's multi-select. Accounts are handled concurrently, one client each.
+
+    :param request: The HTTP POST request, its JSON body holds a list of
+                    items, each with cid, user_name and item_type.
+    :return: JsonResponse of the result (DELETED, SKIPPED, FAILED or
+             UNKNOWN_ACCOUNT) per item.
+    """
+    assert isinstance(request, HttpRequest)
+
+    user = request.user
+
+    if request.method != "POST":
+        return JsonResponse({'error': 'POST only.'}, status=405)
+
+    try:
+        items = json.loads(request.body.decode('utf-8'))['items']
+        items = [(item['user_name'], item['cid'], item['item_type'])
+                 for item in items]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid batch.'}, status=400)
+
+    if len(items) > DELETE_BATCH_MAX:
+        return JsonResponse({'error': 'Too many items.'}, status=400)
+
+    # Only the user's own accounts.
+    accounts = {
+        user_name: (account_id, token)
+        for account_id, user_name, token in RedditAccounts.objects.filter(
+            user_id=user.id,
+            reddit_user_name__in=set(item[0] for item in items)).values_list(
+            'id', 'reddit_user_name', 'reddit_token')
+    }
+
+    batches = defaultdict(list)
+    results = {}
+    for user_name, item_id, item_type in items:
+        if user_name in accounts and item_type in ('Comment', 'Submission'):
+            batches[user_name].append((item_id, item_type))
+        else:
+            results[item_id] = 'UNKNOWN_ACCOUNT'
+
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+        futures = {
+            user_name: pool.submit(delete_on_worker, accounts[user_name][1],
+                                   batch)
+            for user_name, batch in batches.items()
+        }
+
+        for user_name, future in futures.items():
+            account_results = future.result()
+            results.update(account_results)
+
+            # Drop the deleted items from the account's history snapshot.
+            remove_items(accounts[user_name][0],
+                         [item_id for item_id, status in
+                          account_results.items() if status == 'DELETED'])
+
+    return JsonResponse({
+        'results': [{'cid': item_id, 'status': results[item_id]}
+                    for _, item_id, _ in items],
+    })
+
+
+def delete_on_worker(token, batch):
+    """
+    Runs delete_items on a worker thread, closing the thread's DB connection
+    (opened by the cache and token checks) when done.
+    """
+    try:
+        with job('delete'):
+            return delete_items(token, batch)
+    finally:
+        connection.close()
+
+
+@exception(logger)
+@login_required
+def exclude_batch(request):
+    """
+    Sets and unsets many of the user's exclusions in one go.
+
+    :param request: The HTTP POST request, its JSON body holds lists of item
+                    ids under set and unset.
+    :return: JsonResponse of the new exclusion version and the ids that were
+             actually added and removed.
+    """
+    assert isinstance(request, HttpRequest)
+
+    user = request.user
+
+    if request.method != "POST":
+        return JsonResponse({'error': 'POST only.'}, status=405)
+
+    try:
+        batch = json.loads(request.body.decode('utf-8'))
+        set_ids = batch.get('set', [])
+        unset_ids = batch.get('unset', [])
+    except (ValueError, AttributeError, TypeError):
+        return JsonResponse({'error': 'Invalid batch.'}, status=400)
+
+    # Both must be lists of ids, a bare string would be taken character by
+    # character.
+    if not isinstance(set_ids, list) or not isinstance(unset_ids, list) \
+            or len(set_ids) + len(unset_ids) > EXCLUDE_BATCH_MAX \
+            or not all(valid_id(item_id) for item_id in set_ids + unset_ids):
+        return JsonResponse({'error': 'Invalid batch.'}, status=400)
+
+    version, added, removed = apply_exclusions(user.id, set_ids, unset_ids)
+
+    return JsonResponse({
+        'version': version,
+        'added': added,
+        'removed': removed,
+    })
+
+
 @exception(logger)
 def shredder_output(request):
     """
@@ -250,6 +626,9 @@ def profile(request):
 
     user = request.user
 
+    # Let the snapshot warmer know the user is about.
+    mark_active(user.id)
+
     # Get all of the user's authorized reddit accounts.
     accounts = RedditAccounts.objects.filter(user_id=user.id)
 
@@ -259,6 +638,9 @@ def profile(request):
     karma_form = KarmaExcludeForm(
         initial={'karma_exclude': user.profile.karma_exclude})
 
+    # Get the user's automatic exclusion rules.
+    rules = ExclusionRule.objects.filter(user_id=user.id).order_by('kind', 'id')
+
     # Ensure user is authenticated.
     if user.is_authenticated is True:
         return render(
@@ -272,6 +654,8 @@ def profile(request):
                 'form': SchedulerForm,
                 'p_form': record_form,
                 'k_form': karma_form,
+                'rules': rules,
+                'r_form': ExclusionRuleForm(),
                 'auth': get_auth_url(),
             }
         )
@@ -295,8 +679,10 @@ def logs(request):
     # initialize the authenticated user.
     user = request.user
 
-    # Get user's log output.
-    output = SchedulerOutput.objects.filter(user_id=user.id)
+    # The rows are loaded page by page via logs_table, the page only needs to
+    # know if there are any.
+    has_records = SchedulerOutput.objects.filter(user_id=user.id).exists() \
+        or archive.count(user.id) > 0
 
     # Ensure user is authenticated. Render logs.
     if user.is_authenticated:
@@ -307,7 +693,7 @@ def logs(request):
                 'title': 'Records',
                 'year': datetime.datetime.now().year,
                 'user': user,
-                'output': output,
+                'has_records': has_records,
             }
         )
 
@@ -395,6 +781,59 @@ def karma_exclude(request):
         return redirect('/profile/')
 
 
+@exception(logger)
+@login_required
+def exclusion_rules(request):
+    """
+    Adds (POST) and removes (GET ?remove=<rule id>) the user's automatic
+    exclusion rules.
+
+    :param request: The HTTP Request.
+    :return: A redirect to the profile with success / error message attached.
+    """
+    assert isinstance(request, HttpRequest)
+
+    user = request.user
+
+    # If the user is not logged in, redirect to the login page.
+    if user.is_authenticated is False:
+        messages.warning(request, "You must log in.")
+        return redirect('/login/')
+
+    # Remove a rule, only ever one of the user's own.
+    if request.GET.get('remove') is not None:
+        try:
+            rule_id = int(request.GET.get('remove'))
+        except ValueError:
+            rule_id = None
+
+        ExclusionRule.objects.filter(user_id=user.id, id=rule_id).delete()
+        messages.success(request, "Great Success! The rule has been removed.")
+        return redirect('/profile/')
+
+    # If request method is not post, redirect to profile.
+    if request.method != "POST":
+        messages.warning(request, "Whoops, not sure how you got here.")
+        return redirect('/profile/')
+
+    form = ExclusionRuleForm(request.POST)
+
+    # If the form is valid, save the rule against the user.
+    if form.is_valid():
+        rule = form.save(commit=False)
+        rule.user_id = user.id
+        rule.save()
+
+        messages.success(request, "Great Success! Your rule has been saved.")
+
+    else:
+        messages.warning(request, "Whoops! {}".format(
+            ' '.join(error for errors in form.errors.values()
+                     for error in errors)))
+
+    return redirect('/profile/')
+
+
 @exception(logger)
 @login_required
 def manual_exclude(request):
@@ -417,22 +856,19 @@ def manual_exclude(request):
     # method, nothing fancy. User's are redirected to a clean URL.
     if request.GET.get('unset') is not None:
         item_id = request.GET.get('unset')
-        excluded = ExcludedItems.objects.filter(excluded_item_id=item_id)
+        apply_exclusions(user.id, unset_ids=[item_id])
         messages.success(request,
                          "Great success! The item has been removed from your "
                          "list of exclusions.")
-        excluded.delete()
         return redirect('/profile/exclude/')
 
     # Catch and set the set requests.
     if request.GET.get('set') is not None:
         item_id = request.GET.get('set')
-        excluded = ExcludedItems(user_id=user.id,
-                                 excluded_item_id=item_id)
+        apply_exclusions(user.id, set_ids=[item_id])
         messages.success(request,
                          "Great success! The item has been added to your list of"
                          " exclusions.")
-        excluded.save()
         return redirect('/profile/exclude/')
 
     # Get a list of all of the user's exclusions.
@@ -453,7 +889,7 @@ def manual_exclude(request):
             'year': datetime.datetime.now().year,
             'exclude': ExclusionSelector,
             'excluded': excluded_array,
-
+            'version': exclusion_version(user.id),
         }
     )
 
@@ -482,12 +918,19 @@ def delete(request):
         user_name = request.GET.get('user_name')
         item_type = request.GET.get('item_type')
 
-        # Get the token associated with the Reddit username.
-        token = RedditAccounts.objects.filter(
-            reddit_user_name=user_name).values_list('reddit_token', flat=True)
-
-        # Delete the comment / sub.
+        # Get the user's account with that Reddit username.
+        account = RedditAccounts.objects.filter(
+            user_id=user.id, reddit_user_name=user_name).values_list(
+            'id', 'reddit_token').first()
+        if account is None:
+            messages.warning(request, "That Reddit account is not linked to "
+                                      "your profile.")
+            return redirect('/profile/delete/')
+        account_id, token = account
+
+        # Delete the comment / sub, and drop it from the history snapshot.
         message = delete_comment(comment, token, item_type)
+        remove_items(account_id, [comment])
 
         # Display the message from the delete function.
         messages.success(request, message)
@@ -538,29 +981,24 @@ def authorize_callback(request):
         # Get the refresh_token by immediately using the code.
         token = get_token(request.GET.get('code'))
         # Immediately use the code, this catches errors of mis-adventure.
-        user_name = get_reddit_username(token)
+        user_name = str(get_reddit_username(token))
 
-        # Create a query set of all the reddit account objects.
-        reddit_accounts = RedditAccounts.objects
         today = datetime.datetime.now(
             timezone.utc
         )
 
-        # Iterate through all the reddit accounts, deleting any that match
-        # the user's id and the auth'd reddit username.
-        for item in reddit_accounts.all():
-            if item.reddit_user_name == user_name:
-                item.delete()
+        # Delete any earlier authorizations of the Reddit username (usernames
+        # are case insensitive.)
+        RedditAccounts.objects.filter(
+            reddit_user_name__iexact=user_name).delete()
 
         # Create and save the data to a RedditAccount object in the SQL DB.
-        user_accounts = RedditAccounts.objects.create()
-        user_accounts.user_id = user.id
-        user_accounts.reddit_user_name = user_name
-        user_accounts.reddit_token = token
-        user_accounts.authorized_date = today
         # Default schedule is None.
-        user_accounts.schedule = "None"
-        user_accounts.save()
+        RedditAccounts.objects.create(user_id=user.id,
+                                      reddit_user_name=user_name,
+                                      reddit_token=token,
+                                      authorized_date=today,
+                                      schedule="None")
 
         messages.success(request,
                          "Great Success! Your Reddit account was authorized"
@@ -587,37 +1025,23 @@ def delete_account(request):
 
     user = request.user
 
-    # Delete exclusions.
-    try:
-        excluded_items = ExcludedItems.objects.filter(user_id=user.id)
-        for item in excluded_items:
-            item.delete()
-
-    # Do nothing if there aren't any excluded items.
-    except ExcludedItems.DoesNotExist or UnboundLocalError:
-        pass
-
-    # Delete Reddit Accounts.
-    try:
-        accounts = RedditAccounts.objects.filter(user_id=user.id)
-        if accounts:
-            for item in accounts:
-                item.delete()
-
-    # Do nothing if no accounts exist.
-    except RedditAccounts.DoesNotExist or UnboundLocalError:
-        pass
+    accounts = list(RedditAccounts.objects.filter(
+        user_id=user.id).values_list('id', 'reddit_token'))
+    account_ids = [account_id for account_id, token in accounts]
 
-    # Delete Scheduler Output.
-    try:
-        scheduler_output = SchedulerOutput.objects.filter(user_id=user.id)
-        if scheduler_output:
-            for item in scheduler_output:
-                item.delete()
+    # Delete exclusions, exclusion rules, Reddit accounts, scheduler output,
+    # run summaries and unfinished run checkpoints, one query each.
+    ExcludedItems.objects.filter(user_id=user.id).delete()
+    ExclusionRule.objects.filter(user_id=user.id).delete()
+    RedditAccounts.objects.filter(user_id=user.id).delete()
+    SchedulerOutput.objects.filter(user_id=user.id).delete()
+    ShredRun.objects.filter(user_id=user.id).delete()
+    ShredCheckpoint.objects.filter(account_id__in=account_ids).delete()
 
-    # Do nothing if no output exists.
-    except SchedulerOutput.DoesNotExist or UnboundLocalError:
-        pass
+    # Delete the archived records and the cached history and access tokens.
+    archive.remove(user.id)
+    history_snapshot.forget(account_ids)
+    forget_tokens(token for account_id, token in accounts)
 
     # Delete profile
     user.profile.delete()
@@ -627,3 +1051,29 @@ def delete_account(request):
 
     messages.success(request, "Your account has been successfully deleted.")
     return redirect('login')
+
+
+@exception(logger)
+def metrics(request):
+    """
+    Serves the shredder's metrics in the Prometheus text format, to staff and
+    to requests bearing METRICS_TOKEN (i.e. the Prometheus server.)
+
+    :param request: The HTTP request.
+    :return: The metrics as text/plain.
+    """
+    assert isinstance(request, HttpRequest)
+
+    bearer = request.META.get('HTTP_AUTHORIZATION', '')
+    authorized = METRICS_TOKEN and hmac.compare_digest(
+        bearer.encode('utf-8'), 'Bearer {}'.format(METRICS_TOKEN).encode(
+            'utf-8'))
+
+    if not request.user.is_staff and not authorized:
+        return HttpResponse(status=404)
+
+    # Include whatever this process recorded since its last dump.
+    dump()
+
+    return HttpResponse(render_text(load_totals()),
+                        content_type='text/plain; version=0.0.4')